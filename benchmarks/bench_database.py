@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Database and ReferralSystem benchmark at production scale
+
+Builds synthetic SQLite databases in a temporary directory and times every
+Database and ReferralSystem method against each of them. The referral graph
+is skewed the way real campaigns are: most referrers bring in a handful of
+users, while a few early users bring in thousands. A share of referred users
+have since left the channel.
+
+    python benchmarks/bench_database.py                           # 10k users
+    python benchmarks/bench_database.py --sizes 10k,1m,10m --output report.json
+
+The report is JSON: one entry per size, containing generation stats and
+mean/p50/p95/max microseconds per method. Compare reports across schema and
+index changes with the same --seed.
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.export import BulkImporter, FORMATS, write_table
+from telegramreferralpro.dedup import WINDOW_BITS
+from telegramreferralpro.referral_system import ReferralSystem
+from telegramreferralpro.rollups import DailyRollup, MAX_REPORT_DAYS
+
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+CHUNK_SIZE = 100_000
+
+REFERRED_SHARE = 0.6      # users who arrived through a referral link
+CHURN_SHARE = 0.15        # referred users who later left the channel
+MEMBER_SHARE = 0.7        # non-referred users who are channel members
+REWARD_SHARE = 0.05       # users who already claimed their reward
+INVITE_LINK_SHARE = 0.3   # users who generated a personal invite link
+FANOUT_SKEW = 4           # higher = more referrals concentrated on early users
+
+def parse_size(text: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000"""
+    text = text.strip().lower()
+    if text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+def referral_code(user_id: int) -> str:
+    return f"ref_{user_id:012x}"
+
+def generate_database(path: str, users: int, seed: int) -> dict:
+    """Create the schema through Database and bulk-load a synthetic population"""
+    rng = random.Random(seed)
+    Database(path)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    referrals = 0
+    for chunk_start in range(1, users + 1, CHUNK_SIZE):
+        user_rows = []
+        referral_rows = []
+        link_rows = []
+        for user_id in range(chunk_start, min(chunk_start + CHUNK_SIZE, users + 1)):
+            referred_by = None
+            is_member = rng.random() < MEMBER_SHARE
+            if user_id > 1 and rng.random() < REFERRED_SHARE:
+                # Early users are far more likely to be picked as the referrer
+                referred_by = 1 + int((user_id - 1) * rng.random() ** FANOUT_SKEW)
+                active = rng.random() >= CHURN_SHARE
+                is_member = active
+                referral_rows.append((referred_by, user_id, active))
+            user_rows.append((
+                user_id, f"user{user_id}", f"User {user_id}", None, referral_code(user_id),
+                referred_by, is_member, rng.random() < REWARD_SHARE
+            ))
+            if rng.random() < INVITE_LINK_SHARE:
+                link_rows.append((user_id, referral_code(user_id), f"https://t.me/+bench{user_id:x}",
+                                  f"Referral-{referral_code(user_id)}"))
+        conn.executemany('''
+            INSERT INTO users (user_id, username, first_name, last_name, referral_code, referred_by,
+                               is_channel_member, reward_claimed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', user_rows)
+        conn.executemany('INSERT INTO referrals (referrer_id, referred_user_id, is_active) VALUES (?, ?, ?)',
+                         referral_rows)
+        conn.executemany('''
+            INSERT INTO invite_links (user_id, referral_code, invite_link, invite_link_name)
+            VALUES (?, ?, ?, ?)
+        ''', link_rows)
+        conn.commit()
+        referrals += len(referral_rows)
+    # The bulk load bypasses the stats row; unverified, it is recounted below without a drift warning
+    conn.execute('UPDATE stats SET verified_at = NULL WHERE id = 1')
+    conn.commit()
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+    load_seconds = time.perf_counter() - started
+    counter_started = time.perf_counter()
+    database = Database(path)
+    database.rebuild_referral_counters()
+    database.verify_stats()
+    return {
+        'users': users,
+        'referrals': referrals,
+        'load_seconds': round(load_seconds, 2),
+        'counter_rebuild_seconds': round(time.perf_counter() - counter_started, 2),
+        'file_bytes': os.path.getsize(path),
+    }
+
+def time_calls(func, arguments: list) -> dict:
+    """Call func once per argument tuple and summarise the latencies in microseconds"""
+    samples = []
+    for args in arguments:
+        started = time.perf_counter_ns()
+        func(*args)
+        samples.append((time.perf_counter_ns() - started) / 1000)
+    samples.sort()
+    return {
+        'calls': len(samples),
+        'mean_us': round(statistics.fmean(samples), 1),
+        'p50_us': round(samples[len(samples) // 2], 1),
+        'p95_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+        'max_us': round(samples[-1], 1),
+    }
+
+def run_benchmarks(path: str, users: int, iterations: int, seed: int) -> dict:
+    """Time every Database and ReferralSystem method, and the rollup paths, against a generated database"""
+    rng = random.Random(seed + 1)
+    db = Database(path)
+    referral_system = ReferralSystem(db)
+
+    def existing(count=iterations):
+        return [rng.randint(1, users) for _ in range(count)]
+
+    # Heavy referrers are where per-user aggregates used to hurt, so sample them too
+    heavy = [rng.randint(1, max(1, users // 1000)) for _ in range(iterations)]
+    # IDs above the generated range behave like brand-new users
+    new_ids = iter(range(users + 1, users + 10 * iterations + 10))
+
+    results = {}
+
+    # Reads
+    results['Database.get_user'] = time_calls(db.get_user, [(u,) for u in existing()])
+    results['Database.get_user_by_referral_code'] = time_calls(
+        db.get_user_by_referral_code, [(referral_code(u),) for u in existing()])
+    results['Database.get_referral_stats'] = time_calls(db.get_referral_stats, [(u,) for u in existing()])
+    results['Database.get_referral_stats[heavy]'] = time_calls(db.get_referral_stats, [(u,) for u in heavy])
+    results['Database.get_invite_link'] = time_calls(db.get_invite_link, [(u,) for u in existing()])
+    results['Database.get_referrer_by_invite_link_name'] = time_calls(
+        db.get_referrer_by_invite_link_name, [(f"Referral-{referral_code(u)}",) for u in existing()])
+    aggregate_iterations = max(3, iterations // 20)
+    results['Database.get_all_users_count'] = time_calls(db.get_all_users_count, [()] * aggregate_iterations)
+    results['Database.get_channel_members_count'] = time_calls(
+        db.get_channel_members_count, [()] * aggregate_iterations)
+    results['Database.get_active_referrals_count'] = time_calls(
+        db.get_active_referrals_count, [()] * aggregate_iterations)
+    results['Database.get_rewards_claimed_count'] = time_calls(
+        db.get_rewards_claimed_count, [()] * aggregate_iterations)
+    results['Database.get_stats'] = time_calls(db.get_stats, [()] * iterations)
+    results['ReferralSystem.generate_referral_code'] = time_calls(
+        referral_system.generate_referral_code, [(u,) for u in existing()])
+    results['ReferralSystem.check_referral_target_reached'] = time_calls(
+        referral_system.check_referral_target_reached, [(u, 5) for u in existing()])
+    results['ReferralSystem.get_referral_progress'] = time_calls(
+        referral_system.get_referral_progress, [(u, 5) for u in existing()])
+
+    # Writes
+    fresh = [next(new_ids) for _ in range(iterations)]
+    results['Database.add_user'] = time_calls(
+        db.add_user, [(u, f"user{u}", f"User {u}", None, referral_code(u)) for u in fresh])
+    results['Database.add_referral'] = time_calls(
+        db.add_referral, [(r, u) for r, u in zip(heavy, fresh)])
+    results['Database.update_channel_membership'] = time_calls(
+        db.update_channel_membership, [(u, bool(i % 2)) for i, u in enumerate(existing())])
+    now = int(time.time())
+    results['Database.record_membership_change'] = time_calls(
+        db.record_membership_change, [(u, bool(i % 2), now + i) for i, u in enumerate(existing())])
+    results['Database.mark_channel_joined'] = time_calls(db.mark_channel_joined, [(u, now) for u in existing()])
+    results['Database.deactivate_referral'] = time_calls(
+        db.deactivate_referral, [(r, u) for r, u in zip(heavy, fresh)])
+    results['Database.mark_reward_claimed'] = time_calls(db.mark_reward_claimed, [(u,) for u in existing()])
+    results['Database.log_channel_event'] = time_calls(db.log_channel_event, [(u, 'joined') for u in existing()])
+    results['Database.store_invite_link'] = time_calls(
+        db.store_invite_link,
+        [(u, referral_code(u), f"https://t.me/+new{u:x}", f"Referral-{referral_code(u)}") for u in fresh])
+    referred = [next(new_ids) for _ in range(iterations)]
+    results['ReferralSystem.process_referral'] = time_calls(
+        referral_system.process_referral, [(referral_code(r), u) for r, u in zip(heavy, referred)])
+    results['ReferralSystem.handle_user_joined_channel'] = time_calls(
+        referral_system.handle_user_joined_channel, [(u,) for u in referred])
+    results['ReferralSystem.handle_user_left_channel'] = time_calls(
+        referral_system.handle_user_left_channel, [(u,) for u in referred])
+    bitmap = bytes(WINDOW_BITS // 8)
+    results['Database.save_update_window'] = time_calls(
+        db.save_update_window, [('bot', 1000 + i, bitmap, 1000 + i + WINDOW_BITS // 2) for i in range(iterations)])
+    results['Database.get_update_window'] = time_calls(db.get_update_window, [('bot',)] * iterations)
+    # The first compaction folds the events written above, the later ones find nothing new
+    rollup = DailyRollup(db)
+    results['DailyRollup.compact'] = time_calls(rollup.compact, [()] * 3)
+    results['DailyRollup.days'] = time_calls(rollup.days, [(14,)] * aggregate_iterations)
+    results[f'DailyRollup.days[{MAX_REPORT_DAYS}]'] = time_calls(rollup.days, [(MAX_REPORT_DAYS,)] * aggregate_iterations)
+    for fmt in FORMATS:
+        results[f'export.write_table[users,{fmt}]'] = time_calls(
+            lambda: write_table(db, 'users', io.BytesIO(), fmt), [()])
+    imported = [next(new_ids) for _ in range(iterations)]
+    results['BulkImporter.import_rows[users]'] = time_calls(
+        lambda: BulkImporter(db, 'users').import_rows(
+            ['user_id', 'username', 'first_name'], [[u, f"user{u}", f"User {u}"] for u in imported]), [()])
+    results['Database.rebuild_referral_counters'] = time_calls(db.rebuild_referral_counters, [()])
+    results['Database.verify_stats'] = time_calls(db.verify_stats, [()] * 3)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10k', help="Comma-separated user counts, e.g. 10k,1m,10m")
+    parser.add_argument('--iterations', type=int, default=500, help="Calls per method")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--tmp-dir', help="Where to create the temporary databases")
+    args = parser.parse_args()
+
+    # Keep Database's INFO lines out of the report output
+    logging.basicConfig(level=logging.WARNING)
+
+    report = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'seed': args.seed,
+        'iterations': args.iterations,
+        'runs': [],
+    }
+    for size_text in args.sizes.split(','):
+        users = parse_size(size_text)
+        with tempfile.TemporaryDirectory(dir=args.tmp_dir, prefix='bench_db_') as tmp_dir:
+            path = os.path.join(tmp_dir, 'bench.db')
+            print(f"Generating {users} users...", file=sys.stderr)
+            generation = generate_database(path, users, args.seed)
+            print(f"Benchmarking {users} users...", file=sys.stderr)
+            methods = run_benchmarks(path, users, args.iterations, args.seed)
+        report['runs'].append({'size': size_text, 'generation': generation, 'methods': methods})
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
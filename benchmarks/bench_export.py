@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Throughput of the bulk importer and the streaming export (telegramreferralpro/export.py)
+
+Writes --users users (as another referral tool might hand them over: no
+referral codes, most of them referred by an earlier user) and their
+referrals to gzip CSV files, imports both into an empty database, then
+exports every table again as gzip CSV and JSONL.
+
+    python benchmarks/bench_export.py --users 500000
+    python benchmarks/bench_export.py --users 200000 --shards 4 --batch-size 20000
+
+Reports rows/s for each step, the file sizes, and the peak Python memory of
+a second, untimed export (tracemalloc), which should not grow with --users.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.export import FORMATS, export_database, import_file
+from telegramreferralpro.sharding import ShardedDatabase
+
+def write_source_files(directory: str, users: int, seed: int) -> dict:
+    """users.csv.gz and referrals.csv.gz in the shape of another tool's export"""
+    rng = random.Random(seed)
+    paths = {table: os.path.join(directory, f"{table}.csv.gz") for table in ('users', 'referrals')}
+    with gzip.open(paths['users'], 'wt', newline='', compresslevel=1) as users_file, \
+            gzip.open(paths['referrals'], 'wt', newline='', compresslevel=1) as referrals_file:
+        users_csv = csv.writer(users_file)
+        referrals_csv = csv.writer(referrals_file)
+        users_csv.writerow(['user_id', 'username', 'first_name', 'referred_by', 'join_date', 'is_channel_member'])
+        referrals_csv.writerow(['referrer_id', 'referred_user_id', 'join_date', 'is_active'])
+        for user_id in range(1, users + 1):
+            referred_by = rng.randrange(1, user_id) if user_id > 1 and rng.random() < 0.8 else ''
+            join_date = f"2024-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d} 12:00:00"
+            member = int(rng.random() < 0.7)
+            users_csv.writerow([user_id, f"user{user_id}", f"User {user_id}", referred_by, join_date, member])
+            if referred_by:
+                referrals_csv.writerow([referred_by, user_id, join_date, member])
+    return paths
+
+def run(args, tmp_dir: str) -> dict:
+    source = write_source_files(tmp_dir, args.users, args.seed)
+    db_path = os.path.join(tmp_dir, 'bench.db')
+    database = ShardedDatabase(db_path, args.shards) if args.shards > 1 else Database(db_path)
+    database.enable_wal()
+
+    report = {'users': args.users, 'shards': args.shards, 'batch_size': args.batch_size, 'import': {}, 'export': {}}
+    for table, path in source.items():
+        result = import_file(database, path, table, batch_size=args.batch_size)
+        report['import'][table] = {key: result[key] for key in ('imported', 'skipped', 'rows_per_second', 'seconds')}
+
+    for fmt in FORMATS:
+        started = time.perf_counter()
+        result = export_database(database, os.path.join(tmp_dir, fmt), fmt)
+        seconds = time.perf_counter() - started
+        # Traced separately: tracemalloc slows the export down several times
+        tracemalloc.start()
+        export_database(database, os.path.join(tmp_dir, f"{fmt}_traced"), fmt)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows = sum(table['rows'] for table in result.values())
+        report['export'][fmt] = {
+            'rows': rows,
+            'rows_per_second': round(rows / seconds),
+            'seconds': round(seconds, 3),
+            'megabytes': round(sum(os.path.getsize(table['path']) for table in result.values()) / 1e6, 1),
+            'peak_memory_mb': round(peak / 1e6, 1),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix='bench_export_') as tmp_dir:
+        report = run(args, tmp_dir)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark and accuracy check for LanguageDetector.detect_from_text
+
+Compares the precompiled single-pass matcher against the previous
+per-call substring scan on the corpus in data/language_corpus.tsv.
+
+    python benchmarks/bench_language_detection.py [--iterations N] [--min-accuracy 0.9]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegramreferralpro.languages import LanguageDetector, TEXT_PATTERNS, SupportedLanguage
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'language_corpus.tsv')
+
+def load_corpus(path: str = CORPUS_PATH) -> list:
+    """Load (expected_language, text) pairs"""
+    corpus = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            expected, text = line.split('\t', 1)
+            corpus.append((expected, text))
+    return corpus
+
+def legacy_detect_from_text(text: str) -> str:
+    """The substring scan used before the compiled matcher, kept as a baseline"""
+    if not text:
+        return SupportedLanguage.ENGLISH.value
+    text_lower = text.lower()
+    patterns = {lang: list(words) for lang, words in TEXT_PATTERNS.items()}
+    scores = {}
+    for lang, words in patterns.items():
+        score = sum(1 for word in words if word in text_lower)
+        if score > 0:
+            scores[lang] = score
+    if scores:
+        return max(scores.items(), key=lambda x: x[1])[0]
+    return SupportedLanguage.ENGLISH.value
+
+def measure(detect, corpus: list, iterations: int) -> dict:
+    """Time the detector over the corpus and score its accuracy"""
+    correct = sum(1 for expected, text in corpus if detect(text) == expected)
+    texts = [text for _, text in corpus]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            detect(text)
+    elapsed = time.perf_counter() - started
+    calls = iterations * len(texts)
+    return {
+        'accuracy': round(correct / len(corpus), 4),
+        'correct': correct,
+        'calls': calls,
+        'us_per_call': round(elapsed / calls * 1e6, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--min-accuracy', type=float, default=0.9,
+                        help="Exit with status 1 if the compiled matcher scores below this")
+    parser.add_argument('--show-misses', action='store_true')
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    report = {
+        'corpus_size': len(corpus),
+        'compiled': measure(LanguageDetector.detect_from_text, corpus, args.iterations),
+        'legacy': measure(legacy_detect_from_text, corpus, args.iterations),
+    }
+    report['speedup'] = round(report['legacy']['us_per_call'] / report['compiled']['us_per_call'], 2)
+    print(json.dumps(report, indent=2))
+
+    if args.show_misses:
+        for expected, text in corpus:
+            detected = LanguageDetector.detect_from_text(text)
+            if detected != expected:
+                print(f"expected={expected} detected={detected} text={text!r}")
+
+    if report['compiled']['accuracy'] < args.min_accuracy:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Memory per bot when many bots share one process (telegramreferralpro/multitenant.py)
+
+Builds and starts a TenantHost with --tenants bots against a shared fake Bot
+API (see fake_bot.py), then runs a short workload through every tenant to
+check that their databases stay isolated. Resident memory is sampled after
+the first tenant (roughly what every separate main.py process costs) and
+after all of them.
+
+    python benchmarks/bench_multitenant.py --tenants 20 --updates 200
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegramreferralpro.config import BotConfig
+from telegramreferralpro.main import open_database
+from telegramreferralpro.multitenant import TenantHost
+from fake_bot import FakeBotAPI
+from loadgen import CHANNEL_ID, WorkloadRunner, generate_workload
+
+def rss_mb() -> float:
+    """Current resident set size (peak size where /proc is unavailable)"""
+    gc.collect()
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def tenant_config(index: int, tmp_dir: str) -> BotConfig:
+    return BotConfig(
+        bot_token=f"{100000 + index}:BENCHMARK",
+        channel_id=CHANNEL_ID,
+        channel_username=f"bench_channel_{index}",
+        admin_user_ids=[],
+        database_path=os.path.join(tmp_dir, f"tenant_{index}.db"),
+        throttle_burst=1000,
+    )
+
+async def run(args, tmp_dir: str) -> dict:
+    fake_api = FakeBotAPI(CHANNEL_ID, seed=args.seed)
+    configs = [tenant_config(index, tmp_dir) for index in range(args.tenants)]
+    baseline = rss_mb()
+
+    first = TenantHost(configs[:1], request=fake_api, get_updates_request=fake_api)
+    await first.start(polling=False)
+    one_tenant = rss_mb()
+    await first.stop()
+
+    host = TenantHost(configs, request=fake_api, get_updates_request=fake_api)
+    await host.start(polling=False)
+    all_tenants = rss_mb()
+
+    # Same seed for every tenant: identical user IDs must still land in separate databases
+    steps = generate_workload(args.updates, args.seed)
+    expected_users = len({user_id for kind, user_id, _ in steps if kind in ('start', 'start_referral')})
+    started = time.perf_counter()
+    user_counts = []
+    for config, application in zip(configs, host.applications):
+        database = open_database(config)
+        runner = WorkloadRunner(application, fake_api, database)
+        for step in steps:
+            await runner.process(*step)
+        user_counts.append(database.get_all_users_count())
+    elapsed = time.perf_counter() - started
+    after_workload = rss_mb()
+    await host.stop()
+
+    return {
+        'tenants': args.tenants,
+        'rss_mb': {
+            'before_tenants': round(baseline, 1),
+            'one_tenant': round(one_tenant, 1),
+            'all_tenants': round(all_tenants, 1),
+            'after_workload': round(after_workload, 1),
+        },
+        'mb_per_extra_tenant': round((all_tenants - one_tenant) / max(1, args.tenants - 1), 2),
+        'mb_per_extra_tenant_after_workload': round((after_workload - one_tenant) / max(1, args.tenants - 1), 2),
+        'updates': args.updates * args.tenants,
+        'updates_per_second': round(args.updates * args.tenants / elapsed, 1),
+        'isolated': all(count == expected_users for count in user_counts),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--updates', type=int, default=200, help="Updates run through each tenant")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix='bench_multitenant_') as tmp_dir:
+        report = asyncio.run(run(args, tmp_dir))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
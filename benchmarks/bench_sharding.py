@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Concurrent write throughput of ShardedDatabase at different shard counts
+
+Writer threads sign up new users the way /start with a referral link and a
+channel join do: add_user, add_referral and update_channel_membership, each
+its own transaction. On one file all of those writes serialize on the
+database lock; with K shards, writes for users on different shards proceed
+in parallel. sqlite3 releases the GIL while a statement runs and while it
+waits for a lock, so threads are enough to load the files concurrently.
+
+    python benchmarks/bench_sharding.py --shards 1,4,16 --threads 16 --signups 500
+
+Reports signups/s and write latency percentiles per shard count, plus the
+writes that failed (e.g. "database is locked" after the busy timeout).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegramreferralpro.sharding import ShardedDatabase
+from fake_bot import percentiles
+
+SEED_USERS = 1000
+FIRST_NEW_USER = 1_000_000
+
+def seed(database: ShardedDatabase, users: int) -> None:
+    """Existing users that new signups are referred by"""
+    for user_id in range(1, users + 1):
+        database.add_user(user_id, f"user{user_id}", f"User {user_id}", None, f"ref_seed_{user_id}")
+
+def writer(database: ShardedDatabase, user_ids: range, seed_value: int, latencies: list, failures: list) -> None:
+    rng = random.Random(seed_value)
+    for user_id in user_ids:
+        referrer_id = rng.randint(1, SEED_USERS)
+        started = time.perf_counter()
+        ok = database.add_user(user_id, f"user{user_id}", f"User {user_id}", None, f"ref_new_{user_id}", referrer_id)
+        ok = database.add_referral(referrer_id, user_id) and ok
+        ok = database.update_channel_membership(user_id, True) and ok
+        latencies.append(time.perf_counter() - started)
+        if not ok:
+            failures.append(user_id)
+
+def run(shards: int, args, tmp_dir: str) -> dict:
+    database = ShardedDatabase(os.path.join(tmp_dir, f"bench_{shards}.db"), shards)
+    if args.journal == 'wal':
+        database.enable_wal()
+    seed(database, SEED_USERS)
+
+    latencies, failures, threads = [], [], []
+    for index in range(args.threads):
+        first = FIRST_NEW_USER + index * args.signups
+        threads.append(threading.Thread(
+            target=writer, args=(database, range(first, first + args.signups), args.seed + index, latencies, failures)))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    signups = args.threads * args.signups
+    active, total = 0, 0
+    for referrer_id in range(1, SEED_USERS + 1):
+        referrer_active, referrer_total = database.get_referral_stats(referrer_id)
+        active += referrer_active
+        total += referrer_total
+    return {
+        'shards': shards,
+        'signups': signups,
+        'elapsed_seconds': round(elapsed, 3),
+        'signups_per_second': round(signups / elapsed, 1),
+        'writes_per_second': round(3 * signups / elapsed, 1),
+        'signup_latency': percentiles(latencies),
+        'failed_signups': len(failures),
+        # Every successful signup must be counted exactly once across the shards
+        'referrals_counted': total,
+        'active_referrals_counted': active,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='1,4,16', help="Comma-separated shard counts")
+    parser.add_argument('--threads', type=int, default=16, help="Concurrent writers")
+    parser.add_argument('--signups', type=int, default=300, help="Signups per writer")
+    parser.add_argument('--journal', choices=['wal', 'delete'], default='wal')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tmp-dir', help="Where to create the shard files")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    runs = []
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir, prefix='bench_sharding_') as tmp_dir:
+        for shards in [int(count) for count in args.shards.split(',')]:
+            print(f"Running {shards} shards...", file=sys.stderr)
+            runs.append(run(shards, args, tmp_dir))
+    for result in runs:
+        result['speedup'] = round(result['signups_per_second'] / runs[0]['signups_per_second'], 2)
+
+    report = {'cpus': os.cpu_count(), 'threads': args.threads, 'journal': args.journal, 'seed': args.seed,
+              'runs': runs}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the bot entry point
+
+Each run is a fresh interpreter that measures:
+
+- import_ms: importing telegramreferralpro.main, split into library_import_ms
+  (python-telegram-bot and its dependencies) and package_import_ms (our modules)
+- build_new_db_ms: build_application() against a new database (schema creation)
+- build_existing_db_ms: build_application() again on the same database (a restart)
+- initialize_ms: Application.initialize() against the fake Bot API
+
+    python benchmarks/bench_startup.py [--runs 15] [--cold-bytecode] [--importtime]
+
+--cold-bytecode points PYTHONPYCACHEPREFIX at an empty directory, so every
+module is compiled from source. This is what happens on a deploy that does not
+precompile. --importtime lists the package's slowest imports.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = r'''
+import json, os, sys, tempfile, time
+started = time.perf_counter()
+import telegram.ext, telegram.request
+library_imported = time.perf_counter()
+from telegramreferralpro import main as entry
+imported = time.perf_counter()
+
+import asyncio, logging
+logging.disable(logging.CRITICAL)
+sys.path.insert(0, sys.argv[1])
+from fake_bot import FakeBotAPI
+from loadgen import CHANNEL_ID, make_config
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    config = make_config(os.path.join(tmp_dir, 'startup.db'), 5)
+    build_started = time.perf_counter()
+    entry.build_application(config, request=FakeBotAPI(CHANNEL_ID), get_updates_request=FakeBotAPI(CHANNEL_ID))
+    build_new = time.perf_counter() - build_started
+
+    build_started = time.perf_counter()
+    fake_api = FakeBotAPI(CHANNEL_ID)
+    application = entry.build_application(config, request=fake_api, get_updates_request=fake_api)
+    build_existing = time.perf_counter() - build_started
+
+    init_started = time.perf_counter()
+    asyncio.run(application.initialize())
+    initialize = time.perf_counter() - init_started
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'library_import_ms': (library_imported - started) * 1000,
+    'package_import_ms': (imported - library_imported) * 1000,
+    'build_new_db_ms': build_new * 1000,
+    'build_existing_db_ms': build_existing * 1000,
+    'initialize_ms': initialize * 1000,
+}))
+'''
+
+def run_probe(cold_bytecode: bool) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory(prefix='pycache_') as cache_dir:
+        if cold_bytecode:
+            env['PYTHONPYCACHEPREFIX'] = cache_dir
+        output = subprocess.run([sys.executable, '-c', PROBE, BENCH_DIR], env=env, cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def import_profile(limit: int) -> list:
+    """Slowest package imports (cumulative microseconds) from python -X importtime"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import telegramreferralpro.main'],
+                            env=env, cwd=ROOT, capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        if cumulative.strip().isdigit() and (name.startswith('telegram') or name in ('dotenv', 'asyncio')):
+            rows.append({'module': name, 'cumulative_us': int(cumulative)})
+    rows.sort(key=lambda row: row['cumulative_us'], reverse=True)
+    return rows[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--cold-bytecode', action='store_true', help="Compile every module from source")
+    parser.add_argument('--importtime', action='store_true', help="Include the slowest imports")
+    args = parser.parse_args()
+
+    samples = [run_probe(args.cold_bytecode) for _ in range(args.runs)]
+    report = {'runs': args.runs, 'cold_bytecode': args.cold_bytecode}
+    for key in samples[0]:
+        values = [sample[key] for sample in samples]
+        report[key] = {'median': round(statistics.median(values), 2), 'min': round(min(values), 2)}
+    if args.importtime:
+        report['slowest_imports'] = import_profile(15)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
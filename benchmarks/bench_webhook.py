@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+HTTP load test of webhook ingestion (telegramreferralpro/webhook.py)
+
+Starts WebhookServer with an UpdateIngestor on localhost, in front of an
+Application talking to the fake Bot API (see fake_bot.py), and POSTs the
+load generator's workload over --connections keep-alive connections, like
+Telegram does. A share of the updates is sent twice (--duplicate-rate) to
+check that redeliveries are dropped.
+
+    python benchmarks/bench_webhook.py --updates 5000 --connections 40 --latency-ms 20
+    python benchmarks/bench_webhook.py --queue-size 200 --spill     # overflow into SQLite
+
+Reports how fast updates were acknowledged (acks/s and ack latency, what
+Telegram waits on) separately from how fast they were processed end to end
+(updates/s until every accepted update went through the handlers).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.main import build_application
+from telegramreferralpro.webhook import UpdateIngestor, WebhookServer
+from bench_workers import build_updates, seed_referrers
+from fake_bot import FakeBotAPI, percentiles
+from loadgen import CHANNEL_ID, generate_workload, make_config
+
+URL_PATH = 'bench'
+
+async def client(port: int, bodies: list, latencies: list, statuses: dict) -> None:
+    """Send bodies one after another on a single keep-alive connection"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while bodies:
+            body = bodies.pop()
+            started = time.perf_counter()
+            writer.write(
+                f"POST /{URL_PATH} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            response = await reader.readuntil(b'\r\n\r\n')
+            latencies.append(time.perf_counter() - started)
+            status = response.split(b' ', 2)[1].decode()
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+def request_bodies(updates: list, duplicate_rate: float, seed: int) -> list:
+    """Encoded updates in send order (popped from the end), with some sent a second time"""
+    rng = random.Random(seed)
+    bodies = []
+    for update in updates:
+        body = json.dumps(update).encode()
+        bodies.append(body)
+        if rng.random() < duplicate_rate:
+            bodies.append(body)
+    bodies.reverse()
+    return bodies
+
+async def run(args, tmp_dir: str) -> dict:
+    steps = generate_workload(args.updates, args.seed)
+    updates = build_updates(steps)
+    config = make_config(os.path.join(tmp_dir, 'webhook.db'), 1000)
+    seed_referrers(Database(config.database_path), steps)
+
+    fake_api = FakeBotAPI(CHANNEL_ID, seed=args.seed, latency_ms=args.latency_ms)
+    fake_api.members = {user_id for kind, user_id, _ in steps if kind == 'join'}
+    application = build_application(config, request=fake_api, get_updates_request=fake_api)
+    await application.initialize()
+    spill_path = os.path.join(tmp_dir, 'spill.db') if args.spill else None
+    ingestor = UpdateIngestor(application, args.queue_size, args.concurrency, spill_path)
+    server = WebhookServer(ingestor.offer, 0, host='127.0.0.1', url_path=URL_PATH)
+    await ingestor.start()
+    await server.start()
+    port = server._server.sockets[0].getsockname()[1]
+
+    bodies = request_bodies(updates, args.duplicate_rate, args.seed)
+    requests = len(bodies)
+    latencies, statuses = [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*(client(port, bodies, latencies, statuses) for _ in range(args.connections)))
+    acked = time.perf_counter() - started
+    await ingestor.drain()
+    processed = time.perf_counter() - started
+
+    await server.stop()
+    stats = ingestor.stats()
+    await ingestor.stop()
+    await application.shutdown()
+    return {
+        'updates': len(updates),
+        'requests': requests,
+        'connections': args.connections,
+        'concurrency': args.concurrency,
+        'queue_size': args.queue_size,
+        'spill': args.spill,
+        'latency_ms': args.latency_ms,
+        'responses': statuses,
+        'acks_per_second': round(requests / acked, 1),
+        'ack_latency': percentiles(latencies),
+        'processing_seconds': round(processed, 3),
+        'updates_per_second': round(stats['processed'] / processed, 1),
+        'ingestor': stats,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--connections', type=int, default=40, help="Concurrent keep-alive connections")
+    parser.add_argument('--concurrency', type=int, default=8, help="Processing lanes")
+    parser.add_argument('--queue-size', type=int, default=10000, help="Updates held in memory")
+    parser.add_argument('--spill', action='store_true', help="Spill overflow to SQLite instead of answering 503")
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help="Share of updates delivered twice")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Simulated Bot API latency")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix='bench_webhook_') as tmp_dir:
+        report = asyncio.run(run(args, tmp_dir))
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
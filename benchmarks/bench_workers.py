@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Throughput of the multi-process worker mode (telegramreferralpro/workers.py)
+
+Runs the load generator's workload through WorkerPool with 1, 2, 4... worker
+processes sharing one WAL-mode database, each against its own fake Bot API
+(see fake_bot.py). Updates are dispatched by the same user hash the webhook
+front process uses, so per-user ordering is preserved.
+
+    python benchmarks/bench_workers.py --workers 1,2,4 --updates 5000 --latency-ms 20
+
+Reports updates/s per worker count, the speedup over one worker and how
+evenly the users were spread. With --latency-ms 0 the run is CPU bound and
+can only scale up to the number of cores; with Bot API latency, more workers
+also overlap the waiting.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.workers import WorkerPool
+from fake_bot import FakeBotAPI, UpdateFactory
+from loadgen import CHANNEL_ID, generate_workload, make_config
+
+class FakeApiFactory:
+    """Picklable request factory giving every worker its own fake Bot API"""
+
+    def __init__(self, members: set, latency_ms: float, seed: int):
+        self.members = members
+        self.latency_ms = latency_ms
+        self.seed = seed
+
+    def __call__(self, index: int) -> FakeBotAPI:
+        fake_api = FakeBotAPI(CHANNEL_ID, seed=self.seed + index, latency_ms=self.latency_ms)
+        # Workers cannot see each other's channel, so users that ever join count as members throughout
+        fake_api.members = set(self.members)
+        return fake_api
+
+def referral_code(user_id: int) -> str:
+    return f"ref_bench_{user_id}"
+
+def build_updates(steps: list) -> list:
+    """Raw update dicts, as the webhook front process receives them"""
+    factory = UpdateFactory(CHANNEL_ID)
+    updates = []
+    for kind, user_id, argument in steps:
+        if kind == 'start':
+            update = factory.command(None, user_id, 'start', language_code=argument)
+        elif kind == 'start_referral':
+            update = factory.command(None, user_id, 'start', referral_code(argument))
+        elif kind in ('status', 'claim'):
+            update = factory.command(None, user_id, kind)
+        elif kind == 'callback':
+            update = factory.callback(None, user_id, argument)
+        else:
+            update = factory.chat_member(None, user_id, joined=kind == 'join')
+        updates.append(json.loads(update.to_json()))
+    return updates
+
+def seed_referrers(database: Database, steps: list) -> None:
+    """Register referrers up front; their /start may land on another worker after the referral"""
+    for user_id in sorted({argument for kind, _, argument in steps if kind == 'start_referral'}):
+        database.add_user(user_id, f"user{user_id}", f"User {user_id}", None, referral_code(user_id))
+
+def run(workers: int, steps: list, updates: list, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix='bench_workers_') as tmp_dir:
+        config = make_config(os.path.join(tmp_dir, 'workers.db'), 1000)
+        database = Database(config.database_path)
+        database.enable_wal()
+        seed_referrers(database, steps)
+
+        members = {user_id for kind, user_id, _ in steps if kind == 'join'}
+        pool = WorkerPool(config, workers, request_factory=FakeApiFactory(members, args.latency_ms, args.seed),
+                          configure_logging=False)
+        pool.start()
+        try:
+            started = time.perf_counter()
+            for update in updates:
+                while not pool.dispatch(update):
+                    time.sleep(0.001)
+            while sum(pool.processed()) < len(updates):
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            per_worker = pool.processed()
+        finally:
+            pool.stop()
+    return {
+        'workers': workers,
+        'updates': len(updates),
+        'elapsed_seconds': round(elapsed, 3),
+        'updates_per_second': round(len(updates) / elapsed, 1),
+        'updates_per_worker': per_worker,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help="Comma-separated worker counts")
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Simulated Bot API latency")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    steps = generate_workload(args.updates, args.seed)
+    updates = build_updates(steps)
+    runs = []
+    for workers in [int(count) for count in args.workers.split(',')]:
+        print(f"Running {workers} workers...", file=sys.stderr)
+        runs.append(run(workers, steps, updates, args))
+    for result in runs:
+        result['speedup'] = round(result['updates_per_second'] / runs[0]['updates_per_second'], 2)
+
+    report = {'cpus': os.cpu_count(), 'latency_ms': args.latency_ms, 'seed': args.seed, 'runs': runs}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
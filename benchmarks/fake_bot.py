@@ -0,0 +1,194 @@
+"""
+Offline stand-in for the Telegram Bot API, used by the load generator and log replayer
+
+FakeBotAPI replaces the HTTP layer of telegram.Bot, so every handler runs
+unchanged against it. Requests are still serialized by python-telegram-bot and
+answers are parsed into real telegram objects. Latency and flood-control (429)
+responses are drawn from a seeded RNG. UpdateFactory builds the updates Telegram
+would send for commands, button taps and channel joins/leaves.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_ID = 1000000
+BOT_USERNAME = 'bench_referral_bot'
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+class FakeBotAPI(BaseRequest):
+    """BaseRequest that answers Bot API calls locally with simulated latency and 429s"""
+
+    def __init__(self, channel_id: str, seed: int = 0, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 rate_limit_probability: float = 0.0, retry_after: int = 1):
+        self.channel_id = int(channel_id)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._message_ids = 0
+        self._invite_links = 0
+        # Users the fake channel currently counts as members; the workload keeps it in sync
+        self.members: Set[int] = set()
+        # Calls are attributed to whatever update type is being processed
+        self.current_label = 'startup'
+        self.calls: Dict[str, Counter] = defaultdict(Counter)
+        self.rate_limited: Counter = Counter()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[self.current_label][api_method] += 1
+
+        # Draw both values on every call so the RNG sequence does not depend on the settings
+        delay = max(0.0, self.latency_ms + self._rng.gauss(0.0, 1.0) * self.jitter_ms) / 1000
+        limited = self._rng.random() < self.rate_limit_probability
+        if delay:
+            await asyncio.sleep(delay)
+        if limited and api_method != 'getMe':
+            self.rate_limited[self.current_label] += 1
+            return 429, json.dumps({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }).encode()
+        return 200, json.dumps({'ok': True, 'result': self._result(api_method, parameters)}).encode()
+
+    def _message(self, parameters: dict) -> dict:
+        self._message_ids += 1
+        chat_id = parameters.get('chat_id', 0)
+        return {
+            'message_id': parameters.get('message_id', self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if int(chat_id) > 0 else 'channel'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': BOT_USERNAME},
+            'text': parameters.get('text', ''),
+        }
+
+    def _result(self, api_method: str, parameters: dict):
+        if api_method == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': BOT_USERNAME,
+                    'can_join_groups': True, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if api_method in ('sendMessage', 'editMessageText'):
+            return self._message(parameters)
+        if api_method == 'getChatMember':
+            user_id = int(parameters['user_id'])
+            status = 'member' if user_id in self.members else 'left'
+            return {'status': status, 'user': {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}}
+        if api_method == 'createChatInviteLink':
+            self._invite_links += 1
+            return {'invite_link': f"https://t.me/+fake{self._invite_links:08d}",
+                    'creator': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench'},
+                    'creates_join_request': False, 'is_primary': False, 'is_revoked': False,
+                    'name': parameters.get('name')}
+        if api_method == 'getChat':
+            return {'id': int(parameters.get('chat_id', self.channel_id)), 'type': 'channel', 'title': 'Bench',
+                    'accent_color_id': 0, 'max_reaction_count': 0}
+        if api_method == 'getChatMemberCount':
+            return len(self.members)
+        return True
+
+    def api_calls(self) -> Dict[str, Dict[str, int]]:
+        """Call counts per update type and Bot API method"""
+        return {label: dict(sorted(counter.items())) for label, counter in sorted(self.calls.items())}
+
+class UpdateFactory:
+    """Build Update objects shaped like the ones Telegram delivers"""
+
+    def __init__(self, channel_id: str):
+        self.channel_id = int(channel_id)
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self) -> Tuple[int, int]:
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int, language_code: str = 'en') -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}",
+                'username': f"user{user_id}", 'language_code': language_code}
+
+    def command(self, bot, user_id: int, command: str, payload: Optional[str] = None,
+                language_code: str = 'en') -> Update:
+        """/command [payload] sent in the user's private chat"""
+        update_id, message_id = self._next_ids()
+        text = f"/{command}" + (f" {payload}" if payload else '')
+        return Update.de_json({
+            'update_id': update_id,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': self._user(user_id, language_code),
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}],
+            },
+        }, bot)
+
+    def callback(self, bot, user_id: int, data: str, message_id: Optional[int] = None) -> Update:
+        """Inline button tap on one of the bot's messages"""
+        update_id, new_message_id = self._next_ids()
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id or new_message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': BOT_USERNAME},
+                    'text': 'status',
+                },
+            },
+        }, bot)
+
+    def chat_member(self, bot, user_id: int, joined: bool) -> Update:
+        """Channel join or leave"""
+        update_id, _ = self._next_ids()
+        user = self._user(user_id)
+        old_status, new_status = ('left', 'member') if joined else ('member', 'left')
+        return Update.de_json({
+            'update_id': update_id,
+            'chat_member': {
+                'chat': {'id': self.channel_id, 'type': 'channel', 'title': 'Bench'},
+                'from': user,
+                'date': int(time.time()),
+                'old_chat_member': {'status': old_status, 'user': user},
+                'new_chat_member': {'status': new_status, 'user': user},
+            },
+        }, bot)
+
+def percentiles(samples: list) -> dict:
+    """p50/p95/p99/max of latencies given in seconds, reported in milliseconds"""
+    if not samples:
+        return {'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 3)
+    return {'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+            'max_ms': round(ordered[-1] * 1000, 3)}
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for the bot's update handlers
+
+Drives the real Application from telegramreferralpro.main.build_application
+with a generated update stream against a fake Bot API (see fake_bot.py). The
+stream is a mix of /start (with and without referral payloads), /status,
+button callbacks and bursts of channel joins and leaves. No network access is
+needed, and the same --seed always produces the same stream and the same fake
+API answers.
+
+    python benchmarks/loadgen.py --updates 5000 --latency-ms 30 --rate-limit 0.01
+
+Reports throughput, handler latency percentiles and Bot API call counts per
+update type, as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegramreferralpro.config import BotConfig
+from telegramreferralpro.database import Database
+from telegramreferralpro.main import build_application
+from fake_bot import FakeBotAPI, UpdateFactory, percentiles
+
+CHANNEL_ID = '-1001000000000'
+FIRST_USER_ID = 10_000_000
+
+# Relative weight of each update type in the stream
+DEFAULT_MIX = {
+    'start': 20,
+    'start_referral': 15,
+    'status': 10,
+    'callback': 35,
+    'chat_member': 20,
+}
+CALLBACK_MIX = {'refresh_status': 50, 'my_link': 20, 'claim_reward': 15, 'help': 15}
+LANGUAGE_MIX = {'en': 60, 'es': 20, 'fr': 10, 'ru': 5, 'de': 5}
+MAX_BURST = 20
+
+def weighted_choice(rng: random.Random, weights: dict) -> str:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+def generate_workload(updates: int, seed: int, mix: dict = None) -> list:
+    """Deterministic list of (kind, user_id, argument) steps
+
+    kind is one of start, start_referral, status, claim, callback, join, leave. The
+    argument is the referrer's user ID for start_referral, the callback data for
+    callback, and the language code for start.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    registered = []
+    members = set()
+    next_user = FIRST_USER_ID
+    steps = []
+    while len(steps) < updates:
+        kind = weighted_choice(rng, mix)
+        if kind in ('start', 'start_referral') or not registered:
+            user_id = next_user
+            next_user += 1
+            if kind == 'start_referral' and registered:
+                # Popular referrers get picked more often, as in real campaigns
+                referrer = registered[int(len(registered) * rng.random() ** 3)]
+                steps.append(('start_referral', user_id, referrer))
+            else:
+                steps.append(('start', user_id, weighted_choice(rng, LANGUAGE_MIX)))
+            registered.append(user_id)
+        elif kind == 'status':
+            steps.append(('status', rng.choice(registered), None))
+        elif kind == 'callback':
+            steps.append(('callback', rng.choice(registered), weighted_choice(rng, CALLBACK_MIX)))
+        else:
+            # Joins and leaves arrive in bursts, e.g. after a post is shared
+            joining = rng.random() < 0.75 or not members
+            for _ in range(min(rng.randint(1, MAX_BURST), updates - len(steps))):
+                if joining:
+                    candidates = [u for u in registered[-200:] if u not in members]
+                    if not candidates:
+                        break
+                    user_id = rng.choice(candidates)
+                    members.add(user_id)
+                    steps.append(('join', user_id, None))
+                else:
+                    if not members:
+                        break
+                    user_id = rng.choice(sorted(members))
+                    members.discard(user_id)
+                    steps.append(('leave', user_id, None))
+    return steps[:updates]
+
+class WorkloadRunner:
+    """Feed workload steps through an Application and collect timings"""
+
+    def __init__(self, application, fake_api: FakeBotAPI, database: Database):
+        self.application = application
+        self.fake_api = fake_api
+        self.db = database
+        self.factory = UpdateFactory(CHANNEL_ID)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._label = None
+        application.add_error_handler(self._on_error)
+
+    async def _on_error(self, update, context) -> None:
+        self.errors[self._label] += 1
+
+    def build_update(self, kind: str, user_id: int, argument):
+        bot = self.application.bot
+        if kind == 'start':
+            return self.factory.command(bot, user_id, 'start', language_code=argument or 'en')
+        if kind == 'start_referral':
+            referrer = self.db.get_user(argument)
+            payload = referrer['referral_code'] if referrer else None
+            return self.factory.command(bot, user_id, 'start', payload)
+        if kind in ('status', 'claim'):
+            return self.factory.command(bot, user_id, kind)
+        if kind == 'callback':
+            return self.factory.callback(bot, user_id, argument)
+        if kind in ('join', 'leave'):
+            # The fake channel must agree with the update for getChatMember answers
+            if kind == 'join':
+                self.fake_api.members.add(user_id)
+            else:
+                self.fake_api.members.discard(user_id)
+            return self.factory.chat_member(bot, user_id, joined=kind == 'join')
+        raise ValueError(f"Unknown workload step {kind}")
+
+    async def process(self, kind: str, user_id: int, argument) -> None:
+        update = self.build_update(kind, user_id, argument)
+        label = 'chat_member' if kind in ('join', 'leave') else kind
+        self._label = label
+        self.fake_api.current_label = label
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+    def report(self, elapsed: float) -> dict:
+        total = sum(len(samples) for samples in self.latencies.values())
+        api_calls = self.fake_api.api_calls()
+        by_type = {}
+        for label, samples in sorted(self.latencies.items()):
+            by_type[label] = {
+                'updates': len(samples),
+                **percentiles(samples),
+                'handler_errors': self.errors.get(label, 0),
+                'rate_limited': self.fake_api.rate_limited.get(label, 0),
+                'api_calls': api_calls.get(label, {}),
+                'api_calls_per_update': round(sum(api_calls.get(label, {}).values()) / len(samples), 2),
+            }
+        all_samples = [s for samples in self.latencies.values() for s in samples]
+        return {
+            'updates': total,
+            'elapsed_seconds': round(elapsed, 3),
+            'updates_per_second': round(total / elapsed, 1) if elapsed else 0.0,
+            'latency': percentiles(all_samples),
+            'by_type': by_type,
+        }
+
+def make_config(database_path: str, throttle_burst: int) -> BotConfig:
+    # The harnesses never run post_init, which starts the job queue; without one, the side
+    # effects of an update (welcome, referrer notices) run inline and show up in the report
+    return BotConfig(
+        bot_token='123456:BENCHMARK',
+        channel_id=CHANNEL_ID,
+        channel_username='bench_channel',
+        admin_user_ids=[],
+        database_path=database_path,
+        throttle_burst=throttle_burst,
+        job_concurrency=0,
+    )
+
+async def run(steps: list, args, database_path: str, pace=None, prepare=None) -> dict:
+    """Run steps through a fresh Application
+
+    pace(step) may sleep before each step; prepare(database, fake_api) can seed
+    state before the first update.
+    """
+    fake_api = FakeBotAPI(CHANNEL_ID, seed=args.seed, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          rate_limit_probability=args.rate_limit)
+    config = make_config(database_path, args.throttle_burst)
+    application = build_application(config, request=fake_api, get_updates_request=fake_api)
+    database = Database(database_path)
+    if prepare:
+        prepare(database, fake_api)
+    runner = WorkloadRunner(application, fake_api, database)
+    await application.initialize()
+    try:
+        started = time.perf_counter()
+        for step in steps:
+            if pace:
+                await pace(step)
+            # Replayed traces prefix each step with its timestamp
+            await runner.process(*step[-3:])
+        elapsed = time.perf_counter() - started
+    finally:
+        await application.shutdown()
+    return runner.report(elapsed)
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Mean simulated Bot API latency")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help="Probability that a Bot API call is answered with 429 RetryAfter")
+    parser.add_argument('--throttle-burst', type=int, default=1000,
+                        help="Per-user throttle burst; high by default so the bot's limiter stays out of the way")
+    parser.add_argument('--database', help="SQLite file to use instead of a temporary one")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the bot's own log output")
+
+def run_and_report(steps: list, args, pace=None, extra: dict = None, prepare=None) -> None:
+    """Run a workload in a temporary database and print the JSON report"""
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix='loadgen_') as tmp_dir:
+        database_path = args.database or os.path.join(tmp_dir, 'loadgen.db')
+        report = asyncio.run(run(steps, args, database_path, pace, prepare))
+    report = {'seed': args.seed, 'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms,
+              'rate_limit': args.rate_limit, **(extra or {}), **report}
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    steps = generate_workload(args.updates, args.seed)
+    run_and_report(steps, args)
+
+if __name__ == "__main__":
+    main()
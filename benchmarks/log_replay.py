@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Turn bot.log into an anonymized update trace and replay it against a fake Bot
+
+    python benchmarks/log_replay.py parse bot.log -o trace.jsonl
+    python benchmarks/log_replay.py replay trace.jsonl --speed 10
+    python benchmarks/log_replay.py replay trace.jsonl --speed max --output report.json
+
+parse reads the handler log lines below, in text or JSON log format, and
+writes one JSON object per update:
+
+    User <id> (<username>) started the bot        -> start
+    Referral failed for user <id>: ...            -> marks that start as a referral start
+    Button callback received: <data> from user <id> -> callback
+    User <id> claimed their reward                -> /claim
+    User <id> joined the channel / left the channel -> join / leave
+
+User IDs are replaced with sequential synthetic IDs in order of first
+appearance, and usernames are dropped. The first line of the trace is a header
+listing users whose first event was not /start. Those users already existed
+when the log began, so replay registers them before the first update.
+
+replay feeds the trace through the real handlers (see loadgen.py) at the
+recorded pace (--speed 1), faster (--speed 10) or with no waiting at all
+(--speed max). --max-gap caps long idle gaps.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from loadgen import FIRST_USER_ID, add_common_arguments, run_and_report
+
+TRACE_FORMAT = 'telegramreferralpro-trace'
+TRACE_VERSION = 1
+
+TEXT_LINE = re.compile(
+    r'^(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - (?P<logger>\S+) - (?P<level>[A-Z]+) - '
+    r'(?:\[[^\]]*\] )?(?P<message>.*)$'
+)
+EVENT_PATTERNS = [
+    ('start', re.compile(r'^User (?P<user>\d+) \(.*\) started the bot$')),
+    ('referral_failed', re.compile(r'^Referral failed for user (?P<user>\d+):')),
+    ('callback', re.compile(r'^Button callback received: (?P<arg>\S+) from user (?P<user>\d+)$')),
+    ('claim', re.compile(r'^User (?P<user>\d+) claimed their reward$')),
+    ('join', re.compile(r'^User (?P<user>\d+) joined the channel$')),
+    ('leave', re.compile(r'^User (?P<user>\d+) left the channel$')),
+]
+
+def parse_line(line: str) -> Optional[Tuple[datetime, str]]:
+    """(timestamp, message) of a text or JSON log line"""
+    line = line.rstrip('\n')
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+            return datetime.strptime(entry['ts'], '%Y-%m-%dT%H:%M:%S.%f'), entry['message']
+        except (ValueError, KeyError):
+            return None
+    match = TEXT_LINE.match(line)
+    if not match:
+        return None
+    return datetime.strptime(match['ts'], '%Y-%m-%d %H:%M:%S,%f'), match['message']
+
+def extract_events(lines: Iterable[str]) -> List[Tuple[datetime, str, int, Optional[str]]]:
+    """(timestamp, kind, real_user_id, argument) for every recognised handler line"""
+    events = []
+    for line in lines:
+        parsed = parse_line(line)
+        if not parsed:
+            continue
+        timestamp, message = parsed
+        for kind, pattern in EVENT_PATTERNS:
+            match = pattern.match(message)
+            if match:
+                events.append((timestamp, kind, int(match['user']), match.groupdict().get('arg')))
+                break
+    # Several log files may be given; events are replayed in time order
+    events.sort(key=lambda event: event[0])
+    return events
+
+def build_trace(events: list) -> Tuple[dict, list]:
+    """Anonymize events into a header and a list of {t, kind, user, arg} steps"""
+    anonymous_ids = {}
+    preexisting = []
+    steps = []
+    start_time = events[0][0] if events else None
+
+    def anonymize(user_id: int) -> int:
+        if user_id not in anonymous_ids:
+            anonymous_ids[user_id] = FIRST_USER_ID + len(anonymous_ids)
+        return anonymous_ids[user_id]
+
+    last_start = {}
+    for timestamp, kind, user_id, argument in events:
+        is_new = user_id not in anonymous_ids
+        user = anonymize(user_id)
+        if kind == 'referral_failed':
+            # Only the outcome of a referral start is logged, so upgrade the start it belongs to
+            if user in last_start:
+                last_start[user]['kind'] = 'start_referral'
+            continue
+        if is_new and kind != 'start':
+            preexisting.append(user)
+        step = {'t': round((timestamp - start_time).total_seconds(), 3), 'kind': kind, 'user': user}
+        if argument is not None:
+            step['arg'] = argument
+        steps.append(step)
+        if kind == 'start':
+            last_start[user] = step
+
+    header = {
+        'format': TRACE_FORMAT,
+        'version': TRACE_VERSION,
+        'users': len(anonymous_ids),
+        'updates': len(steps),
+        'duration_seconds': steps[-1]['t'] if steps else 0,
+        'preexisting_users': preexisting,
+        'mix': dict(Counter(step['kind'] for step in steps).most_common()),
+    }
+    return header, steps
+
+def write_trace(path: str, header: dict, steps: list) -> None:
+    with open(path, 'w') as f:
+        f.write(json.dumps(header) + '\n')
+        for step in steps:
+            f.write(json.dumps(step) + '\n')
+
+def read_trace(path: str) -> Tuple[dict, list]:
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get('format') != TRACE_FORMAT or header.get('version') != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} trace")
+        steps = [json.loads(line) for line in f if line.strip()]
+    return header, steps
+
+def to_workload(steps: list) -> list:
+    """(t, kind, user_id, argument) tuples for loadgen's runner"""
+    workload = []
+    first_user = steps[0]['user'] if steps else FIRST_USER_ID
+    for step in steps:
+        kind = step['kind']
+        argument = step.get('arg')
+        if kind == 'start_referral':
+            # The referrer is not in the log; credit the earliest user, like a channel owner sharing a link
+            argument = first_user if first_user != step['user'] else None
+            if argument is None:
+                kind = 'start'
+        workload.append((step['t'], kind, step['user'], argument))
+    return workload
+
+def make_pacer(speed: str, max_gap: Optional[float]):
+    """Sleep until each step's (scaled) timestamp; None means no waiting"""
+    if speed == 'max':
+        return None
+    factor = float(speed)
+    state = {'started': None, 'previous_t': 0.0, 'offset': 0.0}
+
+    async def pace(step) -> None:
+        t = step[0]
+        if state['started'] is None:
+            state['started'] = time.perf_counter()
+        if max_gap is not None and t - state['previous_t'] > max_gap:
+            # Skip the idle time beyond the cap
+            state['offset'] += t - state['previous_t'] - max_gap
+        state['previous_t'] = t
+        due = state['started'] + (t - state['offset']) / factor
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    return pace
+
+def seed_preexisting(users: list):
+    """prepare() hook registering users that existed before the log began"""
+    def prepare(database, fake_api) -> None:
+        for user_id in users:
+            database.add_user(user_id, f"user{user_id}", f"User {user_id}", None, f"ref_trace_{user_id}")
+    return prepare
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help="Convert log files into a trace")
+    parse_parser.add_argument('logs', nargs='+')
+    parse_parser.add_argument('-o', '--trace', required=True)
+
+    replay_parser = subparsers.add_parser('replay', help="Replay a trace against the fake Bot API")
+    replay_parser.add_argument('trace')
+    replay_parser.add_argument('--speed', default='max', help="1, 10 (or any factor) or max")
+    replay_parser.add_argument('--max-gap', type=float, help="Cap idle gaps between updates at this many seconds")
+    add_common_arguments(replay_parser)
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        lines = []
+        for path in args.logs:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                lines.extend(f)
+        header, steps = build_trace(extract_events(lines))
+        write_trace(args.trace, header, steps)
+        print(json.dumps(header, indent=2))
+        return
+
+    if args.speed != 'max':
+        try:
+            if float(args.speed) <= 0:
+                raise ValueError
+        except ValueError:
+            parser.error("--speed must be a positive number or 'max'")
+    header, steps = read_trace(args.trace)
+    print(f"Replaying {header['updates']} updates ({header['duration_seconds']}s recorded) "
+          f"at speed {args.speed}", file=sys.stderr)
+    run_and_report(
+        to_workload(steps), args,
+        pace=make_pacer(args.speed, args.max_gap),
+        extra={'trace': args.trace, 'speed': args.speed, 'mix': header['mix']},
+        prepare=seed_preexisting(header['preexisting_users']),
+    )
+
+if __name__ == "__main__":
+    main()
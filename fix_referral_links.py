@@ -11,8 +11,6 @@ from telegramreferralpro.referral_system import ReferralSystem
 from telegramreferralpro.utils import TelegramUtils, setup_logging
 from telegram.ext import Application
 
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
 async def fix_referral_links():
@@ -112,4 +110,6 @@ async def fix_referral_links():
         logger.error(f"Error: {e}")
 
 if __name__ == "__main__":
+    # Setup logging
+    setup_logging()
     asyncio.run(fix_referral_links())
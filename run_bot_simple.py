@@ -13,8 +13,6 @@ from telegramreferralpro.database import Database
 from telegramreferralpro.referral_system import ReferralSystem
 from telegramreferralpro.utils import TelegramUtils, setup_logging
 
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
 class SimpleBotHandlers:
@@ -213,6 +211,8 @@ After joining, use /start again to get your referral link!
 
 def main():
     """Main function to run the simplified bot"""
+    # Setup logging
+    setup_logging()
     try:
         # Load configuration
         config = load_config()
@@ -1,11 +0,0 @@
-export interface Task {
-    id: string;
-    data: any;
-    priority?: number;
-}
-
-export interface WorkerOptions {
-    concurrency?: number;
-    timeout?: number;
-    retryAttempts?: number;
-}
\ No newline at end of file
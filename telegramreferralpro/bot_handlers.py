@@ -1,18 +1,122 @@
+import asyncio
 import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters, ChatMemberHandler, CallbackQueryHandler
+from telegram.ext import (ContextTypes, CommandHandler, MessageHandler, filters, ChatMemberHandler, CallbackQueryHandler,
+                          TypeHandler, ApplicationHandlerStop)
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
 from .database import Database
 from .referral_system import ReferralSystem
 from .messages import Messages
 from .utils import TelegramUtils, setup_logging, escape_markdown
 from .config import BotConfig
 from .languages import LanguageManager, MultilingualMessages, SupportedLanguage
+from .campaigns import CampaignManager, load_campaign_definitions
+from .throttling import UserThrottle
+from .jobs import JobQueue
+from .rollups import (DailyRollup, render_chart, to_csv, COMPACT_INTERVAL, DEFAULT_REPORT_DAYS,
+                      MAX_REPORT_DAYS)
+from .export import EXPORT_TABLES, FORMATS, export_database
 
 logger = logging.getLogger(__name__)
 
+# Number of distinct (language, active, total, target) status renders kept in memory
+STATUS_RENDER_CACHE_SIZE = 4096
+
+# Number of (chat_id, message_id) content fingerprints kept to skip no-op edits
+EDIT_FINGERPRINT_CACHE_SIZE = 10000
+
+# Events /admin_report folds in before rendering when the background compaction is behind
+REPORT_COMPACT_LIMIT = 20000
+
+# Largest file a bot can upload; bigger exports are taken with the CLI on the server
+EXPORT_DOCUMENT_LIMIT = 50 * 1024 * 1024
+# Lease of an /admin_export job, long enough to export a large database
+EXPORT_JOB_TIMEOUT = 3600
+
+# Static keyboards; telegram objects are immutable once built, so every message can share them
+STATUS_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔄 Refresh", callback_data="refresh_status"),
+        InlineKeyboardButton("📊 My Link", callback_data="my_link"),
+    ],
+    [
+        InlineKeyboardButton("🏆 Claim Reward", callback_data="claim_reward"),
+        InlineKeyboardButton("❓ Help", callback_data="help"),
+    ]
+])
+BACK_TO_STATUS_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 Back to Status", callback_data="refresh_status")]
+])
+REWARD_CLAIMED_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🎉 Share Success", callback_data="share_success")],
+    [InlineKeyboardButton("📊 View Status", callback_data="refresh_status")]
+])
+
+def _build_language_keyboard() -> InlineKeyboardMarkup:
+    """Language picker with 2 languages per row"""
+    keyboard = []
+    row = []
+    for lang_code, lang_name in MultilingualMessages.get_available_languages().items():
+        row.append(InlineKeyboardButton(lang_name, callback_data=f"lang_{lang_code}"))
+        if len(row) == 2:
+            keyboard.append(row)
+            row = []
+    
+    # Add remaining button if exists
+    if row:
+        keyboard.append(row)
+    return InlineKeyboardMarkup(keyboard)
+
+LANGUAGE_KEYBOARD = _build_language_keyboard()
+
+@lru_cache(maxsize=STATUS_RENDER_CACHE_SIZE)
+def render_status_message(user_lang: str, active_referrals: int, total_referrals: int, target: int) -> str:
+    """Status text for a given set of counters; identical inputs are served from the cache"""
+    progress = ReferralSystem.build_progress(active_referrals, total_referrals, target)
+    
+    # Generate progress bar
+    progress_bar_full = MultilingualMessages.get_message(user_lang, "progress_bar_full")
+    progress_bar_empty = MultilingualMessages.get_message(user_lang, "progress_bar_empty")
+    filled = int((progress['progress_percentage'] / 100) * 10)
+    empty = 10 - filled
+    progress_bar = progress_bar_full * filled + progress_bar_empty * empty
+    
+    # Get status text
+    if progress['target_reached']:
+        status_text = MultilingualMessages.get_message(user_lang, "status_target_reached")
+    elif progress['active_referrals'] == 0:
+        status_text = MultilingualMessages.get_message(user_lang, "status_no_referrals")
+    else:
+        status_text = MultilingualMessages.get_message(
+            user_lang, "status_progress", remaining=progress['remaining']
+        )
+    
+    return MultilingualMessages.get_message(
+        user_lang, "status_message",
+        active_referrals=progress['active_referrals'],
+        target=progress['target'],
+        total_referrals=progress['total_referrals'],
+        remaining=progress['remaining'],
+        progress=int(progress['progress_percentage']),
+        progress_bar=progress_bar,
+        status_text=status_text
+    )
+
+@lru_cache(maxsize=256)
+def render_static_message(user_lang: str, key: str) -> str:
+    """Messages without placeholders (help, language picker), rendered once per language"""
+    return MultilingualMessages.get_message(user_lang, key)
+
 class BotHandlers:
-    def __init__(self, config: BotConfig, database: Database, referral_system: ReferralSystem, telegram_utils: TelegramUtils):
+    def __init__(self, config: BotConfig, database: Database, referral_system: ReferralSystem, telegram_utils: TelegramUtils,
+                 throttle: Optional[UserThrottle] = None, jobs: Optional[JobQueue] = None):
         self.config = config
         self.db = database
         self.referral_system = referral_system
@@ -20,6 +124,24 @@ class BotHandlers:
         self.messages = Messages()
         self.language_manager = LanguageManager(database)
         self.multilingual_messages = MultilingualMessages()
+        self._edit_fingerprints: "OrderedDict[tuple, int]" = OrderedDict()
+        self.skipped_edits = 0
+        self.sent_edits = 0
+        self.campaign_manager = CampaignManager(database)
+        self.campaign_manager.sync_campaigns(load_campaign_definitions(config.campaigns_file))
+        # Bots hosted in one process may share a limiter (see multitenant.py)
+        self.throttle = throttle or UserThrottle(rate=config.throttle_rate, burst=config.throttle_burst)
+        # Messages that need not go out before the handler returns run as background jobs
+        self.jobs = jobs
+        self.rollup = DailyRollup(database)
+        if jobs:
+            jobs.register('channel_welcome', lambda payload: self._send_channel_welcome(**payload))
+            jobs.register('referrer_joined', lambda payload: self._notify_referrer_joined(**payload))
+            jobs.register('referrer_left', lambda payload: self._notify_referrer_left(**payload))
+            jobs.register('compact_rollups', lambda payload: asyncio.to_thread(self.rollup.compact))
+            jobs.schedule_recurring('compact_rollups', COMPACT_INTERVAL, first_delay=0)
+            jobs.register('export', lambda payload: self._send_export(**payload), max_attempts=2,
+                          timeout=EXPORT_JOB_TIMEOUT)
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /start command with multilingual support"""
@@ -29,7 +151,7 @@ class BotHandlers:
         user = update.effective_user
         user_id = user.id
         
-        logger.info(f"User {user_id} ({user.username}) started the bot")
+        logger.info("User %s (%s) started the bot", user_id, user.username)
         
         # Detect and set user language
         message_text = update.message.text if update.message.text else ""
@@ -63,8 +185,11 @@ class BotHandlers:
             success, message = self.referral_system.process_referral(referral_code, user_id)
             if success:
                 await update.message.reply_text(f"✅ {message}")
+                if is_member:
+                    referred_user = self.db.get_user(user_id)
+                    await self._record_campaign_referral(referred_user['referred_by'], user_id)
             else:
-                logger.warning(f"Referral failed for user {user_id}: {message}")
+                logger.warning("Referral failed for user %s: %s", user_id, message)
         
         # Send appropriate welcome message
         if is_member:
@@ -188,7 +313,7 @@ class BotHandlers:
             return
         
         # Check channel membership
-        is_member = await self.telegram_utils.check_channel_membership(user_id)
+        is_member = await self._check_membership(user)
         if not is_member:
             channel_link = self.telegram_utils.get_channel_link()
             message = self.multilingual_messages.get_message(
@@ -197,52 +322,128 @@ class BotHandlers:
             await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
             return
         
-        # Get referral progress
+        # Get referral progress (counter read) and the cached render for it
         progress = self.referral_system.get_referral_progress(user_id, self.config.referral_target)
-        
-        # Generate progress bar
+        message = render_status_message(
+            user_lang, progress['active_referrals'], progress['total_referrals'], progress['target']
+        )
+        message += self._format_campaign_progress(user_id, user_lang)
+        
+        reply_markup = STATUS_KEYBOARD
+        sent = await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        # A Refresh tap that finds nothing changed can then skip the edit entirely
+        self._remember_fingerprint(
+            (sent.chat_id, sent.message_id),
+            self._content_fingerprint(message, reply_markup, ParseMode.MARKDOWN)
+        )
+
+    @staticmethod
+    def _content_fingerprint(text: str, reply_markup=None, parse_mode=None) -> int:
+        """Hash of what a message shows; shared keyboards hash by their buttons"""
+        return hash((text, reply_markup, parse_mode))
+
+    def _remember_fingerprint(self, key: tuple, fingerprint: int) -> None:
+        """Record the content last sent to a message"""
+        self._edit_fingerprints[key] = fingerprint
+        self._edit_fingerprints.move_to_end(key)
+        if len(self._edit_fingerprints) > EDIT_FINGERPRINT_CACHE_SIZE:
+            self._edit_fingerprints.popitem(last=False)
+
+    async def _edit_message(self, query, text: str, reply_markup=None, parse_mode=None) -> bool:
+        """Edit the callback's message unless it already shows exactly this content"""
+        if query.message:
+            key = (query.message.chat.id, query.message.message_id)
+        else:
+            key = (None, query.inline_message_id)
+        fingerprint = self._content_fingerprint(text, reply_markup, parse_mode)
+        if self._edit_fingerprints.get(key) == fingerprint:
+            # Telegram would reject it with "message is not modified"; the callback is already answered
+            self.skipped_edits += 1
+            return False
+
+        try:
+            await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+            self.sent_edits += 1
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+            self.skipped_edits += 1
+        self._remember_fingerprint(key, fingerprint)
+        return True
+
+    async def _check_membership(self, user) -> bool:
+        """Channel membership, trusting the stored flag while it is younger than MEMBERSHIP_RECHECK_SECONDS"""
+        user_id = user['user_id']
+        if user['is_channel_member']:
+            ttl = self.config.membership_recheck_seconds
+            checked_at = user['membership_updated_at']
+            if ttl <= 0 or (checked_at is not None and time.time() - checked_at < ttl):
+                return True
+            # Stale "member": a leave update may have been missed while the bot was down
+            is_member = await self.telegram_utils.get_channel_membership(user_id)
+            if is_member is None:
+                return True  # Telegram unreachable: keep the stored flag, retry next time
+            if is_member:
+                self.db.update_channel_membership(user_id, True)
+            else:
+                logger.info("User %s left the channel while no update was seen", user_id)
+                await self._apply_channel_leave(user_id, int(time.time()))
+            return is_member
+        # Stored flag says no: confirm with Telegram in case a join update was missed
+        is_member = await self.telegram_utils.check_channel_membership(user_id)
+        if is_member:
+            self.db.update_channel_membership(user_id, True)
+        return is_member
+
+    def _format_campaign_progress(self, user_id: int, user_lang: str) -> str:
+        """Render progress for every running campaign from the precomputed counters"""
+        campaigns = self.campaign_manager.get_user_progress(user_id)
+        if not campaigns:
+            return ""
+
         progress_bar_full = self.multilingual_messages.get_message(user_lang, "progress_bar_full")
         progress_bar_empty = self.multilingual_messages.get_message(user_lang, "progress_bar_empty")
-        filled = int((progress['progress_percentage'] / 100) * 10)
-        empty = 10 - filled
-        progress_bar = progress_bar_full * filled + progress_bar_empty * empty
-        
-        # Get status text
-        if progress['target_reached']:
-            status_text = self.multilingual_messages.get_message(user_lang, "status_target_reached")
-        elif progress['active_referrals'] == 0:
-            status_text = self.multilingual_messages.get_message(user_lang, "status_no_referrals")
-        else:
-            status_text = self.multilingual_messages.get_message(
-                user_lang, "status_progress", remaining=progress['remaining']
+        lines = ["", self.multilingual_messages.get_message(user_lang, "campaigns_header")]
+        for entry in campaigns:
+            campaign = entry['campaign']
+            if entry['next_tier'] is None and campaign.tiers:
+                lines.append(self.multilingual_messages.get_message(
+                    user_lang, "campaign_completed",
+                    title=campaign.title, active_referrals=entry['active_referrals']
+                ))
+                continue
+            target = entry['target']
+            filled = min(5, int(entry['active_referrals'] * 5 / target)) if target else 0
+            ends = ""
+            if campaign.ends_at:
+                ends = self.multilingual_messages.get_message(
+                    user_lang, "campaign_ends", date=campaign.ends_at.strftime("%Y-%m-%d")
+                )
+            lines.append(self.multilingual_messages.get_message(
+                user_lang, "campaign_progress",
+                title=campaign.title,
+                active_referrals=entry['active_referrals'],
+                target=target,
+                progress_bar=progress_bar_full * filled + progress_bar_empty * (5 - filled),
+                ends=ends
+            ))
+        return "\n".join(lines) + "\n"
+
+    async def _record_campaign_referral(self, referrer_id: int, referred_user_id: int) -> None:
+        """Credit a referral to running campaigns and announce newly unlocked tiers"""
+        unlocked = self.campaign_manager.record_referral_joined(referrer_id, referred_user_id)
+        if not unlocked:
+            return
+        referrer_lang = self.language_manager.get_user_language(referrer_id)
+        for campaign, tier in unlocked:
+            message = self.multilingual_messages.get_message(
+                referrer_lang, "campaign_tier_unlocked",
+                title=campaign.title,
+                reward=tier.reward or self.config.reward_message,
+                active_referrals=tier.threshold,
+                threshold=tier.threshold
             )
-        
-        message = self.multilingual_messages.get_message(
-            user_lang, "status_message",
-            active_referrals=progress['active_referrals'],
-            target=progress['target'],
-            total_referrals=progress['total_referrals'],
-            remaining=progress['remaining'],
-            progress=int(progress['progress_percentage']),
-            progress_bar=progress_bar,
-            status_text=status_text
-        )
-        
-        keyboard = [
-            [
-                InlineKeyboardButton("🔄 Refresh", callback_data="refresh_status"),
-                InlineKeyboardButton("📊 My Link", callback_data="my_link"),
-            ],
-            [
-                InlineKeyboardButton("🏆 Claim Reward", callback_data="claim_reward"),
-                InlineKeyboardButton("❓ Help", callback_data="help"),
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-    async def language_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        # ...existing code for language selection...
-        pass
+            await self.telegram_utils.send_message_safe(referrer_id, message)
 
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle inline keyboard button callbacks"""
@@ -254,7 +455,7 @@ class BotHandlers:
         user_id = query.from_user.id
         user_lang = self.language_manager.get_user_language(user_id)
         
-        logger.info(f"Button callback received: {query.data} from user {user_id}")
+        logger.info("Button callback received: %s from user %s", query.data, user_id)
         await query.answer()
         
         if query.data == "my_status":
@@ -268,13 +469,10 @@ class BotHandlers:
             await self._handle_claim_inline(query, user_id, user_lang)
         elif query.data == "help":
             # Show help message
-            message = self.multilingual_messages.get_message(user_lang, "help_message")
+            message = render_static_message(user_lang, "help_message")
+            reply_markup = BACK_TO_STATUS_KEYBOARD
             
-            # Create back button
-            keyboard = [[InlineKeyboardButton("🔙 Back to Status", callback_data="refresh_status")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+            await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
         elif query.data == "my_link":
             # Show user's referral link
             await self._show_referral_link_inline(query, user_id, user_lang)
@@ -282,8 +480,8 @@ class BotHandlers:
             # Handle success sharing
             await self._show_status_inline(query, user_id, user_lang)
         else:
-            logger.warning(f"Unknown callback data: {query.data}")
-            await query.edit_message_text("Unknown action.")
+            logger.warning("Unknown callback data: %s", query.data)
+            await self._edit_message(query, "Unknown action.")
     
     async def _show_status_inline(self, query, user_id: int, user_lang: str) -> None:
         """Show status message inline"""
@@ -292,67 +490,31 @@ class BotHandlers:
             user = self.db.get_user(user_id)
             if not user:
                 message = self.multilingual_messages.get_message(user_lang, "error_register_first", fallback="❌ Please use /start first to register.")
-                await query.edit_message_text(message)
+                await self._edit_message(query, message)
                 return
             
             # Check channel membership
-            is_member = await self.telegram_utils.check_channel_membership(user_id)
+            is_member = await self._check_membership(user)
             if not is_member:
                 channel_link = self.telegram_utils.get_channel_link()
                 message = self.multilingual_messages.get_message(
                     user_lang, "error_not_channel_member", channel_link=channel_link
                 )
-                await query.edit_message_text(message, parse_mode=ParseMode.MARKDOWN)
+                await self._edit_message(query, message, parse_mode=ParseMode.MARKDOWN)
                 return
             
-            # Get referral progress
+            # Get referral progress (counter read) and the cached render for it
             progress = self.referral_system.get_referral_progress(user_id, self.config.referral_target)
-            
-            # Generate progress bar
-            progress_bar_full = self.multilingual_messages.get_message(user_lang, "progress_bar_full")
-            progress_bar_empty = self.multilingual_messages.get_message(user_lang, "progress_bar_empty")
-            filled = int((progress['progress_percentage'] / 100) * 10)
-            empty = 10 - filled
-            progress_bar = progress_bar_full * filled + progress_bar_empty * empty
-            
-            # Get status text
-            if progress['target_reached']:
-                status_text = self.multilingual_messages.get_message(user_lang, "status_target_reached")
-            elif progress['active_referrals'] == 0:
-                status_text = self.multilingual_messages.get_message(user_lang, "status_no_referrals")
-            else:
-                status_text = self.multilingual_messages.get_message(
-                    user_lang, "status_progress", remaining=progress['remaining']
-                )
-            
-            message = self.multilingual_messages.get_message(
-                user_lang, "status_message",
-                active_referrals=progress['active_referrals'],
-                target=progress['target'],
-                total_referrals=progress['total_referrals'],
-                remaining=progress['remaining'],
-                progress=int(progress['progress_percentage']),
-                progress_bar=progress_bar,
-                status_text=status_text
+            message = render_status_message(
+                user_lang, progress['active_referrals'], progress['total_referrals'], progress['target']
             )
+            message += self._format_campaign_progress(user_id, user_lang)
+            reply_markup = STATUS_KEYBOARD
             
-            # Create keyboard with updated buttons
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Refresh", callback_data="refresh_status"),
-                    InlineKeyboardButton("📊 My Link", callback_data="my_link"),
-                ],
-                [
-                    InlineKeyboardButton("🏆 Claim Reward", callback_data="claim_reward"),
-                    InlineKeyboardButton("❓ Help", callback_data="help"),
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+            await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
         except Exception as e:
-            logger.error(f"Error in _show_status_inline: {e}")
-            await query.edit_message_text("❌ An error occurred. Please try again.")
+            logger.error("Error in _show_status_inline: %s", e)
+            await self._edit_message(query, "❌ An error occurred. Please try again.")
     
     async def _handle_claim_inline(self, query, user_id: int, user_lang: str) -> None:
         """Handle reward claiming inline"""
@@ -361,7 +523,7 @@ class BotHandlers:
             user = self.db.get_user(user_id)
             if not user:
                 message = self.multilingual_messages.get_message(user_lang, "error_register_first", fallback="❌ Please use /start first to register.")
-                await query.edit_message_text(message)
+                await self._edit_message(query, message)
                 return
             
             # Check if reward already claimed
@@ -373,11 +535,9 @@ class BotHandlers:
                     user_lang, "error_reward_already_claimed", referral_link=invite_link
                 )
                 
-                # Create back button
-                keyboard = [[InlineKeyboardButton("🔙 Back to Status", callback_data="refresh_status")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = BACK_TO_STATUS_KEYBOARD
                 
-                await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+                await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
                 return
             
             # Check if target reached
@@ -389,11 +549,9 @@ class BotHandlers:
                     target=progress['target']
                 )
                 
-                # Create back button
-                keyboard = [[InlineKeyboardButton("🔙 Back to Status", callback_data="refresh_status")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = BACK_TO_STATUS_KEYBOARD
                 
-                await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+                await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
                 return
             
             # Claim reward
@@ -409,18 +567,14 @@ class BotHandlers:
                 referral_link=invite_link
             )
             
-            # Create celebration keyboard
-            keyboard = [
-                [InlineKeyboardButton("🎉 Share Success", callback_data="share_success")],
-                [InlineKeyboardButton("📊 View Status", callback_data="refresh_status")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Celebration keyboard
+            reply_markup = REWARD_CLAIMED_KEYBOARD
             
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
-            logger.info(f"User {user_id} claimed their reward via inline button")
+            await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+            logger.info("User %s claimed their reward via inline button", user_id)
         except Exception as e:
-            logger.error(f"Error in _handle_claim_inline: {e}")
-            await query.edit_message_text("❌ An error occurred. Please try again.")
+            logger.error("Error in _handle_claim_inline: %s", e)
+            await self._edit_message(query, "❌ An error occurred. Please try again.")
     
     async def _show_referral_link_inline(self, query, user_id: int, user_lang: str) -> None:
         """Show user's referral link inline"""
@@ -428,7 +582,7 @@ class BotHandlers:
             user = self.db.get_user(user_id)
             if not user:
                 message = self.multilingual_messages.get_message(user_lang, "error_register_first", fallback="❌ Please use /start first to register.")
-                await query.edit_message_text(message)
+                await self._edit_message(query, message)
                 return
             
             # Get user's stored invite link
@@ -458,14 +612,12 @@ class BotHandlers:
 💡 **Tip:** Share this link in groups, social media, or directly with friends!
 """
             
-            # Create back button
-            keyboard = [[InlineKeyboardButton("🔙 Back to Status", callback_data="refresh_status")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = BACK_TO_STATUS_KEYBOARD
             
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+            await self._edit_message(query, message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
         except Exception as e:
-            logger.error(f"Error in _show_referral_link_inline: {e}")
-            await query.edit_message_text("❌ An error occurred. Please try again.")
+            logger.error("Error in _show_referral_link_inline: %s", e)
+            await self._edit_message(query, "❌ An error occurred. Please try again.")
     
     async def claim_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /claim command"""
@@ -504,7 +656,7 @@ class BotHandlers:
             referral_link=invite_link
         )
         await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
-        logger.info(f"User {user_id} claimed their reward")
+        logger.info("User %s claimed their reward", user_id)
     
     async def language_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /language command to change language settings"""
@@ -514,26 +666,10 @@ class BotHandlers:
         user_id = update.effective_user.id
         user_lang = self.language_manager.get_user_language(user_id)
         
-        # Create language selection keyboard
-        available_languages = self.multilingual_messages.get_available_languages()
-        keyboard = []
-        
-        # Create rows of 2 languages each
-        row = []
-        for lang_code, lang_name in available_languages.items():
-            button = InlineKeyboardButton(lang_name, callback_data=f"lang_{lang_code}")
-            row.append(button)
-            if len(row) == 2:
-                keyboard.append(row)
-                row = []
-        
-        # Add remaining button if exists
-        if row:
-            keyboard.append(row)
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Language selection keyboard is shared by every picker message
+        reply_markup = LANGUAGE_KEYBOARD
         
-        message = self.multilingual_messages.get_message(user_lang, "language_selection")
+        message = render_static_message(user_lang, "language_selection")
         await update.message.reply_text(message, reply_markup=reply_markup)
     
     async def language_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -552,7 +688,7 @@ class BotHandlers:
         
         # Send confirmation in the new language
         message = self.multilingual_messages.get_message(lang_code, "language_changed")
-        await query.edit_message_text(message)
+        await self._edit_message(query, message)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle /help command with multilingual support"""
@@ -562,7 +698,7 @@ class BotHandlers:
         user_id = update.effective_user.id
         user_lang = self.language_manager.get_user_language(user_id)
         
-        message = self.multilingual_messages.get_message(user_lang, "help_message")
+        message = render_static_message(user_lang, "help_message")
         await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
     
     async def admin_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -573,28 +709,115 @@ class BotHandlers:
             await update.message.reply_text("❌ You don't have permission to use this command.")
             return
         
-        # Get statistics
-        total_users = self.db.get_all_users_count()
-        channel_members = self.db.get_channel_members_count()
-        
-        # Get total referrals and rewards claimed
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM referrals WHERE is_active = TRUE')
-            total_referrals = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM users WHERE reward_claimed = TRUE')
-            rewards_claimed = cursor.fetchone()[0]
+        # One row kept current by the write methods, instead of counting the tables
+        stats = self.db.get_stats()
         
         message = self.messages.ADMIN_STATS.format(
-            total_users=total_users,
-            channel_members=channel_members,
-            total_referrals=total_referrals,
-            rewards_claimed=rewards_claimed
+            total_users=stats['total_users'],
+            channel_members=stats['channel_members'],
+            total_referrals=stats['active_referrals'],
+            rewards_claimed=stats['rewards_claimed']
         )
         
         await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
     
+    async def admin_queries_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /admin_queries [total|max|mean|calls|rows|reset] command"""
+        user_id = update.effective_user.id
+        
+        if not self.telegram_utils.is_admin(user_id, self.config.admin_user_ids):
+            await update.message.reply_text("❌ You don't have permission to use this command.")
+            return
+        
+        profiler = self.db.profiler
+        if not profiler:
+            await update.message.reply_text("Query profiling is disabled. Set QUERY_PROFILING=1 to enable it.")
+            return
+        
+        argument = context.args[0].lower() if context.args else 'total'
+        if argument == 'reset':
+            profiler.reset()
+            await update.message.reply_text("✅ Query statistics reset.")
+            return
+        if argument not in profiler.SORT_KEYS:
+            await update.message.reply_text(f"Usage: /admin_queries [{'|'.join(profiler.SORT_KEYS)}|reset]")
+            return
+        
+        # Plain text: SQL is full of characters Markdown would interpret
+        await update.message.reply_text(profiler.format_report(sort_by=argument))
+    
+    async def admin_jobs_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /admin_jobs [retry] command"""
+        user_id = update.effective_user.id
+        
+        if not self.telegram_utils.is_admin(user_id, self.config.admin_user_ids):
+            await update.message.reply_text("❌ You don't have permission to use this command.")
+            return
+        
+        if not self.jobs:
+            await update.message.reply_text("Background jobs are disabled.")
+            return
+        
+        if context.args and context.args[0].lower() == 'retry':
+            requeued = self.jobs.retry_failed()
+            await update.message.reply_text(f"✅ {requeued} failed jobs queued again.")
+            return
+        
+        # Plain text: job errors may contain Markdown characters
+        await update.message.reply_text(self.jobs.format_report())
+    
+    async def admin_report_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /admin_report [days] command"""
+        user_id = update.effective_user.id
+        
+        if not self.telegram_utils.is_admin(user_id, self.config.admin_user_ids):
+            await update.message.reply_text("❌ You don't have permission to use this command.")
+            return
+        
+        days = DEFAULT_REPORT_DAYS
+        if context.args:
+            if not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= MAX_REPORT_DAYS:
+                await update.message.reply_text(f"Usage: /admin_report [days, 1-{MAX_REPORT_DAYS}]")
+                return
+            days = int(context.args[0])
+        
+        # Only the events since the last compaction are folded in here; without jobs, all of them
+        await asyncio.to_thread(self.rollup.compact, REPORT_COMPACT_LIMIT if self.jobs else None)
+        rows = self.rollup.days(days)
+        await update.message.reply_text(f"📈 Last {days} days (UTC)\n```\n{render_chart(rows)}\n```",
+                                        parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_document(to_csv(rows), filename=f"report_{rows[0]['day']}_{rows[-1]['day']}.csv")
+    
+    async def admin_export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Handle /admin_export [csv|jsonl] [tables...] command"""
+        user_id = update.effective_user.id
+        
+        if not self.telegram_utils.is_admin(user_id, self.config.admin_user_ids):
+            await update.message.reply_text("❌ You don't have permission to use this command.")
+            return
+        
+        args = [arg.lower() for arg in context.args or []]
+        fmt = args.pop(0) if args and args[0] in FORMATS else 'csv'
+        if any(table not in EXPORT_TABLES for table in args):
+            await update.message.reply_text(f"Usage: /admin_export [{'|'.join(FORMATS)}] [{' '.join(EXPORT_TABLES)}]")
+            return
+        
+        chat_id = update.effective_chat.id
+        payload = {'chat_id': chat_id, 'fmt': fmt, 'tables': list(dict.fromkeys(args)) or None}
+        if self.jobs:
+            # One export per chat at a time; the job sends the files when they are written
+            if self.jobs.enqueue('export', payload, key=f"export:{chat_id}") is None:
+                await update.message.reply_text("An export for this chat is already queued.")
+                return
+            await update.message.reply_text("⏳ Export started, the files will follow.")
+            return
+        await update.message.reply_text("⏳ Exporting...")
+        try:
+            await self._send_export(**payload)
+        except Exception as e:
+            logger.error("Error exporting to chat %s: %s", chat_id, e)
+            await update.message.reply_text("❌ Export failed, see the bot log.")
+    
     async def chat_member_updated(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handle chat member updates (join/leave events)"""
         result = update.chat_member
@@ -608,78 +831,163 @@ class BotHandlers:
         user_id = result.new_chat_member.user.id
         old_status = result.old_chat_member.status
         new_status = result.new_chat_member.status
+        # Updates can arrive out of order; the change's date decides which one is current
+        changed_at = int(result.date.timestamp())
 
         # User joined the channel
         if old_status in ['left', 'kicked'] and new_status in ['member', 'administrator', 'creator']:
-            logger.info(f"User {user_id} joined the channel")
-
             # Update database and check for referral
-            referrer_id = self.referral_system.handle_user_joined_channel(user_id)
+            first_join, referrer_id = self.referral_system.handle_user_joined_channel(user_id, changed_at)
+            if not first_join:
+                logger.info("User %s joined the channel again; already welcomed", user_id)
+                return
+            logger.info("User %s joined the channel", user_id)
+            if referrer_id:
+                await self._record_campaign_referral(referrer_id, user_id)
 
-            # Send welcome message if user exists in our system
-            user = self.db.get_user(user_id)
-            if user:
-                try:
-                    # Get or create unique invite link for this user
-                    stored_invite_link = self.db.get_invite_link(user_id)
-                    if stored_invite_link:
-                        referral_link = stored_invite_link
-                    else:
-                        # Create new unique invite link
-                        referral_code = user['referral_code']
-                        invite_link_name = f"Referral-{referral_code}"
-                        referral_link = await self.telegram_utils.create_unique_invite_link(name=invite_link_name)
-
-                        # Store the invite link in database
-                        self.db.store_invite_link(user_id, referral_code, referral_link, invite_link_name)
-
-                    chat_info = await self.telegram_utils.get_chat_info()
-                    channel_name = chat_info['title'] if chat_info else "our channel"
-                    # Multilingual welcome message
-                    user_lang = self.language_manager.get_user_language(user_id)
-                    message = self.multilingual_messages.get_message(
-                        user_lang,
-                        "channel_joined_success",
-                        channel_name=channel_name,
-                        referral_link=referral_link,
-                        target=self.config.referral_target
-                    )
-                    await self.telegram_utils.send_message_safe(user_id, message)
-
-                    # Notify referrer if applicable
-                    if referrer_id:
-                        referrer = self.db.get_user(referrer_id)
-                        if referrer:
-                            progress = self.referral_system.get_referral_progress(referrer_id, self.config.referral_target)
-                            if progress['target_reached'] and not referrer['reward_claimed']:
-                                notify_message = self.messages.REWARD_AVAILABLE
-                            else:
-                                notify_message = (
-                                    "🎉 Great news! Someone joined using your referral link!\n\n"
-                                    f"Your progress: {progress['active_referrals']}/{progress['target']}"
-                                )
-                            await self.telegram_utils.send_message_safe(referrer_id, notify_message)
-                except Exception as e:
-                    logger.error(f"Error sending welcome or notify message for user {user_id}: {e}")
+            # Welcome the user and tell the referrer, off the update path when jobs are enabled
+            await self._run_or_queue('channel_welcome', {'user_id': user_id}, self._send_channel_welcome)
+            if referrer_id:
+                await self._run_or_queue('referrer_joined', {'referrer_id': referrer_id}, self._notify_referrer_joined)
 
         # User left the channel
         elif old_status in ['member', 'administrator', 'creator'] and new_status in ['left', 'kicked']:
-            logger.info(f"User {user_id} left the channel")
-
-            # Update database and notify affected referrers
-            affected_referrers = self.referral_system.handle_user_left_channel(user_id)
-
-            # Notify referrers about the change
-            for ref_id in affected_referrers:
-                try:
-                    progress = self.referral_system.get_referral_progress(ref_id, self.config.referral_target)
-                    notify_message = (
-                        "📉 One of your referrals left the channel.\n\n"
-                        f"Your current progress: {progress['active_referrals']}/{progress['target']}"
-                    )
-                    await self.telegram_utils.send_message_safe(ref_id, notify_message)
-                except Exception as e:
-                    logger.error(f"Error notifying referrer {ref_id}: {e}")
+            logger.info("User %s left the channel", user_id)
+            await self._apply_channel_leave(user_id, changed_at)
+
+    async def _apply_channel_leave(self, user_id: int, changed_at: int) -> None:
+        """Record a channel leave and notify the referrers it affects"""
+        affected_referrers = self.referral_system.handle_user_left_channel(user_id, changed_at)
+        self.campaign_manager.record_referral_left(user_id)
+
+        # Notify referrers about the change
+        for ref_id in affected_referrers:
+            await self._run_or_queue('referrer_left', {'referrer_id': ref_id}, self._notify_referrer_left)
+
+    async def _run_or_queue(self, kind: str, payload: dict, job) -> None:
+        """Queue a background job, or run it now when there is no job queue"""
+        if self.jobs and self.jobs.enqueue(kind, payload) is not None:
+            return
+        try:
+            await job(**payload)
+        except Exception as e:
+            logger.error("Error running %s job %s: %s", kind, payload, e)
+
+    async def _send_job_message(self, user_id: int, text: str) -> None:
+        """Send from a job: network errors raise so the job is retried, a blocked bot is only logged"""
+        try:
+            await self.telegram_utils.bot.send_message(user_id, text)
+        except (BadRequest, Forbidden) as e:
+            logger.warning("Failed to send message to user %s: %s", user_id, e)
+
+    async def _send_channel_welcome(self, user_id: int) -> None:
+        """Welcome a user who joined the channel and give them their own invite link"""
+        user = self.db.get_user(user_id)
+        if not user:
+            return
+        # Get or create unique invite link for this user
+        stored_invite_link = self.db.get_invite_link(user_id)
+        if stored_invite_link:
+            referral_link = stored_invite_link
+        else:
+            # Create new unique invite link
+            referral_code = user['referral_code']
+            invite_link_name = f"Referral-{referral_code}"
+            referral_link = await self.telegram_utils.create_unique_invite_link(name=invite_link_name)
+
+            # Store the invite link in database
+            self.db.store_invite_link(user_id, referral_code, referral_link, invite_link_name)
+
+        chat_info = await self.telegram_utils.get_chat_info()
+        channel_name = chat_info['title'] if chat_info else "our channel"
+        # Multilingual welcome message
+        user_lang = self.language_manager.get_user_language(user_id)
+        message = self.multilingual_messages.get_message(
+            user_lang,
+            "channel_joined_success",
+            channel_name=channel_name,
+            referral_link=referral_link,
+            target=self.config.referral_target
+        )
+        await self._send_job_message(user_id, message)
+
+    async def _notify_referrer_joined(self, referrer_id: int) -> None:
+        """Tell a referrer that someone joined through their link"""
+        referrer = self.db.get_user(referrer_id)
+        if not referrer:
+            return
+        progress = self.referral_system.get_referral_progress(referrer_id, self.config.referral_target)
+        if progress['target_reached'] and not referrer['reward_claimed']:
+            notify_message = self.messages.REWARD_AVAILABLE
+        else:
+            notify_message = (
+                "🎉 Great news! Someone joined using your referral link!\n\n"
+                f"Your progress: {progress['active_referrals']}/{progress['target']}"
+            )
+        await self._send_job_message(referrer_id, notify_message)
+
+    async def _notify_referrer_left(self, referrer_id: int) -> None:
+        """Tell a referrer that one of their referrals left the channel"""
+        progress = self.referral_system.get_referral_progress(referrer_id, self.config.referral_target)
+        notify_message = (
+            "📉 One of your referrals left the channel.\n\n"
+            f"Your current progress: {progress['active_referrals']}/{progress['target']}"
+        )
+        await self._send_job_message(referrer_id, notify_message)
+    
+    async def _send_export(self, chat_id: int, fmt: str, tables: Optional[list] = None) -> None:
+        """Export tables to a temporary directory and send each file to the chat"""
+        bot = self.telegram_utils.bot
+        with tempfile.TemporaryDirectory(prefix='export_') as directory:
+            result = await asyncio.to_thread(export_database, self.db, directory, fmt, tables)
+            for table, exported in result.items():
+                size = os.path.getsize(exported['path'])
+                if size > EXPORT_DOCUMENT_LIMIT:
+                    await bot.send_message(chat_id, f"{table}: {exported['rows']} rows, {size / 1e6:.0f} MB, too large "
+                                                    f"to send; run python -m telegramreferralpro.export on the server.")
+                    continue
+                with open(exported['path'], 'rb') as f:
+                    await bot.send_document(chat_id, f, filename=os.path.basename(exported['path']),
+                                            caption=f"{table}: {exported['rows']} rows")
+    
+    async def throttle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Drop commands and button taps from users who exceed their rate limit"""
+        if update.callback_query:
+            user = update.callback_query.from_user
+        elif update.message and update.message.text and update.message.text.startswith('/'):
+            user = update.effective_user
+        else:
+            # Channel membership updates and plain messages are never throttled
+            return
+        if not user or self.throttle.allow(user.id):
+            return
+
+        if update.callback_query:
+            # The button spinner has to be stopped anyway; the toast text is rendered once per language
+            user_lang = self.language_manager.get_user_language(user.id)
+            try:
+                await update.callback_query.answer(render_static_message(user_lang, "throttled"))
+            except Exception as e:
+                logger.debug("Could not answer throttled callback from user %s: %s", user.id, e)
+        raise ApplicationHandlerStop
+
+    def get_throttle_handler(self) -> TypeHandler:
+        """Handler to register in a group before get_handlers() so it runs first"""
+        return TypeHandler(Update, self.throttle_update)
+    
+    def register_metrics(self, registry) -> None:
+        """Export cache and throttle counters to a MetricsRegistry"""
+        from .metrics import CallbackGauge, lru_cache_stats
+        registry.register_cache('status_render', lru_cache_stats(render_status_message))
+        registry.register_cache('static_message', lru_cache_stats(render_static_message))
+        registry.register_cache('user_language', lambda: (self.language_manager.cache_hits,
+                                                          self.language_manager.cache_misses))
+        # A "hit" is an edit that was skipped because the message already showed that content
+        registry.register_cache('edit_fingerprint', lambda: (self.skipped_edits, self.sent_edits))
+        registry.add(CallbackGauge(
+            'bot_throttle_decisions', 'Commands and callbacks allowed or dropped by the rate limiter', ('result',),
+            lambda: {('allowed',): self.throttle.allowed, ('throttled',): self.throttle.throttled}
+        ))
     
     def get_handlers(self) -> list:
         """Get all bot handlers"""
@@ -690,6 +998,10 @@ class BotHandlers:
             CommandHandler("help", self.help_command),
             CommandHandler("language", self.language_command),
             CommandHandler("admin_stats", self.admin_stats_command),
+            CommandHandler("admin_queries", self.admin_queries_command),
+            CommandHandler("admin_jobs", self.admin_jobs_command),
+            CommandHandler("admin_report", self.admin_report_command),
+            CommandHandler("admin_export", self.admin_export_command),
             # Handle all button callbacks first
             CallbackQueryHandler(self.button_callback, pattern="^(refresh_status|claim_reward|help|my_link|share_success)$"),
             # Handle language selection callbacks
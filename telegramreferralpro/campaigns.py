@@ -0,0 +1,300 @@
+"""Time-windowed referral campaigns with tiered reward targets"""
+
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def utc_now() -> datetime:
+    """Current UTC time as a naive datetime (matches SQLite CURRENT_TIMESTAMP)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Parse an ISO timestamp from config or the database"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@dataclass(frozen=True)
+class CampaignTier:
+    """A reward threshold inside a campaign"""
+    threshold: int
+    reward: str = ""
+
+@dataclass
+class Campaign:
+    """A referral campaign running between two points in time"""
+    campaign_id: int
+    name: str
+    title: str
+    starts_at: datetime
+    ends_at: Optional[datetime] = None
+    tiers: List[CampaignTier] = field(default_factory=list)
+
+    def is_running(self, now: datetime) -> bool:
+        """Check if the campaign window contains the given time"""
+        if now < self.starts_at:
+            return False
+        return self.ends_at is None or now < self.ends_at
+
+    def tier_for(self, active_referrals: int) -> int:
+        """Number of tiers unlocked by the given count"""
+        return sum(1 for tier in self.tiers if active_referrals >= tier.threshold)
+
+    def next_tier(self, active_referrals: int) -> Optional[CampaignTier]:
+        """Next tier still to be reached, if any"""
+        for tier in self.tiers:
+            if active_referrals < tier.threshold:
+                return tier
+        return None
+
+class CampaignManager:
+    """Keep per-campaign referral counters up to date on every referral event"""
+
+    def __init__(self, database):
+        self.db = database
+        self._campaigns: List[Campaign] = []
+        self.reload()
+
+    def reload(self) -> None:
+        """Load enabled campaigns into memory"""
+        campaigns = []
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, name, title, starts_at, ends_at, tiers FROM campaigns
+                    WHERE is_enabled = TRUE ORDER BY starts_at, id
+                ''')
+                for row in cursor.fetchall():
+                    tiers = [CampaignTier(int(t['threshold']), t.get('reward', ''))
+                             for t in json.loads(row['tiers'] or '[]')]
+                    campaigns.append(Campaign(
+                        campaign_id=row['id'],
+                        name=row['name'],
+                        title=row['title'] or row['name'],
+                        starts_at=parse_timestamp(row['starts_at']),
+                        ends_at=parse_timestamp(row['ends_at']),
+                        tiers=sorted(tiers, key=lambda t: t.threshold)
+                    ))
+        except Exception as e:
+            logger.error("Error loading campaigns: %s", e)
+        self._campaigns = campaigns
+
+    def sync_campaigns(self, definitions: List[dict]) -> None:
+        """Create or update campaigns from configuration, keyed by name"""
+        if not definitions:
+            return
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                for definition in definitions:
+                    starts_at = parse_timestamp(definition.get('start')) or utc_now()
+                    ends_at = parse_timestamp(definition.get('end'))
+                    tiers = sorted(
+                        ({'threshold': int(t['threshold']), 'reward': t.get('reward', '')}
+                         for t in definition.get('tiers', [])),
+                        key=lambda t: t['threshold']
+                    )
+                    cursor.execute('''
+                        INSERT INTO campaigns (name, title, starts_at, ends_at, tiers, is_enabled)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET
+                            title = excluded.title,
+                            starts_at = excluded.starts_at,
+                            ends_at = excluded.ends_at,
+                            tiers = excluded.tiers,
+                            is_enabled = excluded.is_enabled
+                    ''', (
+                        definition['name'],
+                        definition.get('title', definition['name']),
+                        starts_at.strftime(TIMESTAMP_FORMAT),
+                        ends_at.strftime(TIMESTAMP_FORMAT) if ends_at else None,
+                        json.dumps(tiers, ensure_ascii=False),
+                        bool(definition.get('enabled', True))
+                    ))
+                conn.commit()
+        except Exception as e:
+            logger.error("Error syncing campaigns: %s", e)
+        self.reload()
+
+    def get_running_campaigns(self, now: Optional[datetime] = None) -> List[Campaign]:
+        """Campaigns whose window contains the given time"""
+        now = now or utc_now()
+        return [c for c in self._campaigns if c.is_running(now)]
+
+    def record_referral_joined(self, referrer_id: int, referred_user_id: int,
+                               now: Optional[datetime] = None) -> List[Tuple[Campaign, CampaignTier]]:
+        """Credit an active referral to every running campaign, returning newly unlocked tiers
+
+        A referral is credited once per campaign. Like the referral itself, a
+        credit that lapsed when the user left is not reactivated by a rejoin.
+        """
+        running = self.get_running_campaigns(now)
+        if not running:
+            return []
+
+        unlocked = []
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                for campaign in running:
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO campaign_credits (campaign_id, referrer_id, referred_user_id)
+                        VALUES (?, ?, ?)
+                    ''', (campaign.campaign_id, referrer_id, referred_user_id))
+                    if not cursor.rowcount:
+                        continue
+
+                    cursor.execute('''
+                        INSERT INTO campaign_progress (campaign_id, user_id, referrals, active_referrals)
+                        VALUES (?, ?, 1, 1)
+                        ON CONFLICT(campaign_id, user_id) DO UPDATE SET
+                            referrals = referrals + 1,
+                            active_referrals = active_referrals + 1,
+                            updated_at = CURRENT_TIMESTAMP
+                        RETURNING active_referrals, tier_reached
+                    ''', (campaign.campaign_id, referrer_id))
+                    active_referrals, tier_reached = cursor.fetchone()
+
+                    new_tier = campaign.tier_for(active_referrals)
+                    if new_tier > tier_reached:
+                        cursor.execute('''
+                            UPDATE campaign_progress SET tier_reached = ?
+                            WHERE campaign_id = ? AND user_id = ?
+                        ''', (new_tier, campaign.campaign_id, referrer_id))
+                        unlocked.extend((campaign, tier) for tier in campaign.tiers[tier_reached:new_tier])
+                conn.commit()
+        except Exception as e:
+            logger.error("Error recording campaign referral for %s: %s", referrer_id, e)
+            return []
+        return unlocked
+
+    def record_referral_left(self, referred_user_id: int) -> None:
+        """Drop a departed referral from the active counters of the campaigns it was credited to"""
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE campaign_credits SET is_active = FALSE
+                    WHERE referred_user_id = ? AND is_active = TRUE
+                    RETURNING campaign_id, referrer_id
+                ''', (referred_user_id,))
+                for campaign_id, referrer_id in cursor.fetchall():
+                    cursor.execute('''
+                        UPDATE campaign_progress
+                        SET active_referrals = MAX(active_referrals - 1, 0), updated_at = CURRENT_TIMESTAMP
+                        WHERE campaign_id = ? AND user_id = ?
+                    ''', (campaign_id, referrer_id))
+                conn.commit()
+        except Exception as e:
+            logger.error("Error recording campaign departure for user %s: %s", referred_user_id, e)
+
+    def get_user_progress(self, user_id: int, now: Optional[datetime] = None) -> List[dict]:
+        """Progress of a user in every running campaign, read from the precomputed counters"""
+        running = self.get_running_campaigns(now)
+        if not running:
+            return []
+
+        counters: Dict[int, Tuple[int, int]] = {}
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT campaign_id, referrals, active_referrals FROM campaign_progress
+                    WHERE user_id = ?
+                ''', (user_id,))
+                for row in cursor.fetchall():
+                    counters[row['campaign_id']] = (row['referrals'], row['active_referrals'])
+        except Exception as e:
+            logger.error("Error getting campaign progress for user %s: %s", user_id, e)
+
+        progress = []
+        for campaign in running:
+            referrals, active_referrals = counters.get(campaign.campaign_id, (0, 0))
+            next_tier = campaign.next_tier(active_referrals)
+            progress.append({
+                'campaign': campaign,
+                'referrals': referrals,
+                'active_referrals': active_referrals,
+                'tier_reached': campaign.tier_for(active_referrals),
+                'next_tier': next_tier,
+                'target': next_tier.threshold if next_tier else (campaign.tiers[-1].threshold if campaign.tiers else 0),
+            })
+        return progress
+
+    def rebuild_counters(self) -> None:
+        """Recompute campaign_progress from the credits table
+
+        Credits of referrals that are inactive in the referrals table are
+        deactivated first, so a credit never counts while its referral does not.
+        """
+        # Referrals may live on other shards than the campaign tables (shard 0)
+        inactive = []
+        for shard in self.db.shards:
+            try:
+                with shard.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT referrer_id, referred_user_id FROM referrals WHERE is_active = FALSE')
+                    inactive.extend(tuple(row) for row in cursor.fetchall())
+            except Exception as e:
+                logger.error("Error reading inactive referrals of %s: %s", shard.db_path, e)
+                return
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    UPDATE campaign_credits SET is_active = FALSE
+                    WHERE referrer_id = ? AND referred_user_id = ? AND is_active = TRUE
+                ''', inactive)
+                cursor.execute('DELETE FROM campaign_progress')
+                cursor.execute('''
+                    INSERT INTO campaign_progress (campaign_id, user_id, referrals, active_referrals)
+                    SELECT campaign_id, referrer_id, COUNT(*), SUM(is_active = TRUE)
+                    FROM campaign_credits GROUP BY campaign_id, referrer_id
+                ''')
+                conn.commit()
+        except Exception as e:
+            logger.error("Error rebuilding campaign counters: %s", e)
+            return
+
+        by_id = {c.campaign_id: c for c in self._campaigns}
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT campaign_id, user_id, active_referrals FROM campaign_progress')
+                updates = [
+                    (by_id[row['campaign_id']].tier_for(row['active_referrals']), row['campaign_id'], row['user_id'])
+                    for row in cursor.fetchall() if row['campaign_id'] in by_id
+                ]
+                cursor.executemany('''
+                    UPDATE campaign_progress SET tier_reached = ? WHERE campaign_id = ? AND user_id = ?
+                ''', updates)
+                conn.commit()
+        except Exception as e:
+            logger.error("Error recomputing campaign tiers: %s", e)
+
+def load_campaign_definitions(path: Optional[str]) -> List[dict]:
+    """Load campaign definitions from a JSON file"""
+    if not path:
+        return []
+    try:
+        with open(path, encoding='utf-8') as f:
+            definitions = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Error loading campaigns from %s: %s", path, e)
+        return []
+    if isinstance(definitions, dict):
+        definitions = definitions.get('campaigns', [])
+    return definitions
@@ -0,0 +1,230 @@
+"""Compiled, lazily loaded translation catalogs
+
+Translations live in locales/<lang>.toml. At build time they are compiled into
+locales/<lang>.catalog (a marshal dump of pre-parsed templates) with:
+
+    python -m telegramreferralpro.catalogs compile
+
+At runtime a catalog is loaded the first time its language is used. If the
+compiled file is missing or older than its source, the source is compiled in
+memory instead. Placeholders are checked against the English catalog at load
+time, so rendering is a plain join without any parsing.
+"""
+
+import logging
+import marshal
+import os
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+SOURCE_SUFFIX = '.toml'
+COMPILED_SUFFIX = '.catalog'
+CATALOG_FORMAT_VERSION = 1
+REFERENCE_LANGUAGE = 'en'
+
+class CompiledTemplate:
+    """A message template split into literal text and placeholder names"""
+    __slots__ = ('source', 'literals', 'fields')
+
+    def __init__(self, source: str, literals: Tuple[str, ...], fields: Tuple[str, ...]):
+        self.source = source
+        # literals has one more item than fields: lit0 field0 lit1 field1 ... litN
+        self.literals = literals
+        self.fields = fields
+
+    def render(self, values: dict) -> str:
+        """Substitute placeholders; raises KeyError if a value is missing"""
+        if not self.fields:
+            return self.source
+        literals = self.literals
+        parts = [literals[0]]
+        for index, field in enumerate(self.fields):
+            parts.append(str(values[field]))
+            parts.append(literals[index + 1])
+        return ''.join(parts)
+
+def compile_template(source: str) -> CompiledTemplate:
+    """Pre-parse a str.format style template with plain {name} placeholders"""
+    import string
+    literals = []
+    fields = []
+    pending = ''
+    for literal, field, format_spec, conversion in string.Formatter().parse(source):
+        pending += literal
+        if field is None:
+            continue
+        if not field.isidentifier() or format_spec or conversion:
+            raise ValueError(f"Unsupported placeholder {{{field}}} in template")
+        literals.append(pending)
+        fields.append(field)
+        pending = ''
+    literals.append(pending)
+    return CompiledTemplate(source, tuple(literals), tuple(fields))
+
+def compile_catalog(messages: Dict[str, str], reference: Optional[Dict[str, CompiledTemplate]] = None,
+                    lang: str = '') -> Dict[str, CompiledTemplate]:
+    """Compile every message of a language, validating placeholders against the reference catalog"""
+    compiled = {}
+    for key, source in messages.items():
+        try:
+            template = compile_template(source)
+        except ValueError as e:
+            logger.warning("Skipping message %s in language %s: %s", key, lang, e)
+            continue
+
+        expected = reference.get(key) if reference else None
+        if expected is not None:
+            unknown = set(template.fields) - set(expected.fields)
+            if unknown:
+                # Callers never pass these, so the translation could not render
+                logger.warning("Message %s in language %s uses unknown placeholders %s; using %s instead",
+                               key, lang, sorted(unknown), REFERENCE_LANGUAGE)
+                continue
+            missing = set(expected.fields) - set(template.fields)
+            if missing:
+                logger.warning("Message %s in language %s is missing placeholders %s", key, lang, sorted(missing))
+        compiled[key] = template
+
+    # Untranslated keys fall back to the reference language without a second lookup at render time
+    if reference:
+        for key, template in reference.items():
+            compiled.setdefault(key, template)
+    return compiled
+
+def _load_source(path: str) -> Dict[str, str]:
+    """Read a TOML message catalog"""
+    import tomllib
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+def _source_stamps(locales_dir: str, lang: str) -> dict:
+    """mtime/size of the sources a compiled catalog depends on (its own and the reference)"""
+    stamps = {}
+    for name in {lang, REFERENCE_LANGUAGE}:
+        path = os.path.join(locales_dir, name + SOURCE_SUFFIX)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamps[name] = (stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+def _dump_compiled(catalog: Dict[str, CompiledTemplate], locales_dir: str, lang: str) -> None:
+    """Write a compiled catalog next to its source"""
+    path = os.path.join(locales_dir, lang + COMPILED_SUFFIX)
+    data = {
+        'version': CATALOG_FORMAT_VERSION,
+        'sources': _source_stamps(locales_dir, lang),
+        'messages': {key: (t.source, t.literals, t.fields) for key, t in catalog.items()},
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        marshal.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _load_compiled(locales_dir: str, lang: str) -> Optional[Dict[str, CompiledTemplate]]:
+    """Read a compiled catalog if it is present and up to date with its sources"""
+    path = os.path.join(locales_dir, lang + COMPILED_SUFFIX)
+    try:
+        with open(path, 'rb') as f:
+            data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != CATALOG_FORMAT_VERSION:
+        return None
+    stamps = _source_stamps(locales_dir, lang)
+    # A deployment may ship compiled catalogs only; otherwise they must match the sources
+    if stamps and data.get('sources') != stamps:
+        return None
+    return {key: CompiledTemplate(*entry) for key, entry in data['messages'].items()}
+
+class CatalogStore:
+    """Load each language's compiled catalog on first use"""
+
+    def __init__(self, locales_dir: str = LOCALES_DIR):
+        self.locales_dir = locales_dir
+        self._catalogs: Dict[str, Dict[str, CompiledTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def available(self, lang: str) -> bool:
+        """Check if a catalog exists for the language"""
+        return (os.path.exists(os.path.join(self.locales_dir, lang + SOURCE_SUFFIX))
+                or os.path.exists(os.path.join(self.locales_dir, lang + COMPILED_SUFFIX)))
+
+    def get(self, lang: str) -> Dict[str, CompiledTemplate]:
+        """Catalog for a language, falling back to the reference language"""
+        catalog = self._catalogs.get(lang)
+        if catalog is not None:
+            return catalog
+        with self._lock:
+            catalog = self._catalogs.get(lang)
+            if catalog is None:
+                catalog = self._load(lang)
+                self._catalogs[lang] = catalog
+        return catalog
+
+    def _load(self, lang: str) -> Dict[str, CompiledTemplate]:
+        """Load one catalog (caller holds the lock)"""
+        reference = None
+        if lang != REFERENCE_LANGUAGE:
+            reference = self._catalogs.get(REFERENCE_LANGUAGE)
+            if reference is None:
+                reference = self._catalogs[REFERENCE_LANGUAGE] = self._load(REFERENCE_LANGUAGE)
+            if not self.available(lang):
+                # Languages without translations share the reference catalog object
+                return reference
+
+        source_path = os.path.join(self.locales_dir, lang + SOURCE_SUFFIX)
+        catalog = _load_compiled(self.locales_dir, lang)
+        if catalog is not None:
+            logger.debug("Loaded compiled catalog for %s", lang)
+            return catalog
+
+        try:
+            messages = _load_source(source_path)
+        except (OSError, ValueError) as e:
+            logger.error("Error loading catalog for language %s: %s", lang, e)
+            return reference or {}
+        logger.debug("Compiling catalog for %s from source", lang)
+        return compile_catalog(messages, reference, lang)
+
+    def clear(self) -> None:
+        """Forget loaded catalogs (e.g. after recompiling)"""
+        with self._lock:
+            self._catalogs.clear()
+
+def compile_all(locales_dir: str = LOCALES_DIR) -> Dict[str, int]:
+    """Compile every source catalog in the directory; returns message counts per language"""
+    sources = sorted(name[:-len(SOURCE_SUFFIX)] for name in os.listdir(locales_dir) if name.endswith(SOURCE_SUFFIX))
+    reference_path = os.path.join(locales_dir, REFERENCE_LANGUAGE + SOURCE_SUFFIX)
+    reference = compile_catalog(_load_source(reference_path), lang=REFERENCE_LANGUAGE)
+
+    counts = {}
+    for lang in sources:
+        source_path = os.path.join(locales_dir, lang + SOURCE_SUFFIX)
+        if lang == REFERENCE_LANGUAGE:
+            catalog = reference
+        else:
+            catalog = compile_catalog(_load_source(source_path), reference, lang)
+        _dump_compiled(catalog, locales_dir, lang)
+        counts[lang] = len(catalog)
+    return counts
+
+def main(argv=None):
+    """Command line entry point"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Compile translation catalogs")
+    parser.add_argument('command', choices=['compile'])
+    parser.add_argument('--locales-dir', default=LOCALES_DIR)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+    counts = compile_all(args.locales_dir)
+    for lang, count in counts.items():
+        print(f"{lang}: {count} messages")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,33 @@
+import json
 import os
-from dataclasses import dataclass
-from typing import Optional
-try:
-    from dotenv import load_dotenv
-except Exception:
-    def load_dotenv(*args, **kwargs):  # fallback no-op if python-dotenv is unavailable
-        return False
+from dataclasses import dataclass, fields
+from typing import List, Optional
 
-# Load environment variables from .env file (no-op if dotenv not installed)
-load_dotenv()
+def _find_env_file() -> Optional[str]:
+    """Nearest .env in this package's directory or its parents (where python-dotenv looks)"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        candidate = os.path.join(directory, '.env')
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+def _load_env_file() -> None:
+    """Load the .env file, importing python-dotenv only when there is one to read"""
+    env_file = _find_env_file()
+    if not env_file:
+        return
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        return  # python-dotenv is optional; the environment is used as is
+    load_dotenv(env_file)
+
+# Load environment variables from .env file (no-op if there is none or dotenv is not installed)
+_load_env_file()
 
 @dataclass
 class BotConfig:
@@ -22,6 +41,20 @@ class BotConfig:
     database_path: str = "bot_database.db"
     webhook_url: Optional[str] = None
     port: int = 8000
+    campaigns_file: Optional[str] = None
+    throttle_rate: float = 1.0
+    throttle_burst: int = 5
+    metrics_port: Optional[int] = None
+    query_profiling: bool = False
+    slow_query_ms: float = 100.0
+    backfill_chunk_ms: float = 50.0
+    workers: int = 1
+    database_shards: int = 1
+    webhook_queue_size: int = 10000
+    webhook_concurrency: int = 8
+    webhook_spill_path: Optional[str] = None
+    job_concurrency: int = 4
+    membership_recheck_seconds: int = 86400
 
 def load_config() -> BotConfig:
     """Load configuration from environment variables"""
@@ -51,5 +84,47 @@ def load_config() -> BotConfig:
         referral_target=referral_target,
         reward_message=reward_message,
         webhook_url=os.getenv("WEBHOOK_URL"),
-        port=int(os.getenv("PORT", "8000"))
+        port=int(os.getenv("PORT", "8000")),
+        campaigns_file=os.getenv("CAMPAIGNS_FILE"),
+        throttle_rate=float(os.getenv("THROTTLE_RATE", "1.0")),
+        throttle_burst=int(os.getenv("THROTTLE_BURST", "5")),
+        metrics_port=int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None,
+        query_profiling=os.getenv("QUERY_PROFILING", "").lower() in ("1", "true", "yes"),
+        slow_query_ms=float(os.getenv("SLOW_QUERY_MS", "100")),
+        backfill_chunk_ms=float(os.getenv("BACKFILL_CHUNK_MS", "50")),
+        workers=int(os.getenv("WORKERS", "1")),
+        database_shards=int(os.getenv("DATABASE_SHARDS", "1")),
+        webhook_queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+        webhook_concurrency=int(os.getenv("WEBHOOK_CONCURRENCY", "8")),
+        webhook_spill_path=os.getenv("WEBHOOK_SPILL_DB") or None,
+        job_concurrency=int(os.getenv("JOB_CONCURRENCY", "4")),
+        membership_recheck_seconds=int(os.getenv("MEMBERSHIP_RECHECK_SECONDS", "86400"))
     )
+
+def load_tenant_configs(path: str) -> List[BotConfig]:
+    """Load one BotConfig per bot from a JSON list (see multitenant.py)"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get('tenants', [])
+    
+    known_fields = {f.name for f in fields(BotConfig)}
+    configs = []
+    for index, entry in enumerate(entries):
+        unknown = set(entry) - known_fields
+        if unknown:
+            raise ValueError(f"Tenant {index}: unknown settings {', '.join(sorted(unknown))}")
+        for required in ("bot_token", "channel_id", "channel_username"):
+            if not entry.get(required):
+                raise ValueError(f"Tenant {index}: {required} is required")
+        entry = dict(entry)
+        entry.setdefault("admin_user_ids", [])
+        # Tenants never share a database file
+        entry.setdefault("database_path", f"bot_{str(entry['channel_username']).lstrip('@')}.db")
+        configs.append(BotConfig(**entry))
+    
+    for attribute in ("bot_token", "database_path"):
+        values = [getattr(config, attribute) for config in configs]
+        if len(values) != len(set(values)):
+            raise ValueError(f"Every tenant needs its own {attribute}")
+    return configs
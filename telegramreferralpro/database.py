@@ -1,108 +1,173 @@
 import sqlite3
+import json
 import logging
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import TYPE_CHECKING, Optional, List, Tuple
 from contextlib import contextmanager
 
+from .migrations import MigrationRunner, STARTUP_BACKFILL_SECONDS
+
+if TYPE_CHECKING:
+    from .profiling import QueryProfiler
+
 logger = logging.getLogger(__name__)
 
+# Event types written to channel_events alongside the state change they describe
+EVENT_USER_UPSERTED = 'user_upserted'
+EVENT_MEMBERSHIP_UPDATED = 'membership_updated'
+EVENT_REFERRAL_ADDED = 'referral_added'
+EVENT_REFERRAL_DEACTIVATED = 'referral_deactivated'
+EVENT_REWARD_CLAIMED = 'reward_claimed'
+
+# Columns of the stats row and the counts they track
+STATS_QUERIES = {
+    'total_users': 'SELECT COUNT(*) FROM users',
+    'channel_members': 'SELECT COUNT(*) FROM users WHERE is_channel_member = TRUE',
+    'active_referrals': 'SELECT COUNT(*) FROM referrals WHERE is_active = TRUE',
+    'rewards_claimed': 'SELECT COUNT(*) FROM users WHERE reward_claimed = TRUE',
+}
+
 class Database:
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, profiler: Optional["QueryProfiler"] = None, migrate: bool = True):
         self.db_path = db_path
-        self.init_database()
+        self.profiler = profiler
+        # Backfills still in progress (see migrations.py); reads fall back to live queries meanwhile
+        self.pending_backfills = set()
+        if migrate:
+            self.init_database()
     
     def init_database(self):
-        """Initialize database tables"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Users table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    referral_code TEXT UNIQUE,
-                    referred_by INTEGER,
-                    join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_channel_member BOOLEAN DEFAULT FALSE,
-                    reward_claimed BOOLEAN DEFAULT FALSE,
-                    FOREIGN KEY (referred_by) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # Referrals table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS referrals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    referrer_id INTEGER,
-                    referred_user_id INTEGER,
-                    join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    FOREIGN KEY (referrer_id) REFERENCES users (user_id),
-                    FOREIGN KEY (referred_user_id) REFERENCES users (user_id),
-                    UNIQUE(referrer_id, referred_user_id)
-                )
-            ''')
-            
-            # Channel events table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS channel_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    event_type TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # Invite links table to track unique invite links
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS invite_links (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    referral_code TEXT,
-                    invite_link TEXT UNIQUE,
-                    invite_link_name TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            conn.commit()
-            logger.info("Database initialized successfully")
+        """Bring the schema up to date and run backfills for a bounded time"""
+        runner = MigrationRunner(self)
+        runner.migrate()
+        if self.pending_backfills:
+            # Whatever is left over finishes in the background once the bot is running
+            runner.run_backfills(time_budget=STARTUP_BACKFILL_SECONDS)
+        logger.info("Database initialized successfully")
     
     @contextmanager
     def get_connection(self):
         """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
+        if self.profiler:
+            from .profiling import ProfilingConnection
+            conn = sqlite3.connect(self.db_path, factory=ProfilingConnection)
+            conn.profiler = self.profiler
+        else:
+            conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         try:
             yield conn
         except Exception as e:
             conn.rollback()
-            logger.error(f"Database error: {e}")
+            logger.error("Database error: %s", e)
             raise
         finally:
             conn.close()
     
+    @property
+    def shards(self) -> List["Database"]:
+        """Files behind this database (see ShardedDatabase)"""
+        return [self]
+    
+    def for_user(self, user_id: int) -> "Database":
+        """Database holding this user's rows"""
+        return self
+    
+    def enable_wal(self) -> bool:
+        """Switch the database file to write-ahead logging (the mode is stored in the file)"""
+        try:
+            with self.get_connection() as conn:
+                mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+                return mode.lower() == 'wal'
+        except Exception as e:
+            logger.error("Error enabling WAL mode: %s", e)
+            return False
+
+    def _refresh_referral_counters(self, cursor, referrer_id: int) -> None:
+        """Recount one referrer's active/total referrals inside the caller's transaction"""
+        cursor.execute('''
+            INSERT OR REPLACE INTO referral_counters (user_id, active_referrals, total_referrals)
+            SELECT ?,
+                (SELECT COUNT(*) FROM referrals r
+                 JOIN users u ON r.referred_user_id = u.user_id
+                 WHERE r.referrer_id = ? AND r.is_active = TRUE AND u.is_channel_member = TRUE),
+                (SELECT COUNT(*) FROM referrals WHERE referrer_id = ?)
+        ''', (referrer_id, referrer_id, referrer_id))
+    
+    def _refresh_counters_for_referred_user(self, cursor, referred_user_id: int) -> None:
+        """Recount the referrers whose active count depends on this user's membership"""
+        cursor.execute('SELECT referrer_id FROM referrals WHERE referred_user_id = ?', (referred_user_id,))
+        for (referrer_id,) in cursor.fetchall():
+            self._refresh_referral_counters(cursor, referrer_id)
+    
+    def _rebuild_referral_counters(self, cursor) -> None:
+        """Recompute every referral counter"""
+        cursor.execute('DELETE FROM referral_counters')
+        cursor.execute('''
+            INSERT INTO referral_counters (user_id, active_referrals, total_referrals)
+            SELECT r.referrer_id,
+                SUM(r.is_active = TRUE AND COALESCE(u.is_channel_member, FALSE) = TRUE),
+                COUNT(*)
+            FROM referrals r LEFT JOIN users u ON r.referred_user_id = u.user_id
+            GROUP BY r.referrer_id
+        ''')
+    
+    def rebuild_referral_counters(self) -> bool:
+        """Recompute every referral counter from the referrals table"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._rebuild_referral_counters(cursor)
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error("Error rebuilding referral counters: %s", e)
+            return False
+    
+    def _adjust_stats(self, cursor, **deltas) -> None:
+        """Add to the stats row inside the caller's transaction"""
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if deltas:
+            assignments = ', '.join(f'{name} = {name} + ?' for name in deltas)
+            cursor.execute(f'UPDATE stats SET {assignments} WHERE id = 1', tuple(deltas.values()))
+    
+    def _append_event(self, cursor, user_id: int, event_type: str, payload: dict = None) -> None:
+        """Append an event to the log inside the caller's transaction"""
+        cursor.execute('''
+            INSERT INTO channel_events (user_id, event_type, payload)
+            VALUES (?, ?, ?)
+        ''', (user_id, event_type, json.dumps(payload) if payload is not None else None))
+    
     def add_user(self, user_id: int, username: str = None, first_name: str = None, 
                  last_name: str = None, referral_code: str = None, referred_by: int = None) -> bool:
         """Add a new user to the database"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute('SELECT is_channel_member, reward_claimed FROM users WHERE user_id = ?', (user_id,))
+                previous = cursor.fetchone()
                 cursor.execute('''
                     INSERT OR REPLACE INTO users 
                     (user_id, username, first_name, last_name, referral_code, referred_by)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (user_id, username, first_name, last_name, referral_code, referred_by))
+                # A replaced row starts over as a non-member that has not claimed its reward
+                self._adjust_stats(cursor, total_users=0 if previous else 1,
+                                   channel_members=-1 if previous and previous['is_channel_member'] else 0,
+                                   rewards_claimed=-1 if previous and previous['reward_claimed'] else 0)
+                self._append_event(cursor, user_id, EVENT_USER_UPSERTED, {
+                    'username': username,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'referral_code': referral_code,
+                    'referred_by': referred_by
+                })
+                # INSERT OR REPLACE resets membership, which can change a referrer's active count
+                self._refresh_counters_for_referred_user(cursor, user_id)
                 conn.commit()
                 return True
         except Exception as e:
-            logger.error(f"Error adding user {user_id}: {e}")
+            logger.error("Error adding user %s: %s", user_id, e)
             return False
     
     def get_user(self, user_id: int) -> Optional[sqlite3.Row]:
@@ -113,7 +178,7 @@ class Database:
                 cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
                 return cursor.fetchone()
         except Exception as e:
-            logger.error(f"Error getting user {user_id}: {e}")
+            logger.error("Error getting user %s: %s", user_id, e)
             return None
     
     def get_user_by_referral_code(self, referral_code: str) -> Optional[sqlite3.Row]:
@@ -124,21 +189,79 @@ class Database:
                 cursor.execute('SELECT * FROM users WHERE referral_code = ?', (referral_code,))
                 return cursor.fetchone()
         except Exception as e:
-            logger.error(f"Error getting user by referral code {referral_code}: {e}")
+            logger.error("Error getting user by referral code %s: %s", referral_code, e)
             return None
     
     def update_channel_membership(self, user_id: int, is_member: bool) -> bool:
-        """Update user's channel membership status"""
+        """Update user's channel membership status (as just checked with Telegram)"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    UPDATE users SET is_channel_member = ? WHERE user_id = ?
-                ''', (is_member, user_id))
+                    UPDATE users SET is_channel_member = ?, membership_updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                    WHERE user_id = ? AND is_channel_member IS NOT ?
+                ''', (is_member, user_id, is_member))
+                if cursor.rowcount:
+                    self._adjust_stats(cursor, channel_members=1 if is_member else -1)
+                    self._append_event(cursor, user_id, EVENT_MEMBERSHIP_UPDATED, {'is_member': bool(is_member)})
+                    self._refresh_counters_for_referred_user(cursor, user_id)
+                else:
+                    # Unchanged: only record that the stored flag was confirmed just now
+                    cursor.execute('''
+                        UPDATE users SET membership_updated_at = CAST(strftime('%s', 'now') AS INTEGER)
+                        WHERE user_id = ?
+                    ''', (user_id,))
                 conn.commit()
                 return True
         except Exception as e:
-            logger.error(f"Error updating channel membership for user {user_id}: {e}")
+            logger.error("Error updating channel membership for user %s: %s", user_id, e)
+            return False
+    
+    def record_membership_change(self, user_id: int, is_member: bool, changed_at: int) -> bool:
+        """Apply a dated join/leave unless a later one was already applied
+
+        Returns True only when the stored membership changed, so stale,
+        repeated and unknown-user changes are all False.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users SET is_channel_member = ?, membership_updated_at = ?
+                    WHERE user_id = ? AND is_channel_member IS NOT ?
+                      AND (membership_updated_at IS NULL OR membership_updated_at <= ?)
+                ''', (is_member, changed_at, user_id, is_member, changed_at))
+                changed = cursor.rowcount > 0
+                if changed:
+                    self._adjust_stats(cursor, channel_members=1 if is_member else -1)
+                    self._append_event(cursor, user_id, EVENT_MEMBERSHIP_UPDATED,
+                                       {'is_member': bool(is_member), 'changed_at': changed_at})
+                    self._refresh_counters_for_referred_user(cursor, user_id)
+                else:
+                    # Same state, newer date: move the mark forward so older opposite changes stay ignored
+                    cursor.execute('''
+                        UPDATE users SET membership_updated_at = ?
+                        WHERE user_id = ? AND is_channel_member IS ?
+                          AND (membership_updated_at IS NULL OR membership_updated_at < ?)
+                    ''', (changed_at, user_id, is_member, changed_at))
+                conn.commit()
+                return changed
+        except Exception as e:
+            logger.error("Error recording membership change for user %s: %s", user_id, e)
+            return False
+    
+    def mark_channel_joined(self, user_id: int, joined_at: int) -> bool:
+        """Record a user's first channel join; True only the first time, whatever the membership flag says"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    UPDATE users SET channel_joined_at = ? WHERE user_id = ? AND channel_joined_at IS NULL
+                ''', (joined_at, user_id))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error("Error marking channel join for user %s: %s", user_id, e)
             return False
     
     def add_referral(self, referrer_id: int, referred_user_id: int) -> bool:
@@ -150,10 +273,15 @@ class Database:
                     INSERT OR IGNORE INTO referrals (referrer_id, referred_user_id)
                     VALUES (?, ?)
                 ''', (referrer_id, referred_user_id))
+                added = cursor.rowcount > 0
+                if added:
+                    self._adjust_stats(cursor, active_referrals=1)
+                    self._append_event(cursor, referred_user_id, EVENT_REFERRAL_ADDED, {'referrer_id': referrer_id})
+                    self._refresh_referral_counters(cursor, referrer_id)
                 conn.commit()
-                return cursor.rowcount > 0
+                return added
         except Exception as e:
-            logger.error(f"Error adding referral: {e}")
+            logger.error("Error adding referral: %s", e)
             return False
     
     def get_referral_stats(self, user_id: int) -> Tuple[int, int]:
@@ -162,38 +290,46 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Active referrals (users still in channel)
+                # Active referrals count only users still in the channel; both are kept in referral_counters
                 cursor.execute('''
-                    SELECT COUNT(*) FROM referrals r
-                    JOIN users u ON r.referred_user_id = u.user_id
-                    WHERE r.referrer_id = ? AND r.is_active = TRUE AND u.is_channel_member = TRUE
+                    SELECT active_referrals, total_referrals FROM referral_counters WHERE user_id = ?
                 ''', (user_id,))
-                active_count = cursor.fetchone()[0]
-                
-                # Total referrals ever made
-                cursor.execute('''
-                    SELECT COUNT(*) FROM referrals WHERE referrer_id = ?
-                ''', (user_id,))
-                total_count = cursor.fetchone()[0]
-                
-                return active_count, total_count
+                row = cursor.fetchone()
+                if not row and 'referral_counters' in self.pending_backfills:
+                    # Not backfilled yet; count directly until the backfill reaches this referrer
+                    cursor.execute('''
+                        SELECT
+                            (SELECT COUNT(*) FROM referrals r
+                             JOIN users u ON r.referred_user_id = u.user_id
+                             WHERE r.referrer_id = ? AND r.is_active = TRUE AND u.is_channel_member = TRUE),
+                            (SELECT COUNT(*) FROM referrals WHERE referrer_id = ?)
+                    ''', (user_id, user_id))
+                    row = cursor.fetchone()
+                if not row:
+                    return 0, 0
+                return row[0], row[1]
         except Exception as e:
-            logger.error(f"Error getting referral stats for user {user_id}: {e}")
+            logger.error("Error getting referral stats for user %s: %s", user_id, e)
             return 0, 0
     
     def deactivate_referral(self, referrer_id: int, referred_user_id: int) -> bool:
-        """Deactivate a referral when user leaves channel"""
+        """Deactivate a referral when user leaves channel; True if it was active"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
                     UPDATE referrals SET is_active = FALSE 
-                    WHERE referrer_id = ? AND referred_user_id = ?
+                    WHERE referrer_id = ? AND referred_user_id = ? AND is_active = TRUE
                 ''', (referrer_id, referred_user_id))
+                deactivated = cursor.rowcount > 0
+                if deactivated:
+                    self._adjust_stats(cursor, active_referrals=-1)
+                    self._append_event(cursor, referred_user_id, EVENT_REFERRAL_DEACTIVATED, {'referrer_id': referrer_id})
+                    self._refresh_referral_counters(cursor, referrer_id)
                 conn.commit()
-                return True
+                return deactivated
         except Exception as e:
-            logger.error(f"Error deactivating referral: {e}")
+            logger.error("Error deactivating referral: %s", e)
             return False
     
     def mark_reward_claimed(self, user_id: int) -> bool:
@@ -202,29 +338,97 @@ class Database:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    UPDATE users SET reward_claimed = TRUE WHERE user_id = ?
+                    UPDATE users SET reward_claimed = TRUE WHERE user_id = ? AND reward_claimed IS NOT TRUE
                 ''', (user_id,))
+                if cursor.rowcount:
+                    self._adjust_stats(cursor, rewards_claimed=1)
+                    self._append_event(cursor, user_id, EVENT_REWARD_CLAIMED)
                 conn.commit()
                 return True
         except Exception as e:
-            logger.error(f"Error marking reward claimed for user {user_id}: {e}")
+            logger.error("Error marking reward claimed for user %s: %s", user_id, e)
             return False
     
-    def log_channel_event(self, user_id: int, event_type: str) -> bool:
+    def log_channel_event(self, user_id: int, event_type: str, payload: dict = None) -> bool:
         """Log channel events (join/leave)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._append_event(cursor, user_id, event_type, payload)
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error("Error logging channel event: %s", e)
+            return False
+    
+    def get_update_window(self, name: str) -> Optional[sqlite3.Row]:
+        """Get a saved update_id window (see dedup.py)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT base, bitmap, polling_offset FROM update_windows WHERE name = ?', (name,))
+                return cursor.fetchone()
+        except Exception as e:
+            logger.error("Error getting update window %s: %s", name, e)
+            return None
+    
+    def save_update_window(self, name: str, base: int, bitmap: bytes, polling_offset: Optional[int]) -> bool:
+        """Save an update_id window and the polling offset that goes with it"""
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute('''
-                    INSERT INTO channel_events (user_id, event_type)
-                    VALUES (?, ?)
-                ''', (user_id, event_type))
+                    INSERT OR REPLACE INTO update_windows (name, base, bitmap, polling_offset, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (name, base, bitmap, polling_offset))
                 conn.commit()
                 return True
         except Exception as e:
-            logger.error(f"Error logging channel event: {e}")
+            logger.error("Error saving update window %s: %s", name, e)
             return False
     
+    def get_stats(self) -> dict:
+        """Admin totals from the stats row, counted live until it has been verified once"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT * FROM stats WHERE id = 1')
+                row = cursor.fetchone()
+                if row is None or row['verified_at'] is None:
+                    return {name: cursor.execute(query).fetchone()[0] for name, query in STATS_QUERIES.items()}
+                return {name: row[name] for name in STATS_QUERIES}
+        except Exception as e:
+            logger.error("Error getting stats: %s", e)
+            return {name: 0 for name in STATS_QUERIES}
+    
+    def verify_stats(self) -> Optional[dict]:
+        """Recount the stats row and correct any drift; returns the corrections made
+
+        The row and the counts are read in one transaction, so writes
+        committed meanwhile are in neither; adding the difference afterwards
+        keeps their updates. In WAL mode the recount does not block writers.
+        """
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN')
+                cursor.execute('SELECT * FROM stats WHERE id = 1')
+                row = cursor.fetchone()
+                counted = {name: cursor.execute(query).fetchone()[0] for name, query in STATS_QUERIES.items()}
+                conn.commit()
+                drift = {name: counted[name] - row[name] for name in STATS_QUERIES if counted[name] != row[name]}
+                self._adjust_stats(cursor, **drift)
+                cursor.execute('''
+                    UPDATE stats SET verified_at = CURRENT_TIMESTAMP, corrections = corrections + ? WHERE id = 1
+                ''', (1 if drift else 0,))
+                conn.commit()
+        except Exception as e:
+            logger.error("Error verifying stats: %s", e)
+            return None
+        if drift and row['verified_at'] is not None:
+            logger.warning("Corrected stats drift in %s: %s", self.db_path, drift)
+        return drift
+    
     def get_all_users_count(self) -> int:
         """Get total number of users"""
         try:
@@ -233,7 +437,7 @@ class Database:
                 cursor.execute('SELECT COUNT(*) FROM users')
                 return cursor.fetchone()[0]
         except Exception as e:
-            logger.error(f"Error getting user count: {e}")
+            logger.error("Error getting user count: %s", e)
             return 0
     
     def get_channel_members_count(self) -> int:
@@ -244,7 +448,29 @@ class Database:
                 cursor.execute('SELECT COUNT(*) FROM users WHERE is_channel_member = TRUE')
                 return cursor.fetchone()[0]
         except Exception as e:
-            logger.error(f"Error getting channel members count: {e}")
+            logger.error("Error getting channel members count: %s", e)
+            return 0
+    
+    def get_active_referrals_count(self) -> int:
+        """Get number of active referrals"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM referrals WHERE is_active = TRUE')
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error("Error getting active referrals count: %s", e)
+            return 0
+    
+    def get_rewards_claimed_count(self) -> int:
+        """Get number of users who claimed their reward"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM users WHERE reward_claimed = TRUE')
+                return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error("Error getting rewards claimed count: %s", e)
             return 0
     
     def store_invite_link(self, user_id: int, referral_code: str, invite_link: str, invite_link_name: str) -> bool:
@@ -260,7 +486,7 @@ class Database:
                 conn.commit()
                 return True
         except Exception as e:
-            logger.error(f"Error storing invite link for user {user_id}: {e}")
+            logger.error("Error storing invite link for user %s: %s", user_id, e)
             return False
     
     def get_invite_link(self, user_id: int) -> Optional[str]:
@@ -276,7 +502,7 @@ class Database:
                 result = cursor.fetchone()
                 return result[0] if result else None
         except Exception as e:
-            logger.error(f"Error getting invite link for user {user_id}: {e}")
+            logger.error("Error getting invite link for user %s: %s", user_id, e)
             return None
     
     def get_referrer_by_invite_link_name(self, invite_link_name: str) -> Optional[int]:
@@ -291,5 +517,5 @@ class Database:
                 result = cursor.fetchone()
                 return result[0] if result else None
         except Exception as e:
-            logger.error(f"Error getting referrer by invite link name {invite_link_name}: {e}")
+            logger.error("Error getting referrer by invite link name %s: %s", invite_link_name, e)
             return None
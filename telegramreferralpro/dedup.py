@@ -0,0 +1,163 @@
+"""Drop Telegram updates that were already processed
+
+update_ids of one bot increase by one per update, so the ones seen recently
+fit in a bitmap: bit i is set once update base + i has been accepted. The
+window slides forward as newer ids arrive, keeping the older half; ids up
+to one window width behind it count as already seen, since Telegram only
+redelivers recent updates. An id further back means the sequence started
+over (Telegram picks a new random start after about a week without updates,
+and a new bot token brings its own sequence): the window and the polling
+offset are reset to it. WINDOW_BITS ids cost WINDOW_BITS / 8 bytes.
+
+UpdateDeduplicator keeps one bot's window in the update_windows table,
+saved every SAVE_INTERVAL seconds and on stop together with the next
+polling offset. After a restart, polling resumes from that offset and
+redelivered updates are still recognized. Updates processed after the last
+save may run again after a crash; membership changes are ordered by date
+and tolerate that.
+"""
+
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+WINDOW_BITS = 1 << 16
+SAVE_INTERVAL = 1.0
+
+class UpdateIdWindow:
+    """Bitmap of the update_ids accepted in a sliding window"""
+
+    def __init__(self, bits: int = WINDOW_BITS, base: Optional[int] = None, bitmap: Optional[bytes] = None):
+        self.bits = bits
+        # First id covered; set from the first id added, with room for slightly older ones
+        self.base = base
+        self._bitmap = bytearray(bitmap) if bitmap and len(bitmap) == bits // 8 else bytearray(bits // 8)
+        self.highest: Optional[int] = None
+
+    def __contains__(self, update_id) -> bool:
+        if update_id is None or self.base is None:
+            return False
+        offset = update_id - self.base
+        if offset < 0:
+            return offset >= -self.bits
+        if offset >= self.bits:
+            return False
+        return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def add(self, update_id) -> None:
+        if update_id is None:
+            return
+        if self.restarted(update_id):
+            logger.warning("update_id %s is far below the window starting at %s; "
+                           "assuming a new update sequence", update_id, self.base)
+            self.reset()
+        if self.base is None:
+            self.base = update_id - self.bits // 2
+        offset = update_id - self.base
+        if offset < 0:
+            return
+        if offset >= self.bits:
+            self._slide(update_id)
+            offset = update_id - self.base
+        self._bitmap[offset >> 3] |= 1 << (offset & 7)
+        if self.highest is None or update_id > self.highest:
+            self.highest = update_id
+
+    def restarted(self, update_id: int) -> bool:
+        """Whether update_id is more than a window width below the window"""
+        return self.base is not None and update_id - self.base < -self.bits
+
+    def reset(self) -> None:
+        """Forget every id; the next one added starts a new window"""
+        self.base = None
+        self._bitmap = bytearray(self.bits // 8)
+        self.highest = None
+
+    def _slide(self, update_id: int) -> None:
+        """Move the window so update_id lands in its upper half"""
+        shift = (update_id - self.bits // 2 - self.base) & ~7
+        if shift >= self.bits:
+            self._bitmap = bytearray(self.bits // 8)
+        else:
+            self._bitmap = self._bitmap[shift >> 3:] + bytearray(shift >> 3)
+        self.base += shift
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bitmap)
+
+class UpdateDeduplicator:
+    """One bot's update window, loaded from and saved to the database"""
+
+    def __init__(self, database, name: str = 'bot', bits: int = WINDOW_BITS):
+        self.database = database
+        self.name = name
+        self.window = UpdateIdWindow(bits)
+        self.duplicates = 0
+        self._dirty = False
+        row = database.get_update_window(name)
+        if row is not None:
+            self.window = UpdateIdWindow(bits, row['base'], row['bitmap'])
+            if row['polling_offset'] is not None:
+                self.window.highest = row['polling_offset'] - 1
+
+    @property
+    def polling_offset(self) -> Optional[int]:
+        """Offset that confirms every update accepted so far"""
+        return self.window.highest + 1 if self.window.highest is not None else None
+
+    def seen(self, update_id) -> bool:
+        return update_id in self.window
+
+    def mark(self, update_id) -> None:
+        self.window.add(update_id)
+        self._dirty = True
+
+    def save(self) -> bool:
+        """Persist the window if it changed since the last save"""
+        if not self._dirty or self.window.base is None:
+            return True
+        self._dirty = False
+        if not self.database.save_update_window(self.name, self.window.base, self.window.to_bytes(),
+                                                self.polling_offset):
+            self._dirty = True
+            return False
+        return True
+
+    async def run(self, interval: float = SAVE_INTERVAL) -> None:
+        """Save periodically until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            self.save()
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """TypeHandler callback stopping updates that were already processed"""
+        if self.seen(update.update_id):
+            self.duplicates += 1
+            logger.info("Dropping duplicate update %s", update.update_id)
+            raise ApplicationHandlerStop
+        self.mark(update.update_id)
+
+    async def confirm_polling_offset(self, bot) -> None:
+        """Tell Telegram which updates were processed before the restart"""
+        offset = self.polling_offset
+        if offset is None:
+            return
+        try:
+            # Peeking without an offset confirms nothing. After a restarted sequence the saved
+            # offset is above every pending update and would confirm them all; the window is
+            # reset when the first of them is marked
+            pending = await bot.get_updates(limit=1, timeout=0)
+            if pending and self.window.restarted(pending[0].update_id):
+                logger.warning("Pending update %s is far below the saved offset %s; not confirming it",
+                               pending[0].update_id, offset)
+                return
+            # getUpdates with an offset confirms every earlier update; the one returned is fetched again
+            await bot.get_updates(offset=offset, limit=1, timeout=0)
+            logger.info("Resuming polling from update %s", offset)
+        except Exception as e:
+            logger.warning("Could not confirm polling offset %s: %s", offset, e)
@@ -0,0 +1,306 @@
+"""Rebuild users and referrals from the channel_events log
+
+The replay engine keeps a projection of the state derived from the event log
+(projection_users / projection_referrals) together with the id of the last
+event folded into it. Advancing the projection only replays events written
+since the last snapshot, and a rebuild copies the projection over the live
+tables in a single transaction. The tables are created by migration 9, and
+the bot advances the snapshot every jobs.SNAPSHOT_INTERVAL seconds.
+
+Usage:
+    python -m telegramreferralpro.event_replay status
+    python -m telegramreferralpro.event_replay snapshot
+    python -m telegramreferralpro.event_replay rebuild [--from-scratch]
+"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+
+from .database import (
+    Database,
+    EVENT_USER_UPSERTED,
+    EVENT_MEMBERSHIP_UPDATED,
+    EVENT_REFERRAL_ADDED,
+    EVENT_REFERRAL_DEACTIVATED,
+    EVENT_REWARD_CLAIMED,
+)
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = ('user_id', 'username', 'first_name', 'last_name', 'referral_code', 'referred_by',
+                'join_date', 'is_channel_member', 'reward_claimed')
+# Bookkeeping the events do not carry, kept from the live rows across a rebuild
+KEPT_USER_COLUMNS = ('membership_updated_at', 'channel_joined_at')
+
+class EventReplayer:
+    """Fold channel_events into a snapshot projection and restore it into the live tables"""
+
+    def __init__(self, database: Database, batch_size: int = 50000):
+        self.db = database
+        self.batch_size = batch_size
+
+    def get_snapshot_position(self) -> Optional[int]:
+        """Id of the last event folded into the snapshot, or None if there is no snapshot"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT last_event_id FROM event_snapshots WHERE id = 1')
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def seed_from_live_state(self) -> int:
+        """Start the projection from the current live tables (upgrade path for existing databases)"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM channel_events')
+            last_event_id = cursor.fetchone()[0]
+            cursor.execute('DELETE FROM projection_users')
+            cursor.execute('DELETE FROM projection_referrals')
+            cursor.execute(f'''
+                INSERT INTO projection_users ({', '.join(USER_COLUMNS)})
+                SELECT {', '.join(USER_COLUMNS)} FROM users
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO projection_referrals (referrer_id, referred_user_id, join_date, is_active)
+                SELECT referrer_id, referred_user_id, join_date, is_active FROM referrals
+            ''')
+            cursor.execute('''
+                INSERT OR REPLACE INTO event_snapshots (id, last_event_id, created_at)
+                VALUES (1, ?, CURRENT_TIMESTAMP)
+            ''', (last_event_id,))
+            conn.commit()
+        logger.info("Event snapshot seeded from live state at event %s", last_event_id)
+        return last_event_id
+
+    def unlogged_rows(self) -> Dict[str, int]:
+        """Live users and referrals whose creation is not in the log (written before event logging began)"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            users = cursor.execute('''
+                SELECT COUNT(*) FROM users
+                WHERE user_id NOT IN (SELECT user_id FROM channel_events WHERE event_type = ?)
+            ''', (EVENT_USER_UPSERTED,)).fetchone()[0]
+            referrals = cursor.execute('''
+                SELECT COUNT(*) FROM referrals
+                WHERE (referrer_id, referred_user_id) NOT IN (
+                    SELECT json_extract(payload, '$.referrer_id'), user_id FROM channel_events WHERE event_type = ?
+                )
+            ''', (EVENT_REFERRAL_ADDED,)).fetchone()[0]
+        return {'users': users, 'referrals': referrals}
+
+    def reset(self) -> None:
+        """Drop the snapshot so the next advance replays the whole log"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM projection_users')
+            cursor.execute('DELETE FROM projection_referrals')
+            cursor.execute('INSERT OR REPLACE INTO event_snapshots (id, last_event_id) VALUES (1, 0)')
+            conn.commit()
+
+    def advance(self, max_events: Optional[int] = None) -> int:
+        """Fold events written since the last snapshot into the projection; returns events applied"""
+        position = self.get_snapshot_position()
+        if position is None:
+            self.seed_from_live_state()
+            return 0
+
+        applied = 0
+        while max_events is None or applied < max_events:
+            limit = self.batch_size if max_events is None else min(self.batch_size, max_events - applied)
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT id, user_id, event_type, payload, timestamp FROM channel_events
+                    WHERE id > ? ORDER BY id LIMIT ?
+                ''', (position, limit))
+                events = cursor.fetchall()
+                if not events:
+                    break
+                self._apply_batch(cursor, events)
+                position = events[-1]['id']
+                # Every batch is its own snapshot, so an interrupted replay resumes where it stopped
+                cursor.execute('''
+                    UPDATE event_snapshots SET last_event_id = ?, created_at = CURRENT_TIMESTAMP WHERE id = 1
+                ''', (position,))
+                conn.commit()
+            applied += len(events)
+        return applied
+
+    def _apply_batch(self, cursor, events) -> None:
+        """Collapse a batch of events per key and write the result with a few executemany calls"""
+        # user_id -> full replacement row (dict), or None if only field updates were seen
+        replaced: Dict[int, dict] = {}
+        updated: Dict[int, dict] = {}
+        # (referrer_id, referred_user_id) -> join_date / is_active
+        inserted: Dict[Tuple[int, int], Tuple[str, bool]] = {}
+        deactivated = set()
+
+        for event in events:
+            user_id = event['user_id']
+            event_type = event['event_type']
+            if event_type == EVENT_USER_UPSERTED:
+                payload = json.loads(event['payload'] or '{}')
+                replaced[user_id] = {
+                    'user_id': user_id,
+                    'username': payload.get('username'),
+                    'first_name': payload.get('first_name'),
+                    'last_name': payload.get('last_name'),
+                    'referral_code': payload.get('referral_code'),
+                    'referred_by': payload.get('referred_by'),
+                    'join_date': event['timestamp'],
+                    'is_channel_member': False,
+                    'reward_claimed': False,
+                }
+                updated.pop(user_id, None)
+            elif event_type == EVENT_MEMBERSHIP_UPDATED:
+                payload = json.loads(event['payload'] or '{}')
+                self._set_user_field(replaced, updated, user_id, 'is_channel_member', bool(payload.get('is_member')))
+            elif event_type == EVENT_REWARD_CLAIMED:
+                self._set_user_field(replaced, updated, user_id, 'reward_claimed', True)
+            elif event_type == EVENT_REFERRAL_ADDED:
+                payload = json.loads(event['payload'] or '{}')
+                key = (payload.get('referrer_id'), user_id)
+                if key not in inserted:
+                    # INSERT OR IGNORE semantics: only the first insert of a pair counts
+                    inserted[key] = (event['timestamp'], True)
+            elif event_type == EVENT_REFERRAL_DEACTIVATED:
+                payload = json.loads(event['payload'] or '{}')
+                key = (payload.get('referrer_id'), user_id)
+                if key in inserted:
+                    inserted[key] = (inserted[key][0], False)
+                deactivated.add(key)
+            # Other event types (joined/left audit entries) carry no state
+
+        if replaced:
+            cursor.executemany(f'''
+                INSERT OR REPLACE INTO projection_users ({', '.join(USER_COLUMNS)})
+                VALUES ({', '.join('?' * len(USER_COLUMNS))})
+            ''', [tuple(row[column] for column in USER_COLUMNS) for row in replaced.values()])
+        for field in ('is_channel_member', 'reward_claimed'):
+            rows = [(fields[field], user_id) for user_id, fields in updated.items() if field in fields]
+            if rows:
+                cursor.executemany(f'UPDATE projection_users SET {field} = ? WHERE user_id = ?', rows)
+
+        # Updates only touch rows that existed before this batch, inserts only rows that did not
+        if deactivated:
+            cursor.executemany('''
+                UPDATE projection_referrals SET is_active = FALSE
+                WHERE referrer_id = ? AND referred_user_id = ?
+            ''', list(deactivated))
+        if inserted:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO projection_referrals (referrer_id, referred_user_id, join_date, is_active)
+                VALUES (?, ?, ?, ?)
+            ''', [(key[0], key[1], join_date, is_active) for key, (join_date, is_active) in inserted.items()])
+
+    @staticmethod
+    def _set_user_field(replaced: dict, updated: dict, user_id: int, field: str, value) -> None:
+        """Apply a field update on top of whatever is pending for the user in this batch"""
+        if user_id in replaced:
+            replaced[user_id][field] = value
+        else:
+            updated.setdefault(user_id, {})[field] = value
+
+    def rebuild(self, from_scratch: bool = False) -> dict:
+        """Replay the log and overwrite users/referrals with the result
+
+        A from-scratch replay only knows rows created while the log was being
+        written, so it is refused (ValueError) while older rows exist; the
+        snapshot seeded from the live tables covers those.
+        """
+        started = time.perf_counter()
+        if from_scratch:
+            unlogged = self.unlogged_rows()
+            if any(unlogged.values()):
+                raise ValueError(f"{unlogged['users']} users and {unlogged['referrals']} referrals predate the event "
+                                 f"log and would be lost; rebuild without --from-scratch")
+            self.reset()
+        applied = self.advance()
+
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            # Events written between advance() and the lock are folded in under the lock
+            position = cursor.execute('SELECT last_event_id FROM event_snapshots WHERE id = 1').fetchone()[0]
+            cursor.execute('SELECT id, user_id, event_type, payload, timestamp FROM channel_events WHERE id > ? ORDER BY id',
+                           (position,))
+            tail = cursor.fetchall()
+            if tail:
+                self._apply_batch(cursor, tail)
+                cursor.execute('UPDATE event_snapshots SET last_event_id = ? WHERE id = 1', (tail[-1]['id'],))
+                applied += len(tail)
+
+            cursor.execute(f'''
+                CREATE TEMP TABLE kept_users AS SELECT user_id, {', '.join(KEPT_USER_COLUMNS)} FROM users
+            ''')
+            cursor.execute('DELETE FROM users')
+            cursor.execute(f'''
+                INSERT INTO users ({', '.join(USER_COLUMNS + KEPT_USER_COLUMNS)})
+                SELECT {', '.join(f'p.{column}' for column in USER_COLUMNS)},
+                       {', '.join(f'k.{column}' for column in KEPT_USER_COLUMNS)}
+                FROM projection_users p LEFT JOIN kept_users k ON k.user_id = p.user_id
+            ''')
+            cursor.execute('DROP TABLE kept_users')
+            cursor.execute('DELETE FROM referrals')
+            cursor.execute('''
+                INSERT INTO referrals (referrer_id, referred_user_id, join_date, is_active)
+                SELECT referrer_id, referred_user_id, join_date, is_active FROM projection_referrals
+            ''')
+            cursor.execute('SELECT COUNT(*) FROM users')
+            users = cursor.fetchone()[0]
+            cursor.execute('SELECT COUNT(*) FROM referrals')
+            referrals = cursor.fetchone()[0]
+            conn.commit()
+
+        self._rebuild_counters()
+        result = {
+            'events_replayed': applied,
+            'users': users,
+            'referrals': referrals,
+            'seconds': round(time.perf_counter() - started, 3),
+        }
+        logger.info("State rebuilt from event log: %s", result)
+        return result
+
+    def _rebuild_counters(self) -> None:
+        """Recompute counters derived from users/referrals"""
+        from .campaigns import CampaignManager
+        self.db.rebuild_referral_counters()
+        self.db.verify_stats()
+        CampaignManager(self.db).rebuild_counters()
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Rebuild bot state from the channel_events log")
+    parser.add_argument('command', choices=['status', 'snapshot', 'rebuild'])
+    parser.add_argument('--db', default='bot_database.db', help="Path to the SQLite database")
+    parser.add_argument('--from-scratch', action='store_true',
+                        help="Ignore the snapshot and replay the whole log")
+    parser.add_argument('--batch-size', type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    replayer = EventReplayer(Database(args.db), batch_size=args.batch_size)
+
+    if args.command == 'status':
+        with replayer.db.get_connection() as conn:
+            last_event_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM channel_events').fetchone()[0]
+        position = replayer.get_snapshot_position()
+        print(json.dumps({
+            'last_event_id': last_event_id,
+            'snapshot_event_id': position,
+            'events_behind': last_event_id - (position or 0),
+        }))
+    elif args.command == 'snapshot':
+        print(json.dumps({'events_applied': replayer.advance(), 'snapshot_event_id': replayer.get_snapshot_position()}))
+    else:
+        try:
+            print(json.dumps(replayer.rebuild(from_scratch=args.from_scratch)))
+        except ValueError as e:
+            parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
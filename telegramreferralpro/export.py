@@ -0,0 +1,472 @@
+"""Streaming export and bulk import of bot data
+
+Export writes users, referrals, invite links and the event log as gzip
+CSV or JSONL. Rows are read in pages of EXPORT_PAGE_SIZE ordered by the
+table's key, each page starting after the last key of the previous one, in
+its own short read transaction; memory stays constant and writers are never
+held up for long. The result is not a point-in-time snapshot: a row changed
+during the export is written as it was when its page was read.
+
+Import reads the same files (or ones produced by other referral tools with
+a subset of the columns) and upserts them in batches of IMPORT_BATCH_SIZE
+rows, one transaction per batch and shard. Every batch also appends the
+matching channel_events rows, so event_replay rebuilds keep imported data.
+Users without a referral code get one. Existing codes and join dates are
+kept, and referrals are never reactivated. Referral counters and the stats
+row are recomputed once at the end.
+
+Usage:
+    python -m telegramreferralpro.export export --out backup/ [--format jsonl] [--tables users,referrals]
+    python -m telegramreferralpro.export import users.csv.gz [--table users]
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import itertools
+import json
+import logging
+import operator
+import os
+import time
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .database import (
+    EVENT_USER_UPSERTED,
+    EVENT_MEMBERSHIP_UPDATED,
+    EVENT_REFERRAL_ADDED,
+    EVENT_REFERRAL_DEACTIVATED,
+    EVENT_REWARD_CLAIMED,
+)
+
+logger = logging.getLogger(__name__)
+
+# Table -> key the export pages by
+EXPORT_TABLES = {
+    'users': 'user_id',
+    'referrals': 'id',
+    'invite_links': 'id',
+    'channel_events': 'id',
+}
+FORMATS = ('csv', 'jsonl')
+EXPORT_PAGE_SIZE = 5000
+IMPORT_BATCH_SIZE = 50000
+# Page cache of an import connection (negative: KiB), so index pages stay cached across a batch
+IMPORT_CACHE_KIB = -65536
+# Several times faster than the default level 9, for somewhat larger files
+GZIP_LEVEL = 1
+
+# Importable tables: columns, the unique key upserts match on, and the columns that must be present
+IMPORT_TABLES = {
+    'users': {
+        'columns': ('user_id', 'username', 'first_name', 'last_name', 'referral_code', 'referred_by',
+                    'join_date', 'is_channel_member', 'reward_claimed'),
+        'conflict': ('user_id',),
+        'required': ('user_id',),
+        'shard_by': 'user_id',
+    },
+    'referrals': {
+        'columns': ('referrer_id', 'referred_user_id', 'join_date', 'is_active'),
+        'conflict': ('referrer_id', 'referred_user_id'),
+        'required': ('referrer_id', 'referred_user_id'),
+        'shard_by': 'referred_user_id',
+    },
+    'invite_links': {
+        'columns': ('user_id', 'referral_code', 'invite_link', 'invite_link_name', 'created_at', 'is_active'),
+        'conflict': ('invite_link',),
+        'required': ('user_id', 'invite_link'),
+        'shard_by': 'user_id',
+    },
+}
+# IDs and flags are parsed in Python (malformed IDs skip the row); other values are normalized by the upsert
+INTEGER_COLUMNS = {'user_id', 'referred_by', 'referrer_id', 'referred_user_id'}
+# Empty booleans take the column default; empty timestamps become the time of the import
+BOOLEAN_DEFAULTS = {'is_channel_member': False, 'reward_claimed': False, 'is_active': True}
+TIMESTAMP_COLUMNS = {'join_date', 'created_at'}
+TRUE_VALUES = ('1', 'true', 't', 'yes', 'y')
+# Same shape as ReferralSystem.generate_referral_code, generated by SQLite for rows without one
+GENERATED_REFERRAL_CODE = "'ref_' || lower(hex(randomblob(6)))"
+
+def table_columns(database, table: str) -> List[str]:
+    """Column names of a table, in schema order"""
+    with database.shards[0].get_connection() as conn:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+def iter_pages(database, table: str, select: str, key_index: int,
+               page_size: int = EXPORT_PAGE_SIZE) -> Iterator[List[tuple]]:
+    """Pages of `select` over a table, shard by shard, in key order within each shard
+
+    key_index is the position of the table's key in `select`; the next page
+    starts after the key of the last row.
+    """
+    key = EXPORT_TABLES[table]
+    for shard in database.shards:
+        last = None
+        while True:
+            with shard.get_connection() as conn:
+                # Plain tuples: sqlite3.Row costs more than the query for wide pages
+                conn.row_factory = None
+                if last is None:
+                    page = conn.execute(f'SELECT {select} FROM {table} ORDER BY {key} LIMIT ?',
+                                        (page_size,)).fetchall()
+                else:
+                    page = conn.execute(f'SELECT {select} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?',
+                                        (last, page_size)).fetchall()
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            last = page[-1][key_index]
+
+def write_table(database, table: str, fileobj: IO[bytes], fmt: str = 'csv') -> int:
+    """Write a table to a binary file as gzip CSV or JSONL; returns the number of rows"""
+    columns = table_columns(database, table)
+    key = EXPORT_TABLES[table]
+    if fmt == 'jsonl':
+        # SQLite builds each line, so no Python object is created per value
+        select = f"json_object({', '.join(f'{column!r}, {column}' for column in columns)}), {key}"
+        key_index = 1
+    else:
+        select = ', '.join(columns)
+        key_index = columns.index(key)
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=GZIP_LEVEL) as compressed:
+        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        if fmt != 'jsonl':
+            writer.writerow(columns)
+        for page in iter_pages(database, table, select, key_index):
+            if fmt == 'jsonl':
+                text.write('\n'.join(row[0] for row in page))
+                text.write('\n')
+            else:
+                writer.writerows(page)
+            count += len(page)
+        text.flush()
+        text.detach()
+    return count
+
+def export_table(database, table: str, path: str, fmt: str = 'csv') -> int:
+    """Export one table to a gzip file; returns the number of rows"""
+    with open(path, 'wb') as f:
+        return write_table(database, table, f, fmt)
+
+def export_database(database, directory: str, fmt: str = 'csv', tables: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Export tables to <directory>/<table>.<fmt>.gz; returns the path and row count of each"""
+    os.makedirs(directory, exist_ok=True)
+    result = {}
+    for table in tables or EXPORT_TABLES:
+        started = time.perf_counter()
+        path = os.path.join(directory, f"{table}.{fmt}.gz")
+        rows = export_table(database, table, path, fmt)
+        result[table] = {'path': path, 'rows': rows, 'seconds': round(time.perf_counter() - started, 3)}
+        logger.info("Exported %s rows of %s to %s", rows, table, path)
+    return result
+
+def read_table(fileobj: IO[bytes], fmt: str = 'csv') -> Tuple[List[str], Iterator[Sequence]]:
+    """Column names and value rows of a CSV or JSONL file, gzip-compressed or not
+
+    JSONL columns are the keys of the first line.
+    """
+    stream = io.BufferedReader(fileobj) if not hasattr(fileobj, 'peek') else fileobj
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt != 'jsonl':
+        reader = csv.reader(text)
+        return next(reader, []), reader
+    records = (json.loads(line) for line in text if line.strip())
+    first = next(records, None)
+    if first is None:
+        return [], iter(())
+    columns = list(first)
+    rows = ([record.get(column) for column in columns] for record in records)
+    return columns, itertools.chain([[first[column] for column in columns]], rows)
+
+class BulkImporter:
+    """Upsert rows into a Database or ShardedDatabase in large batches"""
+
+    def __init__(self, database, table: str, batch_size: int = IMPORT_BATCH_SIZE):
+        if table not in IMPORT_TABLES:
+            raise ValueError(f"Cannot import into {table}")
+        self.db = database
+        self.table = table
+        self.spec = IMPORT_TABLES[table]
+        self.batch_size = batch_size
+        self.imported = 0
+        self.skipped = 0
+
+    def _columns(self, header: List[str]) -> tuple:
+        """Known columns present in the file (referral codes are always written for users)"""
+        columns = [column for column in self.spec['columns'] if column in header]
+        missing = [column for column in self.spec['required'] if column not in columns]
+        if missing:
+            raise ValueError(f"{self.table} rows need the columns {', '.join(missing)}")
+        if self.table == 'users' and 'referral_code' not in columns:
+            columns.append('referral_code')
+        return tuple(columns)
+
+    @staticmethod
+    def _value_sql(column: str, supplied: bool) -> str:
+        """Expression turning a CSV text or JSON value into what the column stores"""
+        if not supplied:
+            return GENERATED_REFERRAL_CODE
+        if column in INTEGER_COLUMNS or column in BOOLEAN_DEFAULTS:
+            return '?'
+        if column in TIMESTAMP_COLUMNS:
+            return "COALESCE(NULLIF(?, ''), CURRENT_TIMESTAMP)"
+        if column == 'referral_code':
+            return f"COALESCE(NULLIF(?, ''), {GENERATED_REFERRAL_CODE})"
+        return "NULLIF(?, '')"
+
+    def _upsert_sql(self, columns: tuple, header: List[str]) -> str:
+        conflict = self.spec['conflict']
+        assignments = []
+        for column in columns:
+            if column in conflict or column in TIMESTAMP_COLUMNS:
+                continue
+            if column == 'referral_code' and self.table == 'users':
+                assignments.append('referral_code = COALESCE(referral_code, excluded.referral_code)')
+            elif column == 'is_active' and self.table == 'referrals':
+                assignments.append('is_active = is_active AND excluded.is_active')
+            else:
+                assignments.append(f'{column} = excluded.{column}')
+        action = f"DO UPDATE SET {', '.join(assignments)}" if assignments else 'DO NOTHING'
+        values = [self._value_sql(column, column in header) for column in columns]
+        return f'''
+            INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({', '.join(values)})
+            ON CONFLICT ({', '.join(conflict)}) {action}
+        '''
+
+    def _append_events(self, cursor, rows: List[list], keys: list, previous: dict, last_id: int) -> None:
+        """Log what the batch did, the way the Database write methods would have
+
+        For referrals, previous holds the pairs that existed before the batch
+        and last_id the highest referral id then, so new pairs are the rows
+        after it.
+        """
+        if self.table == 'users':
+            batch = json.dumps(list(dict.fromkeys(keys)))
+            cursor.execute('''
+                INSERT INTO channel_events (user_id, event_type, timestamp, payload)
+                SELECT user_id, ?, COALESCE(join_date, CURRENT_TIMESTAMP),
+                       json_object('username', username, 'first_name', first_name, 'last_name', last_name,
+                                   'referral_code', referral_code, 'referred_by', referred_by)
+                FROM users WHERE user_id IN (SELECT value FROM json_each(?))
+            ''', (EVENT_USER_UPSERTED, batch))
+            # Replaying user_upserted resets these flags, so they are logged again after it
+            cursor.execute('''
+                INSERT INTO channel_events (user_id, event_type, timestamp, payload)
+                SELECT user_id, ?, COALESCE(join_date, CURRENT_TIMESTAMP), json_object('is_member', json('true'))
+                FROM users WHERE user_id IN (SELECT value FROM json_each(?)) AND is_channel_member = TRUE
+            ''', (EVENT_MEMBERSHIP_UPDATED, batch))
+            cursor.execute('''
+                INSERT INTO channel_events (user_id, event_type, timestamp)
+                SELECT user_id, ?, COALESCE(join_date, CURRENT_TIMESTAMP)
+                FROM users WHERE user_id IN (SELECT value FROM json_each(?)) AND reward_claimed = TRUE
+            ''', (EVENT_REWARD_CLAIMED, batch))
+        elif self.table == 'referrals':
+            cursor.execute('''
+                INSERT INTO channel_events (user_id, event_type, timestamp, payload)
+                SELECT referred_user_id, ?, COALESCE(join_date, CURRENT_TIMESTAMP),
+                       json_object('referrer_id', referrer_id)
+                FROM referrals WHERE id > ? ORDER BY id
+            ''', (EVENT_REFERRAL_ADDED, last_id))
+            # Only rows the file marks inactive can deactivate a pair that was active (or new)
+            if self._active_index is None:
+                return
+            deactivated = list(dict.fromkeys(key for row, key in zip(rows, keys)
+                                             if not row[self._active_index] and previous.get(key, True)))
+            if not deactivated:
+                return
+            cursor.execute('''
+                INSERT INTO channel_events (user_id, event_type, payload)
+                SELECT r.referred_user_id, ?, json_object('referrer_id', r.referrer_id)
+                FROM json_each(?) k
+                JOIN referrals r ON r.referrer_id = json_extract(k.value, '$[0]')
+                                AND r.referred_user_id = json_extract(k.value, '$[1]')
+                WHERE r.is_active = FALSE
+            ''', (EVENT_REFERRAL_DEACTIVATED, json.dumps(deactivated)))
+
+    def _before_batch(self, cursor, keys: list) -> Tuple[dict, int]:
+        """For referrals: is_active of the batch's pairs that already exist, and the highest id"""
+        if self.table != 'referrals':
+            return {}, 0
+        last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM referrals').fetchone()[0]
+        cursor.execute('''
+            SELECT r.referrer_id, r.referred_user_id, r.is_active
+            FROM json_each(?) k
+            JOIN referrals r ON r.referrer_id = json_extract(k.value, '$[0]')
+                            AND r.referred_user_id = json_extract(k.value, '$[1]')
+        ''', (json.dumps(keys),))
+        return {(row[0], row[1]): bool(row[2]) for row in cursor.fetchall()}, last_id
+
+    def _write(self, shard, rows: List[list]) -> None:
+        """Upsert one shard's part of a batch in one transaction"""
+        if len(self._key_indexes) == 1:
+            keys = [row[self._key_indexes[0]] for row in rows]
+        else:
+            keys = [tuple(row[index] for index in self._key_indexes) for row in rows]
+        with shard.get_connection() as conn:
+            cursor = conn.cursor()
+            # A batch that is lost in a power cut is imported again by re-running the import
+            cursor.execute('PRAGMA synchronous = NORMAL')
+            cursor.execute(f'PRAGMA cache_size = {IMPORT_CACHE_KIB}')
+            cursor.execute('BEGIN IMMEDIATE')
+            previous, last_id = self._before_batch(cursor, keys)
+            try:
+                cursor.executemany(self._sql, rows)
+            except Exception as e:
+                # One bad row (e.g. a referral code taken by another user) must not lose the batch
+                logger.warning("Batch of %s %s rows failed (%s), importing row by row", len(rows), self.table, e)
+                conn.rollback()
+                cursor.execute('BEGIN IMMEDIATE')
+                previous, last_id = self._before_batch(cursor, keys)
+                accepted = []
+                for row, key in zip(rows, keys):
+                    try:
+                        cursor.execute('SAVEPOINT row')
+                        cursor.execute(self._sql, row)
+                        cursor.execute('RELEASE row')
+                        accepted.append((row, key))
+                    except Exception as row_error:
+                        cursor.execute('ROLLBACK TO row')
+                        cursor.execute('RELEASE row')
+                        self.skipped += 1
+                        logger.warning("Skipping %s row %s: %s", self.table, key, row_error)
+                rows = [row for row, _ in accepted]
+                keys = [key for _, key in accepted]
+            if self.table != 'invite_links':
+                self._append_events(cursor, rows, keys, previous, last_id)
+            conn.commit()
+        self.imported += len(keys)
+
+    def _flush(self, batch: List[list]) -> None:
+        """Split a batch by shard and write each part"""
+        if len(self.db.shards) == 1:
+            self._write(self.db.shards[0], batch)
+            return
+        parts = {}
+        for row in batch:
+            shard = self.db.for_user(row[self._shard_index])
+            parts.setdefault(id(shard), (shard, []))[1].append(row)
+        for shard, rows in parts.values():
+            self._write(shard, rows)
+
+    def _invalidate_stats(self) -> None:
+        """Batches bypass the stats row; until it is recounted, /admin_stats counts the tables"""
+        for shard in self.db.shards:
+            with shard.get_connection() as conn:
+                conn.execute('UPDATE stats SET verified_at = NULL WHERE id = 1')
+                conn.commit()
+
+    def import_rows(self, header: List[str], rows: Iterable[Sequence]) -> dict:
+        """Upsert rows whose values follow header, then recompute the counters derived from them"""
+        started = time.perf_counter()
+        if not header:
+            # An empty file (an empty table exported as JSONL has no first line to take columns from)
+            return {'table': self.table, 'imported': 0, 'skipped': 0, 'rows_per_second': 0, 'seconds': 0.0}
+        columns = self._columns(header)
+        self._sql = self._upsert_sql(columns, header)
+        # Rows passed to the upsert hold the file's values in `columns` order (generated codes excluded)
+        supplied = [column for column in columns if column in header]
+        pick = operator.itemgetter(*(header.index(column) for column in supplied))
+        integers = [index for index, column in enumerate(supplied) if column in INTEGER_COLUMNS]
+        booleans = [(index, BOOLEAN_DEFAULTS[column]) for index, column in enumerate(supplied)
+                    if column in BOOLEAN_DEFAULTS]
+        self._key_indexes = [supplied.index(column) for column in self.spec['conflict']]
+        self._shard_index = supplied.index(self.spec['shard_by'])
+        self._active_index = supplied.index('is_active') if 'is_active' in supplied else None
+        if self.table != 'invite_links':
+            self._invalidate_stats()
+
+        batch = []
+        for row in rows:
+            try:
+                values = list(pick(row)) if len(supplied) > 1 else [pick(row)]
+                for index in integers:
+                    value = values[index]
+                    values[index] = int(value) if value is not None and value != '' else None
+                for index, default in booleans:
+                    value = values[index]
+                    values[index] = default if value is None or value == '' else str(value).strip().lower() in TRUE_VALUES
+            except (IndexError, TypeError, ValueError) as e:
+                self.skipped += 1
+                logger.warning("Skipping malformed %s row %s: %s", self.table, row, e)
+                continue
+            batch.append(values)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        if self.imported and self.table != 'invite_links':
+            self.db.rebuild_referral_counters()
+            self.db.verify_stats()
+        seconds = time.perf_counter() - started
+        result = {
+            'table': self.table,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'rows_per_second': round(self.imported / seconds) if seconds else 0,
+            'seconds': round(seconds, 3),
+        }
+        logger.info("Import finished: %s", result)
+        return result
+
+def detect_format(path: str) -> str:
+    """jsonl for *.jsonl / *.ndjson (gzip or not), csv otherwise; *.json is rejected"""
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.json'):
+        # A JSON array cannot be read line by line, and loading it whole defeats the streaming import
+        raise ValueError(f"{path}: JSON arrays are not supported, convert the file to JSONL "
+                         f"(one object per line, e.g. jq -c '.[]') or pass --format jsonl if it already is")
+    return 'jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+def import_file(database, path: str, table: Optional[str] = None, fmt: Optional[str] = None,
+                batch_size: int = IMPORT_BATCH_SIZE) -> dict:
+    """Import a CSV/JSONL file (gzip or not); the table defaults to the file name, e.g. users.csv.gz"""
+    table = table or os.path.basename(path).split('.')[0]
+    importer = BulkImporter(database, table, batch_size)
+    with open(path, 'rb') as f:
+        return importer.import_rows(*read_table(f, fmt or detect_format(path)))
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Export or import bot data as gzip CSV/JSONL")
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('files', nargs='*', help="Files to import")
+    parser.add_argument('--db', default='bot_database.db', help="Database file")
+    parser.add_argument('--shards', type=int, default=1, help="DATABASE_SHARDS of the database")
+    parser.add_argument('--out', default='export', help="Export directory")
+    parser.add_argument('--format', choices=FORMATS, help="Default: csv for export, from the file name for import")
+    parser.add_argument('--tables', help=f"Comma-separated tables to export (default: {','.join(EXPORT_TABLES)})")
+    parser.add_argument('--table', choices=list(IMPORT_TABLES), help="Table to import into (default: from the file name)")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.shards > 1:
+        from .sharding import ShardedDatabase
+        database = ShardedDatabase(args.db, args.shards)
+    else:
+        from .database import Database
+        database = Database(args.db)
+    if args.command == 'export':
+        tables = args.tables.split(',') if args.tables else None
+        unknown = set(tables or ()) - set(EXPORT_TABLES)
+        if unknown:
+            parser.error(f"unknown tables: {', '.join(sorted(unknown))}")
+        print(json.dumps(export_database(database, args.out, args.format or 'csv', tables), indent=2))
+    else:
+        if not args.files:
+            parser.error("import needs at least one file")
+        try:
+            print(json.dumps([import_file(database, path, args.table, args.format, args.batch_size)
+                              for path in args.files], indent=2))
+        except ValueError as e:
+            parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
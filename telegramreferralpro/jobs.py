@@ -0,0 +1,337 @@
+"""Background jobs persisted in SQLite
+
+Work that does not have to finish before a handler answers (welcome and
+referrer messages, maintenance such as recounting the stats row or advancing the
+event log snapshot) is stored as a row in the jobs table and run
+by JobQueue on the bot's event loop, at most `concurrency` jobs at a time.
+
+- Each kind of job has an async handler registered with register(); it
+  receives the job's JSON payload.
+- A failing job is retried with exponential backoff until max_attempts,
+  then kept as 'failed' for /admin_jobs (which can queue it again).
+- A recurring job is a single row that is rescheduled after every run.
+- A job with a key is not queued again while one with that key is pending.
+- Claimed jobs hold a lease; jobs left 'running' by a crashed process are
+  picked up again once it expires. Several processes can share the table,
+  as jobs are claimed in a write transaction and each process only claims
+  kinds it has handlers for.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_ATTEMPTS = 5
+POLL_INTERVAL = 1.0
+LEASE_SECONDS = 300.0
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 600.0
+STOP_GRACE_SECONDS = 5.0
+KEEP_FINISHED_SECONDS = 7 * 86400
+PURGE_INTERVAL = 3600.0
+STATS_VERIFY_INTERVAL = 3600.0
+SNAPSHOT_INTERVAL = 3600.0
+
+@dataclass
+class JobKind:
+    """How to run one kind of job"""
+    handler: Callable[[dict], Awaitable[None]]
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    # Also the lease: a job is never reclaimed while it may still be running
+    timeout: float = LEASE_SECONDS
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds before retry number `attempts`, doubling each time with jitter"""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+class JobQueue:
+    """Queue jobs in the database and run them with a bounded number of asyncio tasks"""
+
+    def __init__(self, database, concurrency: int = DEFAULT_CONCURRENCY, poll_interval: float = POLL_INTERVAL):
+        self.db = database
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.kinds: Dict[str, JobKind] = {}
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._active: Dict[int, asyncio.Task] = {}
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.register('purge_jobs', self._purge_job)
+        self.register('verify_stats', self._verify_stats_job)
+        self.register('event_snapshot', self._event_snapshot_job)
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[None]],
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, timeout: float = LEASE_SECONDS) -> None:
+        """Run jobs of this kind in this process"""
+        self.kinds[kind] = JobKind(handler, max_attempts, timeout)
+
+    def enqueue(self, kind: str, payload: dict = None, delay: float = 0.0, key: Optional[str] = None,
+                interval: Optional[float] = None) -> Optional[int]:
+        """Queue a job; returns its ID, or None if one with the same key is pending or on error"""
+        now = time.time()
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR IGNORE INTO jobs (kind, payload, job_key, run_at, interval_seconds, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (kind, json.dumps(payload or {}), key, now + delay, interval, now, now))
+                job_id = cursor.lastrowid if cursor.rowcount else None
+                conn.commit()
+        except Exception as e:
+            logger.error("Error queueing %s job: %s", kind, e)
+            return None
+        if job_id is not None and delay <= 0:
+            self._wakeup.set()
+        return job_id
+
+    def schedule_recurring(self, kind: str, interval: float, payload: dict = None,
+                           first_delay: Optional[float] = None) -> Optional[int]:
+        """Run a job every `interval` seconds; only one instance is ever pending"""
+        return self.enqueue(kind, payload, delay=interval if first_delay is None else first_delay,
+                            key=f"recurring:{kind}", interval=interval)
+
+    def _claim(self, limit: int) -> List[dict]:
+        """Mark up to `limit` due jobs (or expired leases) as running in this process"""
+        kinds = list(self.kinds)
+        now = time.time()
+        placeholders = ', '.join('?' * len(kinds))
+        due = f'''
+            kind IN ({placeholders}) AND ((status = ? AND run_at <= ?) OR (status = ? AND locked_until <= ?))
+        '''
+        parameters = (*kinds, STATUS_QUEUED, now, STATUS_RUNNING, now)
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                # An idle poll only reads, so it never takes the write lock from the handlers
+                cursor.execute(f'SELECT 1 FROM jobs WHERE {due} LIMIT 1', parameters)
+                if cursor.fetchone() is None:
+                    return []
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(f'''
+                    SELECT id, kind, payload, attempts, interval_seconds FROM jobs
+                    WHERE {due} ORDER BY run_at, id LIMIT ?
+                ''', (*parameters, limit))
+                jobs = [dict(row) for row in cursor.fetchall()]
+                for job in jobs:
+                    job['attempts'] += 1
+                    cursor.execute('''
+                        UPDATE jobs SET status = ?, attempts = ?, locked_until = ?, updated_at = ? WHERE id = ?
+                    ''', (STATUS_RUNNING, job['attempts'], now + self.kinds[job['kind']].timeout, now, job['id']))
+                conn.commit()
+                return jobs
+        except Exception as e:
+            logger.error("Error claiming jobs: %s", e)
+            return []
+
+    def _update(self, job_id: int, status: str, run_at: Optional[float] = None, attempts: Optional[int] = None,
+                error: Optional[str] = None) -> None:
+        now = time.time()
+        try:
+            with self.db.get_connection() as conn:
+                conn.execute('''
+                    UPDATE jobs SET status = ?, run_at = COALESCE(?, run_at), attempts = COALESCE(?, attempts),
+                        last_error = COALESCE(?, last_error), locked_until = NULL, updated_at = ?
+                    WHERE id = ?
+                ''', (status, run_at, attempts, error, now, job_id))
+                conn.commit()
+        except Exception as e:
+            logger.error("Error updating job %s: %s", job_id, e)
+
+    async def _run_job(self, job: dict) -> None:
+        kind = self.kinds[job['kind']]
+        try:
+            await asyncio.wait_for(kind.handler(json.loads(job['payload'] or '{}')), kind.timeout)
+        except asyncio.CancelledError:
+            # Stopped mid-run: queue it again without counting the attempt
+            self._update(job['id'], STATUS_QUEUED, attempts=job['attempts'] - 1)
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if job['attempts'] < kind.max_attempts:
+                delay = backoff_delay(job['attempts'])
+                logger.warning("Job %s (%s) failed on attempt %s, retrying in %.0fs: %s",
+                               job['id'], job['kind'], job['attempts'], delay, error)
+                self._update(job['id'], STATUS_QUEUED, run_at=time.time() + delay, error=error)
+                self.retried += 1
+            else:
+                logger.error("Job %s (%s) failed after %s attempts: %s",
+                             job['id'], job['kind'], job['attempts'], error)
+                if job['interval_seconds']:
+                    # A recurring job gives up on this run only
+                    self._update(job['id'], STATUS_QUEUED, run_at=time.time() + job['interval_seconds'],
+                                 attempts=0, error=error)
+                else:
+                    self._update(job['id'], STATUS_FAILED, error=error)
+                self.failed += 1
+            return
+        if job['interval_seconds']:
+            self._update(job['id'], STATUS_QUEUED, run_at=time.time() + job['interval_seconds'], attempts=0)
+        else:
+            self._update(job['id'], STATUS_DONE)
+        self.completed += 1
+
+    def _job_finished(self, job_id: int) -> None:
+        self._active.pop(job_id, None)
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            free = self.concurrency - len(self._active)
+            if free > 0:
+                for job in self._claim(free):
+                    task = asyncio.create_task(self._run_job(job))
+                    task.add_done_callback(lambda _, job_id=job['id']: self._job_finished(job_id))
+                    self._active[job['id']] = task
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self) -> None:
+        """Start running due jobs in the background"""
+        self.schedule_recurring('purge_jobs', PURGE_INTERVAL)
+        # First run right away: until verified once, /admin_stats counts the tables itself
+        self.schedule_recurring('verify_stats', STATS_VERIFY_INTERVAL, first_delay=0)
+        # Keeps `event_replay rebuild` down to the events of the last interval
+        self.schedule_recurring('event_snapshot', SNAPSHOT_INTERVAL)
+        self._runner = asyncio.create_task(self._run())
+        logger.info("Job queue started with %s workers", self.concurrency)
+
+    async def stop(self) -> None:
+        """Stop claiming jobs and give running ones a moment to finish"""
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        running = list(self._active.values())
+        if running:
+            done, pending = await asyncio.wait(running, timeout=STOP_GRACE_SECONDS)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _purge_job(self, payload: dict) -> None:
+        self.purge(payload.get('older_than', KEEP_FINISHED_SECONDS))
+
+    async def _verify_stats_job(self, payload: dict) -> None:
+        # Counting every row takes a while on large tables, so it runs off the event loop
+        if await asyncio.to_thread(self.db.verify_stats) is None:
+            raise RuntimeError("stats verification failed")
+
+    async def _event_snapshot_job(self, payload: dict) -> None:
+        from .event_replay import EventReplayer
+        # Each shard logs and replays its own users' events
+        for shard in self.db.shards:
+            applied = await asyncio.to_thread(EventReplayer(shard).advance)
+            if applied:
+                logger.info("Folded %s events into the snapshot of %s", applied, shard.db_path)
+
+    def purge(self, older_than: float = KEEP_FINISHED_SECONDS) -> int:
+        """Delete finished jobs last updated more than `older_than` seconds ago"""
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM jobs WHERE status = ? AND updated_at < ?',
+                               (STATUS_DONE, time.time() - older_than))
+                conn.commit()
+                return cursor.rowcount
+        except Exception as e:
+            logger.error("Error purging jobs: %s", e)
+            return 0
+
+    def retry_failed(self) -> int:
+        """Queue every failed job again with a fresh set of attempts"""
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                # OR IGNORE: a job whose key is pending again stays failed
+                cursor.execute('UPDATE OR IGNORE jobs SET status = ?, attempts = 0, run_at = ? WHERE status = ?',
+                               (STATUS_QUEUED, time.time(), STATUS_FAILED))
+                conn.commit()
+                count = cursor.rowcount
+        except Exception as e:
+            logger.error("Error retrying failed jobs: %s", e)
+            return 0
+        self._wakeup.set()
+        return count
+
+    def stats(self) -> dict:
+        """Queue depth per kind and status, and how late the oldest due job is"""
+        now = time.time()
+        try:
+            with self.db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind')
+                by_kind: Dict[str, Dict[str, int]] = {}
+                for kind, status, count in cursor.fetchall():
+                    by_kind.setdefault(kind, {})[status] = count
+                cursor.execute('SELECT COUNT(*), MIN(run_at) FROM jobs WHERE status = ? AND run_at <= ?',
+                               (STATUS_QUEUED, now))
+                due, oldest_due = cursor.fetchone()
+                cursor.execute('''
+                    SELECT id, kind, attempts, last_error FROM jobs WHERE status = ?
+                    ORDER BY updated_at DESC LIMIT 5
+                ''', (STATUS_FAILED,))
+                recent_failures = [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error("Error getting job stats: %s", e)
+            return {}
+        return {
+            'by_kind': by_kind,
+            'due': due,
+            'oldest_due_seconds': round(now - oldest_due, 1) if oldest_due is not None else 0.0,
+            'running_here': len(self._active),
+            'recent_failures': recent_failures,
+        }
+
+    def format_report(self) -> str:
+        """Plain-text summary for /admin_jobs"""
+        stats = self.stats()
+        if not stats:
+            return "Job statistics are unavailable."
+        lines = [f"Jobs due: {stats['due']} (oldest waiting {stats['oldest_due_seconds']:.0f}s), "
+                 f"running here: {stats['running_here']}"]
+        for kind, counts in stats['by_kind'].items():
+            lines.append(f"{kind}: " + ', '.join(f"{status} {count}" for status, count in sorted(counts.items())))
+        if stats['recent_failures']:
+            lines.append("Recent failures:")
+            for job in stats['recent_failures']:
+                lines.append(f"#{job['id']} {job['kind']} after {job['attempts']} attempts: {job['last_error']}")
+        return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the background job queue")
+    parser.add_argument('command', choices=['status', 'retry', 'purge'])
+    parser.add_argument('--db', default='bot_database.db', help="Database file")
+    args = parser.parse_args(argv)
+
+    from .database import Database
+    queue = JobQueue(Database(args.db))
+    if args.command == 'status':
+        result = queue.stats()
+    elif args.command == 'retry':
+        result = {'requeued': queue.retry_failed()}
+    else:
+        result = {'purged': queue.purge()}
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
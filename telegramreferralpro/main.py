@@ -1,69 +1,231 @@
 import asyncio
 import logging
-import signal
+import os
 import sys
-from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from telegram.error import TelegramError
+from typing import Optional
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from telegram.request import BaseRequest
 
-from .config import load_config
+from .config import BotConfig, load_config, load_tenant_configs
 from .database import Database
+from .dedup import UpdateDeduplicator
+from .jobs import JobQueue
+from .migrations import MigrationRunner
 from .referral_system import ReferralSystem
 from .bot_handlers import BotHandlers
-from .utils import TelegramUtils, setup_logging
+from .throttling import UserThrottle
+from .utils import TelegramUtils, setup_logging, bind_correlation_id
+from .webhook import ALLOWED_UPDATES
 
-# Setup logging
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# How often a process that leaves backfills to another one re-reads which are still running
+BACKFILL_POLL_SECONDS = 30
+
+def open_database(config: BotConfig, profiler=None, migrate: bool = True):
+    """Single-file Database, or a ShardedDatabase when DATABASE_SHARDS > 1"""
+    if config.database_shards > 1:
+        from .sharding import ShardedDatabase
+        return ShardedDatabase(config.database_path, config.database_shards, profiler=profiler, migrate=migrate)
+    return Database(config.database_path, profiler=profiler, migrate=migrate)
+
+def load_pending_backfills(database) -> bool:
+    """Read which backfills another process is still running; False once none are"""
+    for shard in database.shards:
+        shard.pending_backfills = set(MigrationRunner(shard).pending_backfills())
+    return bool(database.pending_backfills)
+
+def build_application(config: BotConfig, request: Optional[BaseRequest] = None,
+                      get_updates_request: Optional[BaseRequest] = None,
+                      throttle: Optional[UserThrottle] = None, deduplicate: bool = True,
+                      migrate: bool = True, run_jobs: bool = True) -> Application:
+    """Create the database, handlers and Application for a configuration
+
+    request/get_updates_request replace the HTTP layer, e.g. with the fake
+    Bot API used by the load generator in benchmarks/. request, get_updates_request
+    and throttle can also be shared between bots hosted in one process.
+    deduplicate=False leaves dropping redelivered updates to the caller.
+    migrate=False expects another process to have migrated the schema and to run
+    the backfills; run_jobs=False only queues jobs for another process to run.
+    """
+    # Initialize database
+    profiler = None
+    if config.query_profiling:
+        from .profiling import QueryProfiler
+        profiler = QueryProfiler(config.slow_query_ms)
+    database = open_database(config, profiler=profiler, migrate=migrate)
+    if not migrate:
+        load_pending_backfills(database)
+    logger.info("Database initialized")
+    
+    # Metrics are only collected (and their module only imported) when an endpoint is configured
+    metrics = None
+    if config.metrics_port:
+        from .metrics import (MetricsRegistry, MetricsServer, InstrumentedRequest, instrument_database,
+                              instrument_handlers)
+        metrics = MetricsRegistry()
+        instrument_database(database, metrics)
+    
+    # Initialize referral system
+    referral_system = ReferralSystem(database)
+    logger.info("Referral system initialized")
+    
+    # Create bot application; each feature adds its own startup/stop hooks
+    builder = Application.builder().token(config.bot_token)
+    startup_hooks, stop_hooks = [], []
+    if metrics:
+        metrics_server = MetricsServer(metrics, config.metrics_port)
+        startup_hooks.append(metrics_server.start)
+        stop_hooks.append(metrics_server.stop)
+        if request is None:
+            request = InstrumentedRequest(metrics, connection_pool_size=256)
+    
+    # Backfills that did not finish during Database startup continue between updates
+    if database.pending_backfills and not migrate:
+        # Another process runs them; keep falling back to live reads until it is done
+        poll_tasks = []
+        
+        async def poll_backfills():
+            while load_pending_backfills(database):
+                await asyncio.sleep(BACKFILL_POLL_SECONDS)
+        
+        async def start_backfill_poll():
+            poll_tasks.append(asyncio.create_task(poll_backfills()))
+        
+        async def stop_backfill_poll():
+            for task in poll_tasks:
+                task.cancel()
+        
+        startup_hooks.append(start_backfill_poll)
+        stop_hooks.append(stop_backfill_poll)
+    elif database.pending_backfills:
+        runners = [MigrationRunner(shard, chunk_seconds=config.backfill_chunk_ms / 1000)
+                   for shard in database.shards if shard.pending_backfills]
+        backfill_tasks = []
+        
+        async def start_backfills():
+            for runner in runners:
+                backfill_tasks.append(asyncio.create_task(runner.run_backfills_async()))
+        
+        async def stop_backfills():
+            for task in backfill_tasks:
+                task.cancel()
+        
+        startup_hooks.append(start_backfills)
+        stop_hooks.append(stop_backfills)
+    
+    # Processed update_ids are remembered across restarts so redeliveries are dropped
+    deduplicator = None
+    if deduplicate:
+        deduplicator = UpdateDeduplicator(database)
+        dedup_tasks = []
+        
+        async def start_dedup():
+            if not config.webhook_url:
+                await deduplicator.confirm_polling_offset(application.bot)
+            dedup_tasks.append(asyncio.create_task(deduplicator.run()))
+        
+        async def stop_dedup():
+            for task in dedup_tasks:
+                task.cancel()
+            deduplicator.save()
+        
+        startup_hooks.append(start_dedup)
+        stop_hooks.append(stop_dedup)
+    
+    # Background jobs (notifications, maintenance) run between updates; JOB_CONCURRENCY=0 runs them inline
+    jobs = None
+    if config.job_concurrency > 0:
+        jobs = JobQueue(database, concurrency=config.job_concurrency)
+        if run_jobs:
+            startup_hooks.append(jobs.start)
+            stop_hooks.append(jobs.stop)
+    
+    async def post_init(application):
+        for hook in startup_hooks:
+            await hook()
+    
+    async def post_stop(application):
+        for hook in stop_hooks:
+            await hook()
+    
+    builder = builder.post_init(post_init).post_stop(post_stop)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    application = builder.build()
+    
+    # Initialize telegram utils
+    telegram_utils = TelegramUtils(application.bot, config.channel_id, config.channel_username)
+    
+    # Initialize bot handlers
+    bot_handlers = BotHandlers(config, database, referral_system, telegram_utils, throttle=throttle, jobs=jobs)
+    
+    # Tag log records with the update being handled before anything else runs
+    application.add_handler(TypeHandler(Update, bind_correlation_id), group=-3)
+    
+    # Updates that were already processed stop here
+    if deduplicator:
+        application.add_handler(TypeHandler(Update, deduplicator.handle_update), group=-2)
+    
+    # Rate limiting runs in an earlier group and stops throttled updates before any handler
+    application.add_handler(bot_handlers.get_throttle_handler(), group=-1)
+    
+    # Add handlers to application
+    handlers = bot_handlers.get_handlers()
+    if metrics:
+        bot_handlers.register_metrics(metrics)
+        instrument_handlers(handlers, metrics)
+    for handler in handlers:
+        application.add_handler(handler)
+    
+    logger.info("Bot handlers registered")
+    return application
+
 def main():
     """Main function to run the bot"""
+    # Setup logging
+    setup_logging()
     try:
+        tenants_file = os.getenv("TENANTS_FILE")
+        if tenants_file:
+            # Several bots in this process (see multitenant.py)
+            from .multitenant import run_tenants
+            configs = load_tenant_configs(tenants_file)
+            logger.info("Starting %s tenants from %s", len(configs), tenants_file)
+            run_tenants(configs)
+            return
+        
         # Load configuration
         config = load_config()
         logger.info("Configuration loaded successfully")
         
-        # Initialize database
-        database = Database(config.database_path)
-        logger.info("Database initialized")
-        
-        # Initialize referral system
-        referral_system = ReferralSystem(database)
-        logger.info("Referral system initialized")
-        
-        # Create bot application
-        application = Application.builder().token(config.bot_token).build()
-        
-        # Initialize telegram utils
-        telegram_utils = TelegramUtils(application.bot, config.channel_id, config.channel_username)
-        
-        # Initialize bot handlers
-        bot_handlers = BotHandlers(config, database, referral_system, telegram_utils)
-        
-        # Add handlers to application
-        for handler in bot_handlers.get_handlers():
-            application.add_handler(handler)
+        if config.webhook_url and config.workers > 1:
+            # Webhook front process routing updates to worker processes by user
+            from .workers import run_workers
+            logger.info("Starting bot with %s workers on port %s", config.workers, config.port)
+            run_workers(config)
+            return
         
-        logger.info("Bot handlers registered")
+        application = build_application(config)
         
         # Start the bot
         if config.webhook_url:
-            # Webhook mode
-            logger.info(f"Starting bot in webhook mode on port {config.port}")
-            application.run_webhook(
-                listen="0.0.0.0",
-                port=config.port,
-                webhook_url=config.webhook_url,
-                url_path=config.bot_token
-            )
+            # Webhook mode: acknowledge at once, process from bounded per-user lanes
+            from .webhook import serve_webhook
+            logger.info("Starting bot in webhook mode on port %s", config.port)
+            asyncio.run(serve_webhook(application, config))
         else:
             # Polling mode
             logger.info("Starting bot in polling mode")
-            application.run_polling(allowed_updates=["message", "chat_member"])
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
     
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
+        logger.error("Failed to start bot: %s", e)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,299 @@
+"""Prometheus-style metrics: handler, database and Bot API latency plus cache hit ratios
+
+Metrics are only collected when METRICS_PORT is set. Recording a sample is a
+bisect over the bucket bounds and a few integer additions; cumulative bucket
+counts and ratios are computed when the endpoint is scraped.
+"""
+
+import asyncio
+import functools
+import logging
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Seconds; SQLite calls sit at the low end, Bot API round trips at the high end
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Database methods that are not worth timing on their own
+UNTIMED_DATABASE_METHODS = {'get_connection', 'init_database', 'for_user'}
+
+def _format_labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    """Render a Prometheus label set"""
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    """Render a sample value the way Prometheus expects"""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, label_values: tuple = (), amount: float = 1) -> None:
+        """Add to the counter for one label set"""
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, label_values: tuple = ()) -> float:
+        """Current value for one label set"""
+        return self._values.get(label_values, 0)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class Histogram:
+    """Latency histogram with fixed buckets and labels"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), count, sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, label_values: tuple, seconds: float) -> None:
+        """Record one sample"""
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+        series[0][bisect_left(self.buckets, seconds)] += 1
+        series[1] += 1
+        series[2] += seconds
+
+    def count(self, label_values: tuple = ()) -> int:
+        """Number of samples recorded for one label set"""
+        series = self._series.get(label_values)
+        return series[1] if series else 0
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total, seconds) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(seconds)}"
+            yield f"{self.name}_count{labels} {total}"
+
+class CallbackGauge:
+    """Gauge whose values are read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...],
+                 callback: Callable[[], Dict[tuple, float]]):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+
+    def render(self) -> Iterable[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error("Error collecting metric %s: %s", self.name, e)
+            return
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class MetricsRegistry:
+    """All metrics exported by the bot"""
+
+    def __init__(self):
+        self._metrics = []
+        self.handler_latency = self.add(Histogram(
+            'bot_handler_duration_seconds', 'Time spent in each update handler', ('handler',)))
+        self.handler_errors = self.add(Counter(
+            'bot_handler_errors_total', 'Exceptions raised by update handlers', ('handler',)))
+        self.db_latency = self.add(Histogram(
+            'bot_db_method_duration_seconds', 'Time spent in each Database method', ('method',)))
+        self.api_latency = self.add(Histogram(
+            'bot_api_request_duration_seconds', 'Bot API round trip time per method', ('method',)))
+        self.api_errors = self.add(Counter(
+            'bot_api_errors_total', 'Bot API calls that raised an error', ('method',)))
+        self.api_retry_after = self.add(Counter(
+            'bot_api_retry_after_total', 'Bot API calls rejected with RetryAfter (flood control)', ('method',)))
+        self.api_retry_after_seconds = self.add(Counter(
+            'bot_api_retry_after_seconds_total', 'Seconds of back-off requested by RetryAfter', ('method',)))
+        self._caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+        self.add(CallbackGauge('bot_cache_hits', 'Cache hits since start', ('cache',),
+                               lambda: self._cache_values(0)))
+        self.add(CallbackGauge('bot_cache_misses', 'Cache misses since start', ('cache',),
+                               lambda: self._cache_values(1)))
+        self.add(CallbackGauge('bot_cache_hit_ratio', 'Cache hits / lookups since start', ('cache',),
+                               self._cache_ratios))
+
+    def add(self, metric):
+        """Register a metric for export"""
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name: str, stats: Callable[[], Tuple[int, int]]) -> None:
+        """Export a cache given a callable returning (hits, misses)"""
+        self._caches[name] = stats
+
+    def _cache_values(self, index: int) -> Dict[tuple, float]:
+        return {(name,): stats()[index] for name, stats in self._caches.items()}
+
+    def _cache_ratios(self) -> Dict[tuple, float]:
+        ratios = {}
+        for name, stats in self._caches.items():
+            hits, misses = stats()
+            lookups = hits + misses
+            ratios[(name,)] = round(hits / lookups, 4) if lookups else 0.0
+        return ratios
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def instrument_handlers(handlers: list, registry: MetricsRegistry) -> list:
+    """Wrap each handler's callback so its latency and errors are recorded"""
+    for handler in handlers:
+        callback = handler.callback
+        handler.callback = _timed_handler(callback, callback.__name__, registry)
+    return handlers
+
+def _timed_handler(callback, name: str, registry: MetricsRegistry):
+    labels = (name,)
+    observe = registry.handler_latency.observe
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            registry.handler_errors.inc(labels)
+            raise
+        finally:
+            observe(labels, perf_counter() - started)
+    return wrapper
+
+def instrument_database(database, registry: MetricsRegistry):
+    """Time every public method of a Database instance"""
+    for name in dir(type(database)):
+        if name.startswith('_') or name in UNTIMED_DATABASE_METHODS:
+            continue
+        method = getattr(database, name)
+        if callable(method):
+            setattr(database, name, _timed_method(method, name, registry))
+    return database
+
+def _timed_method(method, name: str, registry: MetricsRegistry):
+    labels = (name,)
+    observe = registry.db_latency.observe
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            observe(labels, perf_counter() - started)
+    return wrapper
+
+def lru_cache_stats(cached_function) -> Callable[[], Tuple[int, int]]:
+    """(hits, misses) reader for a functools.lru_cache wrapped function"""
+    def stats():
+        info = cached_function.cache_info()
+        return info.hits, info.misses
+    return stats
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records per-method latency, errors and RetryAfter responses"""
+
+    def __init__(self, registry: MetricsRegistry, **kwargs):
+        super().__init__(**kwargs)
+        self.registry = registry
+
+    async def post(self, url: str, request_data=None, *args, **kwargs):
+        # url is <base>/bot<token>/<method>; only the method name is used as a label
+        labels = (url.rsplit('/', 1)[-1],)
+        started = perf_counter()
+        try:
+            return await super().post(url, request_data, *args, **kwargs)
+        except RetryAfter as e:
+            self.registry.api_retry_after.inc(labels)
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
+            self.registry.api_retry_after_seconds.inc(labels, seconds)
+            raise
+        except TelegramError:
+            self.registry.api_errors.inc(labels)
+            raise
+        finally:
+            self.registry.api_latency.observe(labels, perf_counter() - started)
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = '0.0.0.0'):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """Start listening on the configured port"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics endpoint listening on %s:%s/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; the request body is never used
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'Not Found\n', 'text/plain'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,573 @@
+"""Versioned schema migrations with online, chunked backfills
+
+Each migration runs once, in order, in its own write transaction and is
+recorded in schema_version. Migrations only make quick schema changes. Work
+that grows with the size of a table goes into a Backfill instead, which is
+processed in small key ranges, each committed on its own together with its
+position in schema_backfills, so a backfill resumes where it stopped after a
+restart. The chunk size adapts so every chunk holds the write lock for about
+chunk_seconds, and the bot keeps serving between chunks.
+
+At startup Database applies pending migrations and spends at most
+STARTUP_BACKFILL_SECONDS on backfills; the bot finishes the rest in the
+background (see main.build_application).
+
+Usage:
+    python -m telegramreferralpro.migrations status
+    python -m telegramreferralpro.migrations migrate
+    python -m telegramreferralpro.migrations backfill [--chunk-ms 50] [--pause-ms 50]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keys are compared with >, so the first chunk starts below any SQLite integer
+FIRST_POSITION = -(2 ** 63)
+INITIAL_CHUNK_SIZE = 100
+MIN_CHUNK_SIZE = 10
+MAX_CHUNK_SIZE = 200000
+DEFAULT_CHUNK_SECONDS = 0.05
+DEFAULT_PAUSE_SECONDS = 0.05
+STARTUP_BACKFILL_SECONDS = 1.0
+
+@dataclass(frozen=True)
+class Backfill:
+    """Statement applied to successive key ranges of a table
+
+    sql receives the range as :lo (exclusive) and :hi (inclusive) over the
+    values of key in table.
+    """
+    name: str
+    table: str
+    key: str
+    sql: str
+
+@dataclass(frozen=True)
+class Migration:
+    """A schema change and the backfills it schedules"""
+    version: int
+    name: str
+    apply: Callable
+    backfills: Tuple[Backfill, ...] = ()
+
+def _baseline_schema(cursor) -> None:
+    """Tables and indexes as they were created before schema versioning"""
+    # Users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            referral_code TEXT UNIQUE,
+            referred_by INTEGER,
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_channel_member BOOLEAN DEFAULT FALSE,
+            reward_claimed BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (referred_by) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Referrals table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referrer_id INTEGER,
+            referred_user_id INTEGER,
+            join_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (referrer_id) REFERENCES users (user_id),
+            FOREIGN KEY (referred_user_id) REFERENCES users (user_id),
+            UNIQUE(referrer_id, referred_user_id)
+        )
+    ''')
+
+    # Channel events table (append-only event log)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channel_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            event_type TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            payload TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    cursor.execute('PRAGMA table_info(channel_events)')
+    if 'payload' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE channel_events ADD COLUMN payload TEXT')
+
+    # Invite links table to track unique invite links
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invite_links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            referral_code TEXT,
+            invite_link TEXT UNIQUE,
+            invite_link_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Per-referrer counters so progress reads don't rescan referrals
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS referral_counters (
+            user_id INTEGER PRIMARY KEY,
+            active_referrals INTEGER DEFAULT 0,
+            total_referrals INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_referrals_referred_user ON referrals (referred_user_id)')
+
+    # User language preferences (LanguageManager)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_languages (
+            user_id INTEGER PRIMARY KEY,
+            language_code TEXT DEFAULT 'en',
+            detected_language TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Campaigns, per-user campaign counters and credited referrals (CampaignManager)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE,
+            title TEXT,
+            starts_at TIMESTAMP,
+            ends_at TIMESTAMP,
+            tiers TEXT,
+            is_enabled BOOLEAN DEFAULT TRUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_progress (
+            campaign_id INTEGER,
+            user_id INTEGER,
+            referrals INTEGER DEFAULT 0,
+            active_referrals INTEGER DEFAULT 0,
+            tier_reached INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (campaign_id, user_id),
+            FOREIGN KEY (campaign_id) REFERENCES campaigns (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_credits (
+            campaign_id INTEGER,
+            referrer_id INTEGER,
+            referred_user_id INTEGER,
+            credited_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            PRIMARY KEY (campaign_id, referred_user_id),
+            FOREIGN KEY (campaign_id) REFERENCES campaigns (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_campaign_credits_referred
+        ON campaign_credits (referred_user_id, is_active)
+    ''')
+
+def _invite_link_indexes(cursor) -> None:
+    """Index the invite link lookups done on every /start and channel join"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invite_links_user
+        ON invite_links (user_id, is_active, created_at)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invite_links_name ON invite_links (invite_link_name)')
+
+def _update_windows(cursor) -> None:
+    """Processed update_ids and the polling offset, saved by dedup.UpdateDeduplicator"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS update_windows (
+            name TEXT PRIMARY KEY,
+            base INTEGER NOT NULL,
+            bitmap BLOB NOT NULL,
+            polling_offset INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _membership_updated_at(cursor) -> None:
+    """Date of the last applied membership change, so late chat_member updates can be ignored"""
+    cursor.execute('PRAGMA table_info(users)')
+    if 'membership_updated_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE users ADD COLUMN membership_updated_at INTEGER')
+
+def _jobs(cursor) -> None:
+    """Background job queue (see jobs.py); times are Unix seconds"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT,
+            job_key TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at REAL NOT NULL,
+            interval_seconds REAL,
+            locked_until REAL,
+            last_error TEXT,
+            created_at REAL,
+            updated_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)')
+    # At most one pending job per key; finished ones do not count
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_key ON jobs (job_key)
+        WHERE status IN ('queued', 'running')
+    ''')
+
+def _stats(cursor) -> None:
+    """Admin totals kept current by the Database write methods (see Database.get_stats)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER NOT NULL DEFAULT 0,
+            channel_members INTEGER NOT NULL DEFAULT 0,
+            active_referrals INTEGER NOT NULL DEFAULT 0,
+            rewards_claimed INTEGER NOT NULL DEFAULT 0,
+            verified_at TIMESTAMP,
+            corrections INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Zero is only right for empty tables; otherwise the first verify_stats counts them
+    cursor.execute('''
+        INSERT OR IGNORE INTO stats (id, verified_at)
+        SELECT 1, CASE WHEN EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM referrals)
+                       THEN NULL ELSE CURRENT_TIMESTAMP END
+    ''')
+
+def _daily_stats(cursor) -> None:
+    """Per-day counts folded from channel_events by rollups.DailyRollup"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            joins INTEGER NOT NULL DEFAULT 0,
+            leaves INTEGER NOT NULL DEFAULT 0,
+            referrals INTEGER NOT NULL DEFAULT 0,
+            claims INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats_progress (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_event_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO daily_stats_progress (id) VALUES (1)')
+
+def _channel_joined_at(cursor) -> None:
+    """Date of a user's first processed channel join, which the welcome and referrer notice hang on"""
+    cursor.execute('PRAGMA table_info(users)')
+    if 'channel_joined_at' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE users ADD COLUMN channel_joined_at INTEGER')
+
+def _event_snapshots(cursor) -> None:
+    """Projection of the event log and its position, kept by event_replay.EventReplayer"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projection_users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            referral_code TEXT,
+            referred_by INTEGER,
+            join_date TIMESTAMP,
+            is_channel_member BOOLEAN DEFAULT FALSE,
+            reward_claimed BOOLEAN DEFAULT FALSE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS projection_referrals (
+            referrer_id INTEGER,
+            referred_user_id INTEGER,
+            join_date TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            PRIMARY KEY (referrer_id, referred_user_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS event_snapshots (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_event_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Recounts a range of referrers; safe to run alongside live writes, which recount the same way
+REFERRAL_COUNTERS_BACKFILL = Backfill(
+    name='referral_counters',
+    table='referrals',
+    key='referrer_id',
+    sql='''
+        INSERT OR REPLACE INTO referral_counters (user_id, active_referrals, total_referrals)
+        SELECT r.referrer_id,
+            SUM(r.is_active = TRUE AND COALESCE(u.is_channel_member, FALSE) = TRUE),
+            COUNT(*)
+        FROM referrals r LEFT JOIN users u ON r.referred_user_id = u.user_id
+        WHERE r.referrer_id > :lo AND r.referrer_id <= :hi
+        GROUP BY r.referrer_id
+    ''',
+)
+
+# Users who are members or had a membership change were already welcomed
+CHANNEL_JOINED_AT_BACKFILL = Backfill(
+    name='channel_joined_at',
+    table='users',
+    key='user_id',
+    sql='''
+        UPDATE users
+        SET channel_joined_at = COALESCE(membership_updated_at, CAST(strftime('%s', join_date) AS INTEGER))
+        WHERE user_id > :lo AND user_id <= :hi AND channel_joined_at IS NULL
+          AND (is_channel_member = TRUE OR membership_updated_at IS NOT NULL)
+    ''',
+)
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, 'baseline', _baseline_schema, (REFERRAL_COUNTERS_BACKFILL,)),
+    Migration(2, 'invite_link_indexes', _invite_link_indexes),
+    Migration(3, 'update_windows', _update_windows),
+    Migration(4, 'membership_updated_at', _membership_updated_at),
+    Migration(5, 'jobs', _jobs),
+    Migration(6, 'stats', _stats),
+    Migration(7, 'daily_stats', _daily_stats),
+    Migration(8, 'channel_joined_at', _channel_joined_at, (CHANNEL_JOINED_AT_BACKFILL,)),
+    Migration(9, 'event_snapshots', _event_snapshots),
+]
+
+class MigrationRunner:
+    """Apply pending migrations and process their backfills in bounded chunks"""
+
+    def __init__(self, database, migrations: List[Migration] = None,
+                 chunk_seconds: float = DEFAULT_CHUNK_SECONDS):
+        self.db = database
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS,
+                                 key=lambda migration: migration.version)
+        self.chunk_seconds = chunk_seconds
+        self.backfills: Dict[str, Backfill] = {
+            backfill.name: backfill for migration in self.migrations for backfill in migration.backfills
+        }
+        self._chunk_sizes: Dict[str, int] = {}
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def _init_version_tables(self, cursor) -> None:
+        """Create the bookkeeping tables"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_backfills (
+                name TEXT PRIMARY KEY,
+                position INTEGER,
+                chunks INTEGER DEFAULT 0,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        ''')
+
+    @staticmethod
+    def _read_version(cursor) -> int:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if not cursor.fetchone():
+            return 0
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return cursor.fetchone()[0]
+
+    def current_version(self) -> int:
+        """Highest applied migration, 0 for a database that predates versioning"""
+        with self.db.get_connection() as conn:
+            return self._read_version(conn.cursor())
+
+    def migrate(self) -> List[int]:
+        """Apply pending migrations in order; returns the versions applied"""
+        if self.current_version() >= self.latest_version:
+            self._load_pending_backfills()
+            return []
+
+        applied = []
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            for migration in self.migrations:
+                # Another process may be migrating too; the version is re-read under the write lock
+                cursor.execute('BEGIN IMMEDIATE')
+                self._init_version_tables(cursor)
+                if migration.version <= self._read_version(cursor):
+                    conn.rollback()
+                    continue
+                started = time.perf_counter()
+                migration.apply(cursor)
+                cursor.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)',
+                               (migration.version, migration.name))
+                for backfill in migration.backfills:
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO schema_backfills (name, position) VALUES (?, ?)
+                    ''', (backfill.name, FIRST_POSITION))
+                conn.commit()
+                applied.append(migration.version)
+                logger.info("Applied migration %s (%s) in %.1f ms", migration.version, migration.name,
+                            (time.perf_counter() - started) * 1000)
+        self._load_pending_backfills()
+        return applied
+
+    def _load_pending_backfills(self) -> None:
+        """Tell the Database which backfills are still running (reads fall back while they do)"""
+        self.db.pending_backfills = set(self.pending_backfills())
+
+    def pending_backfills(self) -> List[str]:
+        """Names of unfinished backfills in the order they will run"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            if self._read_version(cursor) == 0:
+                return []
+            cursor.execute('SELECT name FROM schema_backfills WHERE completed_at IS NULL ORDER BY rowid')
+            return [row[0] for row in cursor.fetchall()]
+
+    def run_backfill_chunk(self) -> bool:
+        """Process one chunk of the first unfinished backfill; False when none is left"""
+        started = time.perf_counter()
+        # Backfills left behind by a newer version of the bot are skipped; that version will finish them
+        known = list(self.backfills)
+        if not known:
+            return False
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT name, position FROM schema_backfills
+                WHERE completed_at IS NULL AND name IN ({', '.join('?' * len(known))})
+                ORDER BY rowid LIMIT 1
+            ''', known)
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                self.db.pending_backfills = set()
+                return False
+            name, position = row
+            backfill = self.backfills[name]
+
+            size = self._chunk_sizes.get(name, INITIAL_CHUNK_SIZE)
+            cursor.execute(f'''
+                SELECT MAX(k) FROM (
+                    SELECT DISTINCT {backfill.key} AS k FROM {backfill.table}
+                    WHERE {backfill.key} > ? ORDER BY {backfill.key} LIMIT ?
+                )
+            ''', (position, size))
+            upper = cursor.fetchone()[0]
+            if upper is None:
+                cursor.execute('''
+                    UPDATE schema_backfills SET completed_at = CURRENT_TIMESTAMP WHERE name = ?
+                ''', (name,))
+                conn.commit()
+                self.db.pending_backfills.discard(name)
+                logger.info("Backfill %s completed", name)
+                return True
+
+            cursor.execute(backfill.sql, {'lo': position, 'hi': upper})
+            cursor.execute('''
+                UPDATE schema_backfills SET position = ?, chunks = chunks + 1 WHERE name = ?
+            ''', (upper, name))
+            conn.commit()
+
+        # Aim the next chunk at chunk_seconds, changing the size by at most 2x per step
+        elapsed = max(time.perf_counter() - started, 1e-4)
+        factor = min(2.0, max(0.5, self.chunk_seconds / elapsed))
+        self._chunk_sizes[name] = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, int(size * factor)))
+        return True
+
+    def run_backfills(self, time_budget: Optional[float] = None, pause: float = 0.0) -> int:
+        """Run backfill chunks until done or time_budget seconds have passed; returns chunks run"""
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
+        chunks = 0
+        while deadline is None or time.monotonic() < deadline:
+            if not self.run_backfill_chunk():
+                break
+            chunks += 1
+            if pause:
+                time.sleep(pause)
+        return chunks
+
+    async def run_backfills_async(self, pause: float = DEFAULT_PAUSE_SECONDS) -> None:
+        """Run the remaining backfills between updates until they are done"""
+        chunks = 0
+        try:
+            while self.run_backfill_chunk():
+                chunks += 1
+                await asyncio.sleep(pause)
+        except asyncio.CancelledError:
+            logger.info("Backfills paused after %s chunks; they resume on the next start", chunks)
+            raise
+        except Exception as e:
+            logger.error("Backfill failed after %s chunks: %s", chunks, e)
+
+    def status(self) -> dict:
+        """Schema version and backfill progress"""
+        with self.db.get_connection() as conn:
+            cursor = conn.cursor()
+            version = self._read_version(cursor)
+            backfills = []
+            if version:
+                cursor.execute('''
+                    SELECT name, position, chunks, started_at, completed_at FROM schema_backfills ORDER BY rowid
+                ''')
+                for row in cursor.fetchall():
+                    backfill = dict(row)
+                    if backfill['position'] == FIRST_POSITION:
+                        backfill['position'] = None
+                    backfills.append(backfill)
+        return {
+            'version': version,
+            'latest_version': self.latest_version,
+            'pending_migrations': [f"{m.version}_{m.name}" for m in self.migrations if m.version > version],
+            'backfills': backfills,
+        }
+
+def main(argv=None):
+    """Command line entry point"""
+    from .database import Database
+
+    parser = argparse.ArgumentParser(description="Apply schema migrations and run backfills")
+    parser.add_argument('command', choices=['status', 'migrate', 'backfill'])
+    parser.add_argument('--db', default='bot_database.db', help="Path to the SQLite database")
+    parser.add_argument('--chunk-ms', type=float, default=DEFAULT_CHUNK_SECONDS * 1000,
+                        help="Target time each backfill chunk holds the write lock")
+    parser.add_argument('--pause-ms', type=float, default=DEFAULT_PAUSE_SECONDS * 1000,
+                        help="Pause between chunks so a running bot can write")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    runner = MigrationRunner(Database(args.db, migrate=False), chunk_seconds=args.chunk_ms / 1000)
+
+    if args.command == 'migrate':
+        print(json.dumps({'applied': runner.migrate(), 'version': runner.current_version()}))
+    elif args.command == 'backfill':
+        runner.migrate()
+        started = time.perf_counter()
+        chunks = runner.run_backfills(pause=args.pause_ms / 1000)
+        print(json.dumps({'chunks': chunks, 'seconds': round(time.perf_counter() - started, 3)}))
+    else:
+        print(json.dumps(runner.status(), indent=2))
+
+if __name__ == "__main__":
+    main()
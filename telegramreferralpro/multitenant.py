@@ -0,0 +1,133 @@
+"""Host many bots, each with its own channel and database, in one process
+
+Every tenant gets its own Application, BotHandlers and SQLite database, so
+data stays isolated. They share what is not per bot:
+
+- one HTTP connection pool for Bot API calls and one for long polling
+  (the bot token is part of each request URL, so one pool serves all bots)
+- the per-user rate limiter, so a user is limited across all bots together
+  (it uses the first tenant's THROTTLE_RATE/THROTTLE_BURST)
+- translation catalogs and rendered message caches, which are per process
+
+Enabled by pointing TENANTS_FILE at a JSON list of BotConfig settings:
+
+    [
+      {"bot_token": "...", "channel_id": "-100...", "channel_username": "first_channel",
+       "admin_user_ids": [123], "database_path": "first.db"},
+      {"bot_token": "...", "channel_id": "-100...", "channel_username": "second_channel"}
+    ]
+
+Tenants are run in polling mode. Per-tenant METRICS_PORT is not supported,
+since all tenants would bind the same port.
+"""
+
+import asyncio
+import logging
+from typing import List, Optional
+
+from telegram.ext import Application
+from telegram.request import BaseRequest, HTTPXRequest
+
+from .config import BotConfig
+from .throttling import UserThrottle
+from .webhook import ALLOWED_UPDATES
+
+logger = logging.getLogger(__name__)
+
+API_POOL_SIZE = 256
+
+class SharedRequest(BaseRequest):
+    """BaseRequest handed to several Bots, closed when the last of them shuts down"""
+
+    def __init__(self, request: BaseRequest):
+        self._request = request
+        self._users = 0
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        if self._users == 0:
+            await self._request.initialize()
+        self._users += 1
+
+    async def shutdown(self) -> None:
+        self._users -= 1
+        if self._users == 0:
+            await self._request.shutdown()
+
+    async def do_request(self, *args, **kwargs):
+        return await self._request.do_request(*args, **kwargs)
+
+class TenantHost:
+    """Build, start and stop one Application per tenant in a single event loop"""
+
+    def __init__(self, configs: List[BotConfig], request: Optional[BaseRequest] = None,
+                 get_updates_request: Optional[BaseRequest] = None):
+        from .main import build_application
+
+        if not configs:
+            raise ValueError("At least one tenant is required")
+        self.configs = configs
+        self.request = SharedRequest(request or HTTPXRequest(connection_pool_size=API_POOL_SIZE))
+        # Every tenant keeps one getUpdates call open, each holding a connection
+        self.get_updates_request = SharedRequest(
+            get_updates_request or HTTPXRequest(connection_pool_size=len(configs)))
+        self.throttle = UserThrottle(rate=configs[0].throttle_rate, burst=configs[0].throttle_burst)
+        self.applications: List[Application] = [
+            build_application(config, request=self.request, get_updates_request=self.get_updates_request,
+                              throttle=self.throttle)
+            for config in configs
+        ]
+        self._running: List[Application] = []
+
+    async def start(self, polling: bool = True) -> None:
+        """Initialize and start every tenant; a tenant that fails to start is skipped"""
+        for config, application in zip(self.configs, self.applications):
+            try:
+                await application.initialize()
+                if application.post_init:
+                    await application.post_init(application)
+                if polling:
+                    await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+                await application.start()
+                self._running.append(application)
+                logger.info("Tenant %s started", config.channel_username)
+            except Exception as e:
+                logger.error("Tenant %s failed to start: %s", config.channel_username, e)
+                if application.running:
+                    await application.stop()
+                await application.shutdown()
+        logger.info("%s of %s tenants running", len(self._running), len(self.applications))
+
+    async def stop(self) -> None:
+        """Stop every running tenant"""
+        for application in self._running:
+            try:
+                if application.updater and application.updater.running:
+                    await application.updater.stop()
+                if application.running:
+                    await application.stop()
+                if application.post_stop:
+                    await application.post_stop(application)
+                await application.shutdown()
+            except Exception as e:
+                logger.error("Error stopping tenant: %s", e)
+        self._running = []
+
+    async def run(self) -> None:
+        """Run until cancelled (Ctrl+C)"""
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+def run_tenants(configs: List[BotConfig]) -> None:
+    """Run all tenants in this process until interrupted"""
+    host = TenantHost(configs)
+    try:
+        asyncio.run(host.run())
+    except KeyboardInterrupt:
+        logger.info("Tenants stopped by user")
@@ -0,0 +1,216 @@
+"""Opt-in per-statement SQLite profiling
+
+Database connections are created with ProfilingConnection when a QueryProfiler
+is configured. Every statement executed through them is timed from execute()
+until its last row is fetched and aggregated under its normalized SQL. Other
+database drivers (e.g. an async one) can feed the same profiler via record().
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from time import perf_counter
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100.0
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and replace literals so equivalent statements aggregate together"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+class QueryStats:
+    """Aggregated timings for one normalized statement"""
+    __slots__ = ('sql', 'calls', 'total_seconds', 'max_seconds', 'rows')
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.calls if self.calls else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'sql': self.sql,
+            'calls': self.calls,
+            'total_ms': round(self.total_seconds * 1000, 3),
+            'mean_ms': round(self.mean_seconds * 1000, 3),
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'rows': self.rows,
+        }
+
+class QueryProfiler:
+    """Collect call count, total/max duration and rows returned per statement"""
+
+    SORT_KEYS = ('total', 'max', 'calls', 'rows', 'mean')
+
+    def __init__(self, slow_query_ms: float = DEFAULT_SLOW_QUERY_MS):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self._stats: Dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, seconds: float, rows: int = 0) -> None:
+        """Add one statement execution"""
+        normalized = normalize_sql(sql)
+        with self._lock:
+            stats = self._stats.get(normalized)
+            if stats is None:
+                stats = self._stats[normalized] = QueryStats(normalized)
+            stats.calls += 1
+            stats.total_seconds += seconds
+            stats.rows += rows
+            if seconds > stats.max_seconds:
+                stats.max_seconds = seconds
+        if seconds >= self.slow_query_seconds:
+            logger.warning("Slow query (%.1f ms, %s rows): %s", seconds * 1000, rows, normalized)
+
+    def report(self, sort_by: str = 'total', limit: Optional[int] = None) -> List[dict]:
+        """Statement stats, most expensive first"""
+        if sort_by not in self.SORT_KEYS:
+            raise ValueError(f"sort_by must be one of {', '.join(self.SORT_KEYS)}")
+        attribute = {'total': 'total_seconds', 'max': 'max_seconds', 'mean': 'mean_seconds'}.get(sort_by, sort_by)
+        with self._lock:
+            stats = sorted(self._stats.values(), key=lambda s: getattr(s, attribute), reverse=True)
+            return [s.as_dict() for s in stats[:limit]]
+
+    def format_report(self, sort_by: str = 'total', limit: int = 10, sql_width: int = 80) -> str:
+        """Plain-text report for logs and admin commands"""
+        rows = self.report(sort_by, limit)
+        if not rows:
+            return "No queries recorded yet."
+        lines = [f"Top {len(rows)} queries by {sort_by}:"]
+        for index, row in enumerate(rows, 1):
+            sql = row['sql'] if len(row['sql']) <= sql_width else row['sql'][:sql_width - 1] + '…'
+            lines.append(
+                f"{index}. {row['calls']}x total={row['total_ms']}ms mean={row['mean_ms']}ms "
+                f"max={row['max_ms']}ms rows={row['rows']}\n   {sql}"
+            )
+        return '\n'.join(lines)
+
+    def reset(self) -> None:
+        """Forget everything recorded so far"""
+        with self._lock:
+            self._stats.clear()
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement to the connection's profiler once its rows are consumed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sql = None
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self) -> None:
+        if self._sql is not None:
+            self.connection.profiler.record(self._sql, self._elapsed, self._rows)
+            self._sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            self._elapsed = perf_counter() - started
+            self._rows = 0
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = sql
+            self._elapsed = perf_counter() - started
+            self._rows = 0
+
+    def fetchone(self):
+        started = perf_counter()
+        row = super().fetchone()
+        self._elapsed += perf_counter() - started
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += perf_counter() - started
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        started = perf_counter()
+        rows = super().fetchall()
+        self._elapsed += perf_counter() - started
+        self._rows += len(rows)
+        return rows
+
+    def __next__(self):
+        started = perf_counter()
+        try:
+            row = super().__next__()
+        finally:
+            self._elapsed += perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection whose cursors are ProfilingCursors; set .profiler after connecting"""
+
+    profiler: QueryProfiler
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors: List[ProfilingCursor] = []
+
+    def cursor(self, factory=ProfilingCursor):
+        cursor = super().cursor(factory)
+        if isinstance(cursor, ProfilingCursor):
+            self._cursors.append(cursor)
+        return cursor
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        # The journal sync usually costs more than the statements themselves
+        started = perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.profiler.record('COMMIT', perf_counter() - started)
+
+    def flush_profile(self) -> None:
+        """Record statements whose rows were never fully fetched (called before closing)"""
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors.clear()
+
+    def close(self):
+        self.flush_profile()
+        super().close()
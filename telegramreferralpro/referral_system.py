@@ -1,6 +1,7 @@
 import hashlib
 import secrets
 import logging
+import time
 from typing import Optional, Tuple, List
 from .database import Database
 
@@ -27,7 +28,7 @@ class ReferralSystem:
             )
             return invite_link
         except Exception as e:
-            logger.error(f"Error creating referral invite link for user {user_id}: {e}")
+            logger.error("Error creating referral invite link for user %s: %s", user_id, e)
             # Fallback to regular channel link
             return telegram_utils.get_channel_link()
     
@@ -63,7 +64,7 @@ class ReferralSystem:
                 return False, "Failed to process referral"
                 
         except Exception as e:
-            logger.error(f"Error processing referral: {e}")
+            logger.error("Error processing referral: %s", e)
             return False, "An error occurred while processing the referral"
     
     def extract_referral_code_from_invite_link(self, invite_link: str) -> Optional[str]:
@@ -73,7 +74,7 @@ class ReferralSystem:
             # We need to track this mapping in the database
             return None  # This will be handled by tracking invite link usage
         except Exception as e:
-            logger.error(f"Error extracting referral code from invite link: {e}")
+            logger.error("Error extracting referral code from invite link: %s", e)
             return None
     
     def check_referral_target_reached(self, user_id: int, target: int) -> bool:
@@ -84,7 +85,11 @@ class ReferralSystem:
     def get_referral_progress(self, user_id: int, target: int) -> dict:
         """Get detailed referral progress for a user"""
         active_referrals, total_referrals = self.db.get_referral_stats(user_id)
-        
+        return self.build_progress(active_referrals, total_referrals, target)
+    
+    @staticmethod
+    def build_progress(active_referrals: int, total_referrals: int, target: int) -> dict:
+        """Derive the progress fields from the referral counters"""
         return {
             'active_referrals': active_referrals,
             'total_referrals': total_referrals,
@@ -94,12 +99,18 @@ class ReferralSystem:
             'progress_percentage': min(100, (active_referrals / target) * 100) if target > 0 else 0
         }
     
-    def handle_user_left_channel(self, user_id: int) -> List[int]:
-        """Handle when a user leaves the channel - notify their referrer"""
+    def handle_user_left_channel(self, user_id: int, changed_at: Optional[int] = None) -> List[int]:
+        """Handle when a user leaves the channel; returns the referrers whose active count dropped
+
+        changed_at is the update's date. A leave older than the stored
+        membership does not change it, but still deactivates the referral:
+        the user did leave, and referrals are never reactivated.
+        """
         try:
-            # Update user's channel membership
-            self.db.update_channel_membership(user_id, False)
-            self.db.log_channel_event(user_id, 'left')
+            if changed_at is None:
+                changed_at = int(time.time())
+            if self.db.record_membership_change(user_id, False, changed_at):
+                self.db.log_channel_event(user_id, 'left')
             
             # Find who referred this user and deactivate the referral
             user = self.db.get_user(user_id)
@@ -107,8 +118,8 @@ class ReferralSystem:
             
             if user and user['referred_by']:
                 referrer_id = user['referred_by']
-                self.db.deactivate_referral(referrer_id, user_id)
-                affected_referrers.append(referrer_id)
+                if self.db.deactivate_referral(referrer_id, user_id):
+                    affected_referrers.append(referrer_id)
             
             # Also deactivate any referrals this user made
             # This is handled by the database query in get_referral_stats
@@ -116,25 +127,38 @@ class ReferralSystem:
             return affected_referrers
             
         except Exception as e:
-            logger.error(f"Error handling user left channel: {e}")
+            logger.error("Error handling user left channel: %s", e)
             return []
     
-    def handle_user_joined_channel(self, user_id: int) -> Optional[int]:
-        """Handle when a user joins the channel"""
+    def handle_user_joined_channel(self, user_id: int, changed_at: Optional[int] = None) -> Tuple[bool, Optional[int]]:
+        """Handle when a user joins the channel; returns (first join, referrer ID)
+
+        The dated membership change only decides is_channel_member. The
+        welcome, referrer notice and campaign credit go with the user's first
+        join, recorded once by mark_channel_joined, even when a /start or
+        membership check already set the flag. A 'joined' event is logged for
+        the first join and for every later join that changed the membership.
+        Rejoins and repeated joins return (False, None).
+        """
         try:
-            # Update user's channel membership
-            self.db.update_channel_membership(user_id, True)
-            self.db.log_channel_event(user_id, 'joined')
+            if changed_at is None:
+                changed_at = int(time.time())
+            changed = self.db.record_membership_change(user_id, True, changed_at)
+            first_join = self.db.mark_channel_joined(user_id, changed_at)
+            if changed or first_join:
+                self.db.log_channel_event(user_id, 'joined')
+            if not first_join:
+                return False, None
             
             # If this user was referred, activate the referral
             user = self.db.get_user(user_id)
             if user and user['referred_by']:
                 referrer_id = user['referred_by']
                 # Referral is automatically active when user is channel member
-                return referrer_id
+                return True, referrer_id
             
-            return None
+            return True, None
             
         except Exception as e:
-            logger.error(f"Error handling user joined channel: {e}")
-            return None
+            logger.error("Error handling user joined channel: %s", e)
+            return False, None
@@ -0,0 +1,169 @@
+"""Daily rollups of the event log for /admin_report
+
+DailyRollup folds channel_events into daily_stats: channel joins and
+leaves, new referrals and reward claims per UTC day. The id of the last
+event folded in is kept in daily_stats_progress and advanced in the same
+transaction as the counts, so each compaction only reads the events written
+since the previous one, in chunks of at most chunk_size events. A report
+then reads one row per day, however long the history is.
+
+The bot compacts every COMPACT_INTERVAL seconds as a background job, and
+again right before rendering a report. On a sharded database each shard
+keeps the rollup of its own events and reports add them up.
+
+Usage:
+    python -m telegramreferralpro.rollups compact
+    python -m telegramreferralpro.rollups report [--days 14] [--csv report.csv]
+"""
+
+import argparse
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from .database import EVENT_REFERRAL_ADDED, EVENT_REWARD_CLAIMED
+
+logger = logging.getLogger(__name__)
+
+# Logged by ReferralSystem when a chat_member update changes the membership
+EVENT_JOINED = 'joined'
+EVENT_LEFT = 'left'
+
+# Rollup column -> event type it counts
+ROLLUP_EVENTS = {
+    'joins': EVENT_JOINED,
+    'leaves': EVENT_LEFT,
+    'referrals': EVENT_REFERRAL_ADDED,
+    'claims': EVENT_REWARD_CLAIMED,
+}
+COMPACT_CHUNK = 20000
+COMPACT_INTERVAL = 60.0
+DEFAULT_REPORT_DAYS = 14
+MAX_REPORT_DAYS = 366
+CHART_WIDTH = 12
+# Days drawn in a chart; longer reports keep the full range in the totals and the CSV
+CHART_MAX_DAYS = 31
+
+class DailyRollup:
+    """Per-day counts of joins, leaves, referrals and claims"""
+
+    def __init__(self, database, chunk_size: int = COMPACT_CHUNK):
+        self.db = database
+        self.chunk_size = chunk_size
+
+    def _compact_chunk(self, shard) -> int:
+        """Fold the next chunk of one shard's events; returns the number of events read"""
+        columns = ', '.join(ROLLUP_EVENTS)
+        with shard.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            position = cursor.execute('SELECT last_event_id FROM daily_stats_progress WHERE id = 1').fetchone()[0]
+            upper, count = cursor.execute('''
+                SELECT MAX(id), COUNT(*) FROM (SELECT id FROM channel_events WHERE id > ? ORDER BY id LIMIT ?)
+            ''', (position, self.chunk_size)).fetchone()
+            if not count:
+                conn.rollback()
+                return 0
+            cursor.execute(f'''
+                INSERT INTO daily_stats (day, {columns})
+                SELECT date(timestamp), {', '.join('SUM(event_type = ?)' for _ in ROLLUP_EVENTS)}
+                FROM channel_events
+                WHERE id > ? AND id <= ? AND timestamp IS NOT NULL
+                  AND event_type IN ({', '.join('?' for _ in ROLLUP_EVENTS)})
+                GROUP BY date(timestamp)
+                ON CONFLICT (day) DO UPDATE SET
+                    {', '.join(f'{column} = {column} + excluded.{column}' for column in ROLLUP_EVENTS)}
+            ''', (*ROLLUP_EVENTS.values(), position, upper, *ROLLUP_EVENTS.values()))
+            cursor.execute('UPDATE daily_stats_progress SET last_event_id = ? WHERE id = 1', (upper,))
+            conn.commit()
+            return count
+
+    def compact(self, max_events: Optional[int] = None) -> int:
+        """Fold new events into daily_stats, at most about max_events per shard; returns events read"""
+        total = 0
+        for shard in self.db.shards:
+            folded = 0
+            try:
+                while max_events is None or folded < max_events:
+                    count = self._compact_chunk(shard)
+                    if not count:
+                        break
+                    folded += count
+            except Exception as e:
+                logger.error("Error compacting daily stats of %s: %s", shard.db_path, e)
+            total += folded
+        if total:
+            logger.info("Folded %s events into daily stats", total)
+        return total
+
+    def days(self, days: int = DEFAULT_REPORT_DAYS) -> List[dict]:
+        """One row per UTC day for the last `days` days, oldest first, with zeros for quiet days"""
+        today = datetime.now(timezone.utc).date()
+        first = today - timedelta(days=days - 1)
+        rows = {(first + timedelta(days=offset)).isoformat(): dict.fromkeys(ROLLUP_EVENTS, 0)
+                for offset in range(days)}
+        for shard in self.db.shards:
+            try:
+                with shard.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f'SELECT day, {", ".join(ROLLUP_EVENTS)} FROM daily_stats WHERE day >= ?',
+                                   (first.isoformat(),))
+                    for row in cursor.fetchall():
+                        if row['day'] in rows:
+                            for column in ROLLUP_EVENTS:
+                                rows[row['day']][column] += row[column]
+            except Exception as e:
+                logger.error("Error reading daily stats of %s: %s", shard.db_path, e)
+        return [{'day': day, **counts} for day, counts in rows.items()]
+
+def render_chart(rows: List[dict], max_days: int = CHART_MAX_DAYS) -> str:
+    """Monospace table with a bar of joins for each of the last max_days days, and totals of all rows"""
+    shown = rows[-max_days:]
+    peak = max((row['joins'] for row in shown), default=0)
+    lines = [f"{'Day':<5} {'':<{CHART_WIDTH}} {'Joins':>5} {'Left':>5} {'Refs':>5} {'Claims':>6}"]
+    if len(shown) < len(rows):
+        lines.append(f"({len(rows) - len(shown)} earlier days in the totals and the CSV)")
+    for row in shown:
+        bar = '█' * round(row['joins'] / peak * CHART_WIDTH) if peak else ''
+        lines.append(f"{row['day'][5:]:<5} {bar:<{CHART_WIDTH}} {row['joins']:>5} {row['leaves']:>5} "
+                     f"{row['referrals']:>5} {row['claims']:>6}")
+    totals = {column: sum(row[column] for row in rows) for column in ROLLUP_EVENTS}
+    lines.append(f"{'Total':<5} {'':<{CHART_WIDTH}} {totals['joins']:>5} {totals['leaves']:>5} "
+                 f"{totals['referrals']:>5} {totals['claims']:>6}")
+    return '\n'.join(lines)
+
+def to_csv(rows: List[dict]) -> bytes:
+    """Rows as a CSV file"""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=['day', *ROLLUP_EVENTS])
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue().encode()
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Daily rollups of joins, leaves, referrals and claims")
+    parser.add_argument('command', choices=['compact', 'report'])
+    parser.add_argument('--db', default='bot_database.db', help="Database file")
+    parser.add_argument('--days', type=int, default=DEFAULT_REPORT_DAYS)
+    parser.add_argument('--csv', help="Also write the report as CSV to this file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from .database import Database
+    rollup = DailyRollup(Database(args.db))
+    folded = rollup.compact()
+    if args.command == 'compact':
+        print(json.dumps({'events_folded': folded}))
+        return
+    rows = rollup.days(min(max(args.days, 1), MAX_REPORT_DAYS))
+    print(render_chart(rows))
+    if args.csv:
+        with open(args.csv, 'wb') as f:
+            f.write(to_csv(rows))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""User-sharded storage: one SQLite file per shard behind the Database interface
+
+Rows are partitioned by user: a user's row, invite links, language preference
+and channel events live on shard_for(user_id). A referral edge lives on the
+shard of the *referred* user, next to the membership it depends on, so every
+write touches exactly one file. Each shard's referral_counters therefore hold
+partial counts for referrers on any shard, and reads of a referrer's counts,
+lookups by referral code or invite link name, and the admin totals fan out
+over all shards.
+
+Tables that are not per user (campaigns and their counters, event replay
+snapshots) stay on shard 0, which get_connection() returns.
+
+Enabled with DATABASE_SHARDS > 1. bot_database.db becomes
+bot_database.shard00.db, bot_database.shard01.db, ... An existing database is
+split with:
+
+    python -m telegramreferralpro.sharding split --db bot_database.db --shards 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from typing import List, Optional, Tuple
+
+from .database import Database
+
+logger = logging.getLogger(__name__)
+
+# Tables partitioned by user, with the column that decides the shard
+SHARDED_TABLES = {
+    'users': 'user_id',
+    'referrals': 'referred_user_id',
+    'invite_links': 'user_id',
+    'user_languages': 'user_id',
+    'channel_events': 'user_id',
+}
+# Tables copied to shard 0 only
+GLOBAL_TABLES = ('campaigns', 'campaign_progress', 'campaign_credits')
+
+def shard_for(user_id: Optional[int], shards: int) -> int:
+    """Stable shard index for a user (the same in every process, unlike hash())"""
+    if user_id is None:
+        return 0
+    return zlib.crc32(user_id.to_bytes(8, 'little', signed=True)) % shards
+
+def shard_path(db_path: str, index: int) -> str:
+    """bot_database.db -> bot_database.shard03.db"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard{index:02d}{ext or '.db'}"
+
+class ShardedDatabase:
+    """Route Database calls to per-user shards and merge fan-out reads"""
+
+    def __init__(self, db_path: str, shards: int, profiler=None, migrate: bool = True):
+        self.db_path = db_path
+        self.profiler = profiler
+        self._shards = [Database(shard_path(db_path, index), profiler=profiler, migrate=migrate)
+                        for index in range(shards)]
+
+    @property
+    def shards(self) -> List[Database]:
+        return self._shards
+
+    @property
+    def pending_backfills(self) -> set:
+        return set().union(*(shard.pending_backfills for shard in self._shards))
+
+    def for_user(self, user_id: int) -> Database:
+        """Shard holding this user's rows"""
+        return self._shards[shard_for(user_id, len(self._shards))]
+
+    def get_connection(self):
+        """Connection to shard 0, which holds the tables that are not per user"""
+        return self._shards[0].get_connection()
+
+    def init_database(self):
+        """Bring every shard's schema up to date"""
+        for shard in self._shards:
+            shard.init_database()
+
+    def enable_wal(self) -> bool:
+        """Switch every shard to write-ahead logging"""
+        return all([shard.enable_wal() for shard in self._shards])
+
+    def rebuild_referral_counters(self) -> bool:
+        """Recompute every shard's partial referral counters"""
+        return all([shard.rebuild_referral_counters() for shard in self._shards])
+
+    def verify_stats(self) -> Optional[dict]:
+        """Recount every shard's stats row; returns the summed corrections"""
+        corrections = [shard.verify_stats() for shard in self._shards]
+        if None in corrections:
+            return None
+        return {name: sum(drift.get(name, 0) for drift in corrections)
+                for name in set().union(*corrections)}
+
+    def get_update_window(self, name: str) -> Optional[sqlite3.Row]:
+        """Get a saved update_id window (kept on shard 0)"""
+        return self._shards[0].get_update_window(name)
+
+    def save_update_window(self, name: str, base: int, bitmap: bytes, polling_offset: Optional[int]) -> bool:
+        """Save an update_id window (kept on shard 0)"""
+        return self._shards[0].save_update_window(name, base, bitmap, polling_offset)
+
+    # Single-shard operations
+
+    def add_user(self, user_id: int, username: str = None, first_name: str = None,
+                 last_name: str = None, referral_code: str = None, referred_by: int = None) -> bool:
+        """Add a new user to the database"""
+        return self.for_user(user_id).add_user(user_id, username, first_name, last_name, referral_code, referred_by)
+
+    def get_user(self, user_id: int) -> Optional[sqlite3.Row]:
+        """Get user by ID"""
+        return self.for_user(user_id).get_user(user_id)
+
+    def update_channel_membership(self, user_id: int, is_member: bool) -> bool:
+        """Update user's channel membership status"""
+        return self.for_user(user_id).update_channel_membership(user_id, is_member)
+
+    def record_membership_change(self, user_id: int, is_member: bool, changed_at: int) -> bool:
+        """Apply a dated join/leave unless a later one was already applied"""
+        return self.for_user(user_id).record_membership_change(user_id, is_member, changed_at)
+
+    def mark_channel_joined(self, user_id: int, joined_at: int) -> bool:
+        """Record a user's first channel join"""
+        return self.for_user(user_id).mark_channel_joined(user_id, joined_at)
+
+    def add_referral(self, referrer_id: int, referred_user_id: int) -> bool:
+        """Add a referral relationship on the referred user's shard"""
+        return self.for_user(referred_user_id).add_referral(referrer_id, referred_user_id)
+
+    def deactivate_referral(self, referrer_id: int, referred_user_id: int) -> bool:
+        """Deactivate a referral when user leaves channel"""
+        return self.for_user(referred_user_id).deactivate_referral(referrer_id, referred_user_id)
+
+    def mark_reward_claimed(self, user_id: int) -> bool:
+        """Mark reward as claimed for a user"""
+        return self.for_user(user_id).mark_reward_claimed(user_id)
+
+    def log_channel_event(self, user_id: int, event_type: str, payload: dict = None) -> bool:
+        """Log channel events (join/leave)"""
+        return self.for_user(user_id).log_channel_event(user_id, event_type, payload)
+
+    def store_invite_link(self, user_id: int, referral_code: str, invite_link: str, invite_link_name: str) -> bool:
+        """Store a user's unique invite link"""
+        return self.for_user(user_id).store_invite_link(user_id, referral_code, invite_link, invite_link_name)
+
+    def get_invite_link(self, user_id: int) -> Optional[str]:
+        """Get user's stored invite link"""
+        return self.for_user(user_id).get_invite_link(user_id)
+
+    # Fan-out reads
+
+    def get_user_by_referral_code(self, referral_code: str) -> Optional[sqlite3.Row]:
+        """Get user by referral code (searched on every shard)"""
+        for shard in self._shards:
+            user = shard.get_user_by_referral_code(referral_code)
+            if user:
+                return user
+        return None
+
+    def get_referrer_by_invite_link_name(self, invite_link_name: str) -> Optional[int]:
+        """Get referrer user ID by invite link name (searched on every shard)"""
+        for shard in self._shards:
+            referrer_id = shard.get_referrer_by_invite_link_name(invite_link_name)
+            if referrer_id is not None:
+                return referrer_id
+        return None
+
+    def get_referral_stats(self, user_id: int) -> Tuple[int, int]:
+        """Sum of the partial (active, total) counts held by every shard"""
+        active = total = 0
+        for shard in self._shards:
+            shard_active, shard_total = shard.get_referral_stats(user_id)
+            active += shard_active
+            total += shard_total
+        return active, total
+
+    def get_stats(self) -> dict:
+        """Sum of every shard's stats row"""
+        totals = {}
+        for shard in self._shards:
+            for name, value in shard.get_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def get_all_users_count(self) -> int:
+        """Get total number of users"""
+        return sum(shard.get_all_users_count() for shard in self._shards)
+
+    def get_channel_members_count(self) -> int:
+        """Get number of active channel members"""
+        return sum(shard.get_channel_members_count() for shard in self._shards)
+
+    def get_active_referrals_count(self) -> int:
+        """Get number of active referrals"""
+        return sum(shard.get_active_referrals_count() for shard in self._shards)
+
+    def get_rewards_claimed_count(self) -> int:
+        """Get number of users who claimed their reward"""
+        return sum(shard.get_rewards_claimed_count() for shard in self._shards)
+
+def split_database(source_path: str, shards: int, target_path: Optional[str] = None) -> dict:
+    """Copy a single-file database into shard files; the source is left untouched"""
+    target_path = target_path or source_path
+    source = Database(source_path)
+    sharded = ShardedDatabase(target_path, shards)
+    copied = {table: 0 for table in (*SHARDED_TABLES, *GLOBAL_TABLES)}
+    for index, shard in enumerate(sharded.shards):
+        conn = sqlite3.connect(shard.db_path)
+        try:
+            conn.create_function('shard_of', 1, lambda user_id: shard_for(user_id, shards), deterministic=True)
+            conn.execute('ATTACH DATABASE ? AS source', (source.db_path,))
+            for table, column in SHARDED_TABLES.items():
+                cursor = conn.execute(f'INSERT INTO {table} SELECT * FROM source.{table} WHERE shard_of({column}) = ?',
+                                      (index,))
+                copied[table] += cursor.rowcount
+            if index == 0:
+                for table in GLOBAL_TABLES:
+                    copied[table] += conn.execute(f'INSERT INTO {table} SELECT * FROM source.{table}').rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    # Counters are partial per shard, so they are recomputed rather than copied
+    sharded.rebuild_referral_counters()
+    sharded.verify_stats()
+    return copied
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Split a database into user shards")
+    parser.add_argument('command', choices=['split', 'status'])
+    parser.add_argument('--db', default='bot_database.db', help="Path to the single-file database")
+    parser.add_argument('--shards', type=int, required=True)
+    parser.add_argument('--target', help="Base path of the shard files (default: --db)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'split':
+        print(json.dumps(split_database(args.db, args.shards, args.target)))
+    else:
+        sharded = ShardedDatabase(args.target or args.db, args.shards)
+        print(json.dumps([{'path': shard.db_path, 'users': shard.get_all_users_count()}
+                          for shard in sharded.shards], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Per-user rate limiting for commands and button callbacks"""
+
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 1.0           # tokens refilled per second
+DEFAULT_BURST = 5            # bucket capacity
+DEFAULT_EVICT_INTERVAL = 60  # seconds between sweeps of idle buckets
+
+class UserThrottle:
+    """Token bucket per user, stored as a (tokens, last_refill) tuple keyed by user ID"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 evict_interval: float = DEFAULT_EVICT_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError("Throttle rate must be positive and burst at least 1")
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.evict_interval = evict_interval
+        self._clock = clock
+        self._buckets: Dict[int, Tuple[float, float]] = {}
+        # A bucket idle this long has refilled completely and carries no state worth keeping
+        self._idle_after = self.burst / self.rate
+        self._next_eviction = clock() + evict_interval
+        self.allowed = 0
+        self.throttled = 0
+
+    def allow(self, user_id: int) -> bool:
+        """Take one token from the user's bucket; False if the bucket is empty"""
+        now = self._clock()
+        if now >= self._next_eviction:
+            self.evict_idle(now)
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            tokens = self.burst
+        else:
+            tokens, last = bucket
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+        if tokens < 1.0:
+            self._buckets[user_id] = (tokens, now)
+            self.throttled += 1
+            return False
+
+        self._buckets[user_id] = (tokens - 1.0, now)
+        self.allowed += 1
+        return True
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Drop buckets that have been idle long enough to be full again"""
+        if now is None:
+            now = self._clock()
+        cutoff = now - self._idle_after
+        idle = [user_id for user_id, (_, last) in self._buckets.items() if last <= cutoff]
+        for user_id in idle:
+            del self._buckets[user_id]
+        self._next_eviction = now + self.evict_interval
+        if idle:
+            logger.debug("Evicted %s idle throttle buckets, %s remaining", len(idle), len(self._buckets))
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
@@ -1,24 +1,112 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
 import re
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 from typing import Optional
 from telegram import Bot, ChatMember
 from telegram.error import TelegramError
 
 logger = logging.getLogger(__name__)
 
-def setup_logging():
-    """Setup logging configuration"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('bot.log'),
-            logging.StreamHandler()
-        ]
-    )
+# Correlation ID of the update being handled, attached to every log record emitted while handling it
+correlation_id: ContextVar[str] = ContextVar('correlation_id', default='-')
+
+TEXT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s'
+
+_log_listener: Optional[QueueListener] = None
+
+class CorrelationIdFilter(logging.Filter):
+    """Stamp records with the current correlation ID"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'correlation_id': getattr(record, 'correlation_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class _DeferredFormatQueueHandler(QueueHandler):
+    """Merge the message arguments on the calling thread but leave layout to the listener's handlers"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(log_file: Optional[str] = None, level: Optional[str] = None, json_format: Optional[bool] = None):
+    """Setup logging configuration
+
+    Records go through a queue to a background thread that writes the rotating
+    log file and the console, so logging never blocks the event loop. Settings
+    default to LOG_FILE, LOG_LEVEL, LOG_FORMAT (text|json), LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN (time-based rotation, e.g. "midnight") and LOG_BACKUP_COUNT.
+    """
+    global _log_listener
+    if _log_listener is not None:
+        return _log_listener
+
+    log_file = log_file or os.getenv("LOG_FILE", "bot.log")
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    if json_format is None:
+        json_format = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    rotate_when = os.getenv("LOG_ROTATE_WHEN")
+
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count,
+                                                encoding='utf-8')
+    else:
+        file_handler = RotatingFileHandler(log_file, maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+                                           backupCount=backup_count, encoding='utf-8')
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_LOG_FORMAT)
+    handlers = [file_handler, logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = _DeferredFormatQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(CorrelationIdFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _log_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_log_listener.stop)
+
     # Reduce telegram library logging
     logging.getLogger('telegram').setLevel(logging.WARNING)
     logging.getLogger('httpx').setLevel(logging.WARNING)
+    return _log_listener
+
+async def bind_correlation_id(update, context) -> None:
+    """Give log records emitted while handling an update that update's ID"""
+    correlation_id.set(f"u{update.update_id}" if getattr(update, 'update_id', None) is not None else '-')
 
 class TelegramUtils:
     def __init__(self, bot: Bot, channel_id: str, channel_username: str):
@@ -39,17 +127,21 @@ class TelegramUtils:
             invite_link = await self.bot.create_chat_invite_link(self.channel_id, **params)
             return invite_link.invite_link
         except Exception as e:
-            logger.error(f"Error creating invite link: {e}")
+            logger.error("Error creating invite link: %s", e)
             return self.get_channel_link()
 
     async def check_channel_membership(self, user_id: int) -> bool:
         """Check if a user is a member of the channel"""
+        return await self.get_channel_membership(user_id) is True
+
+    async def get_channel_membership(self, user_id: int) -> Optional[bool]:
+        """Channel membership as Telegram reports it, or None when the check failed"""
         try:
             member = await self.bot.get_chat_member(self.channel_id, user_id)
             return member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]
         except TelegramError as e:
-            logger.warning(f"Error checking membership for user {user_id}: {e}")
-            return False
+            logger.warning("Error checking membership for user %s: %s", user_id, e)
+            return None
 
     def get_channel_link(self) -> str:
         """Get the channel invite link"""
@@ -70,7 +162,7 @@ class TelegramUtils:
                 'member_count': await self.bot.get_chat_member_count(self.channel_id) if hasattr(chat, 'member_count') else None
             }
         except TelegramError as e:
-            logger.error(f"Error getting chat info: {e}")
+            logger.error("Error getting chat info: %s", e)
             return None
 
     async def send_message_safe(self, user_id: int, text: str, **kwargs) -> bool:
@@ -79,7 +171,7 @@ class TelegramUtils:
             await self.bot.send_message(user_id, text, **kwargs)
             return True
         except TelegramError as e:
-            logger.warning(f"Failed to send message to user {user_id}: {e}")
+            logger.warning("Failed to send message to user %s: %s", user_id, e)
             return False
 
     def is_admin(self, user_id: int, admin_user_ids: list) -> bool:
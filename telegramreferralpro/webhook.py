@@ -0,0 +1,339 @@
+"""Webhook HTTP server and fast update ingestion
+
+WebhookServer answers Telegram's POST as soon as the update has been handed
+off. UpdateIngestor is the hand-off used in single-process webhook mode:
+updates are de-duplicated by update_id and queued on one of several bounded
+lanes, picked by user so each user's updates stay in order, and each lane is
+processed by its own task. When the lanes are full, updates either spill into
+a SQLite buffer (WEBHOOK_SPILL_DB) that is drained back in arrival order, or
+are refused with 503 so Telegram retries them later. On shutdown the lanes
+get STOP_TIMEOUT seconds to finish; whatever is still queued goes back into
+the spill buffer and is processed first on the next start.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import deque
+from typing import Callable, List, Optional
+
+from telegram import Update
+
+from .dedup import UpdateIdWindow
+from .sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member"]
+MAX_BODY_BYTES = 1024 * 1024
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_CONCURRENCY = 8
+REFILL_BATCH = 500
+STOP_TIMEOUT = 10
+
+def update_user_id(data: dict) -> Optional[int]:
+    """ID of the user a raw update is about, used to keep each user's updates in order"""
+    chat_member = data.get('chat_member')
+    if chat_member:
+        # The member who joined or left, not the admin who may have added them
+        return chat_member.get('new_chat_member', {}).get('user', {}).get('id')
+    for key in ('message', 'edited_message', 'callback_query', 'my_chat_member'):
+        if key in data:
+            return data[key].get('from', {}).get('id')
+    return None
+
+class WebhookServer:
+    """Accept POSTed updates on url_path and hand the decoded JSON to handle_update
+
+    handle_update returns False when the update cannot be accepted right now;
+    the server then answers 503 so Telegram delivers it again later.
+    Connections are kept alive between requests, as Telegram reuses them.
+    """
+
+    def __init__(self, handle_update: Callable[[dict], bool], port: int, host: str = '0.0.0.0',
+                 url_path: str = ''):
+        self.handle_update = handle_update
+        self.host = host
+        self.port = port
+        self.url_path = '/' + url_path.lstrip('/')
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections = set()
+
+    async def start(self) -> None:
+        """Start listening on the configured port"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Webhook server listening on %s:%s", self.host, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening"""
+        if self._server:
+            self._server.close()
+            # Idle keep-alive connections would otherwise hold wait_closed() open
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _respond(self, writer: asyncio.StreamWriter, status: str, keep_alive: bool) -> None:
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+        )
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), timeout=60)
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), timeout=5)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                length = int(headers.get('content-length', '0'))
+                if length > MAX_BODY_BYTES:
+                    self._respond(writer, '413 Payload Too Large', False)
+                    break
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=5) if length else b''
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) < 2 or parts[0] != 'POST' or parts[1] != self.url_path:
+                    status = '404 Not Found'
+                else:
+                    try:
+                        update = json.loads(body)
+                    except ValueError:
+                        status = '400 Bad Request'
+                    else:
+                        status = '200 OK' if self.handle_update(update) else '503 Service Unavailable'
+                self._respond(writer, status, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.warning("Webhook request failed: %s", e)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+class SpillBuffer:
+    """SQLite table holding updates that did not fit in memory, in arrival order
+
+    Only used from the event loop thread, so one connection is kept open.
+    Spilled updates survive a restart and are processed first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS webhook_spill (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                update_id INTEGER,
+                payload TEXT NOT NULL
+            )
+        ''')
+        self.count = self._conn.execute('SELECT COUNT(*) FROM webhook_spill').fetchone()[0]
+
+    def push(self, data: dict) -> None:
+        self._conn.execute('INSERT INTO webhook_spill (update_id, payload) VALUES (?, ?)',
+                           (data.get('update_id'), json.dumps(data)))
+        self.count += 1
+
+    def push_front(self, updates: List[dict]) -> None:
+        """Put updates back ahead of everything spilled so far, keeping their order"""
+        if not updates:
+            return
+        self._conn.execute('BEGIN IMMEDIATE')
+        first = self._conn.execute('SELECT COALESCE(MIN(id), 1) FROM webhook_spill').fetchone()[0]
+        self._conn.executemany('INSERT INTO webhook_spill (id, update_id, payload) VALUES (?, ?, ?)', [
+            (first - len(updates) + offset, data.get('update_id'), json.dumps(data))
+            for offset, data in enumerate(updates)
+        ])
+        self._conn.execute('COMMIT')
+        self.count += len(updates)
+
+    def pop_batch(self, limit: int) -> List[dict]:
+        """Remove and return the oldest updates"""
+        self._conn.execute('BEGIN IMMEDIATE')
+        rows = self._conn.execute('SELECT id, payload FROM webhook_spill ORDER BY id LIMIT ?', (limit,)).fetchall()
+        if rows:
+            self._conn.execute('DELETE FROM webhook_spill WHERE id <= ?', (rows[-1][0],))
+        self._conn.execute('COMMIT')
+        self.count -= len(rows)
+        return [json.loads(payload) for _, payload in rows]
+
+    def close(self) -> None:
+        self._conn.close()
+
+class UpdateIngestor:
+    """Accept webhook updates at once and process them from bounded per-user lanes"""
+
+    def __init__(self, application, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 concurrency: int = DEFAULT_CONCURRENCY, spill_path: Optional[str] = None):
+        self.application = application
+        self.concurrency = concurrency
+        self._lanes = [asyncio.Queue(max(1, queue_size // concurrency)) for _ in range(concurrency)]
+        self.spill = SpillBuffer(spill_path) if spill_path else None
+        # Redeliveries are dropped before queueing; the Application's own check covers restarts
+        self.recent = UpdateIdWindow()
+        self._spill_ready = asyncio.Event()
+        # Spilled updates taken from the buffer but not yet queued; new updates wait behind them
+        self._refilling: deque = deque()
+        # The update each lane is processing right now
+        self._current: List[Optional[dict]] = [None] * concurrency
+        self._refill_task: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.duplicates = 0
+        self.spilled = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    def _lane(self, data: dict) -> asyncio.Queue:
+        return self._lanes[shard_for(update_user_id(data), self.concurrency)]
+
+    def offer(self, data: dict) -> bool:
+        """Queue an update (WebhookServer's handler); False means "retry later\""""
+        update_id = data.get('update_id')
+        if update_id in self.recent:
+            self.duplicates += 1
+            return True
+        lane = self._lane(data)
+        if self.spill is not None and (self.spill.count or self._refilling or lane.full()):
+            # Once anything is spilled, later updates queue behind it to keep arrival order
+            self.spill.push(data)
+            self.spilled += 1
+            self._spill_ready.set()
+        else:
+            try:
+                lane.put_nowait(data)
+            except asyncio.QueueFull:
+                self.rejected += 1
+                return False
+        self.recent.add(update_id)
+        self.accepted += 1
+        return True
+
+    async def _consume(self, index: int) -> None:
+        application = self.application
+        lane = self._lanes[index]
+        while True:
+            data = await lane.get()
+            self._current[index] = data
+            try:
+                await application.process_update(Update.de_json(data, application.bot))
+            except Exception as e:
+                self.failed += 1
+                logger.error("Error processing update %s: %s", data.get('update_id'), e)
+            # Not reached when stop() cancels the task: the update is then kept for the next start
+            self._current[index] = None
+            self.processed += 1
+            lane.task_done()
+
+    async def _refill(self) -> None:
+        """Move spilled updates back onto the lanes, oldest first, as room frees up"""
+        while True:
+            await self._spill_ready.wait()
+            batch = self.spill.pop_batch(REFILL_BATCH)
+            if not batch:
+                self._spill_ready.clear()
+                continue
+            self._refilling.extend(batch)
+            while self._refilling:
+                data = self._refilling[0]
+                await self._lane(data).put(data)
+                self._refilling.popleft()
+
+    async def start(self) -> None:
+        """Start one processing task per lane (and the spill refill)"""
+        self._tasks = [asyncio.create_task(self._consume(index)) for index in range(self.concurrency)]
+        if self.spill is not None:
+            self._refill_task = asyncio.create_task(self._refill())
+            if self.spill.count:
+                logger.info("Resuming %s spilled updates", self.spill.count)
+                self._spill_ready.set()
+
+    async def drain(self) -> None:
+        """Wait until everything accepted so far has been processed"""
+        while (self.spill is not None and (self.spill.count or self._refilling)) or \
+                any(lane.qsize() or lane._unfinished_tasks for lane in self._lanes):
+            await asyncio.sleep(0.01)
+
+    async def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Let the lanes finish for up to `timeout` seconds, then keep what is left in the spill buffer"""
+        # Spilled updates stay in the buffer; only the lanes are worked off
+        if self._refill_task:
+            self._refill_task.cancel()
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+            self._refill_task = None
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook lanes did not finish within %ss", timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Interrupted updates first, then each lane in order, then the refill that was under way
+        left = [data for data in self._current if data is not None]
+        self._current = [None] * self.concurrency
+        for lane in self._lanes:
+            while not lane.empty():
+                left.append(lane.get_nowait())
+        left.extend(self._refilling)
+        self._refilling.clear()
+        if self.spill is not None:
+            if left:
+                self.spill.push_front(left)
+                logger.info("Kept %s unprocessed updates for the next start", len(left))
+            self.spill.close()
+        elif left:
+            logger.warning("Dropped %s unprocessed updates; set WEBHOOK_SPILL_DB to keep them", len(left))
+
+    def stats(self) -> dict:
+        return {
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'spilled': self.spilled,
+            'rejected': self.rejected,
+            'processed': self.processed,
+            'failed': self.failed,
+            'queued': sum(lane.qsize() for lane in self._lanes),
+            'spill_backlog': self.spill.count if self.spill is not None else 0,
+        }
+
+async def serve_webhook(application, config) -> None:
+    """Run an Application in webhook mode with immediate acks until cancelled"""
+    ingestor = UpdateIngestor(application, config.webhook_queue_size, config.webhook_concurrency,
+                              config.webhook_spill_path)
+    server = WebhookServer(ingestor.offer, config.port, url_path=config.bot_token)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.bot.set_webhook(config.webhook_url, allowed_updates=ALLOWED_UPDATES)
+    await application.start()
+    await ingestor.start()
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        await ingestor.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        logger.info("Webhook stopped: %s", ingestor.stats())
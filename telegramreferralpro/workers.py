@@ -0,0 +1,200 @@
+"""Run the bot as several worker processes behind one webhook front process
+
+The front process receives webhook updates and routes each one to a worker by
+a hash of the user it concerns, so all updates of one user are handled by the
+same worker, in order. Every worker is a full Application with its own
+BotHandlers, caches and throttle. State shared between users (referral
+counters, memberships) lives in the SQLite database, which is switched to WAL
+mode so readers never wait for the writer and writes from different workers
+queue on the database lock instead of failing.
+
+The front process migrates the schema and runs the backfills; every worker
+queues background jobs, but only worker 0 runs them.
+
+Enabled by setting WORKERS > 1 together with WEBHOOK_URL (see main.py).
+"""
+
+import asyncio
+import dataclasses
+import logging
+import multiprocessing
+import os
+import queue
+from typing import Callable, List, Optional
+
+from telegram import Bot, Update
+
+from .config import BotConfig
+from .sharding import shard_for
+from .dedup import UpdateDeduplicator
+from .migrations import MigrationRunner
+from .webhook import ALLOWED_UPDATES, WebhookServer, update_user_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+BATCH_SIZE = 100
+
+def _worker_log_file(index: int) -> str:
+    """bot.log -> bot.worker1.log; rotating one file from several processes loses records"""
+    root, ext = os.path.splitext(os.getenv("LOG_FILE", "bot.log"))
+    return f"{root}.worker{index}{ext}"
+
+def _worker_main(config: BotConfig, index: int, updates: multiprocessing.Queue, processed, ready,
+                 request_factory: Optional[Callable], configure_logging: bool) -> None:
+    """Entry point of a worker process"""
+    if configure_logging:
+        from .utils import setup_logging
+        setup_logging(log_file=_worker_log_file(index))
+    else:
+        logging.disable(logging.CRITICAL)
+    try:
+        asyncio.run(_run_worker(config, index, updates, processed, ready, request_factory))
+    except KeyboardInterrupt:
+        pass
+
+async def _run_worker(config: BotConfig, index: int, updates: multiprocessing.Queue, processed, ready,
+                      request_factory: Optional[Callable]) -> None:
+    from .main import build_application
+
+    request = request_factory(index) if request_factory else None
+    # The front process drops redelivered updates for all workers; METRICS_PORT cannot be bound by every worker
+    config = dataclasses.replace(config, metrics_port=None)
+    application = build_application(config, request=request, get_updates_request=request, deduplicate=False,
+                                    migrate=False, run_jobs=index == 0)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    ready.set()
+    logger.info("Worker %s ready", index)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Block in a thread for the next update, then take whatever else is already queued
+            batch = [await loop.run_in_executor(None, updates.get)]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            for data in batch:
+                if data is None:
+                    return
+                try:
+                    await application.process_update(Update.de_json(data, application.bot))
+                except Exception as e:
+                    logger.error("Worker %s failed to process update %s: %s", index, data.get('update_id'), e)
+                with processed.get_lock():
+                    processed[index] += 1
+    finally:
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        logger.info("Worker %s stopped", index)
+
+class WorkerPool:
+    """Worker processes fed through one bounded queue each"""
+
+    def __init__(self, config: BotConfig, workers: int, request_factory: Optional[Callable] = None,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, configure_logging: bool = True):
+        self.config = config
+        self.workers = workers
+        self.request_factory = request_factory
+        self.queue_size = queue_size
+        self.configure_logging = configure_logging
+        # Fresh interpreters: nothing (event loop, sqlite handles) is inherited from the front process
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._processed = self._context.Array('q', workers)
+        self.rejected = 0
+
+    def start(self, timeout: float = 60) -> None:
+        """Start every worker and wait until all of them are initialized"""
+        events = []
+        for index in range(self.workers):
+            updates = self._context.Queue(self.queue_size)
+            ready = self._context.Event()
+            process = self._context.Process(
+                target=_worker_main, name=f"worker-{index}", daemon=True,
+                args=(self.config, index, updates, self._processed, ready, self.request_factory,
+                      self.configure_logging),
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+            events.append(ready)
+        for index, ready in enumerate(events):
+            if not ready.wait(timeout):
+                raise RuntimeError(f"Worker {index} did not start within {timeout}s")
+        logger.info("%s workers started", self.workers)
+
+    def dispatch(self, data: dict) -> bool:
+        """Queue an update on its user's worker; False if that worker is backed up"""
+        index = shard_for(update_user_id(data), self.workers)
+        try:
+            self._queues[index].put_nowait(data)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def processed(self) -> List[int]:
+        """Updates processed so far by each worker"""
+        return list(self._processed)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Let every worker finish its queue, then stop it"""
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", process.name)
+                process.terminate()
+        self._queues, self._processes = [], []
+
+async def _serve_webhook(config: BotConfig, pool: WorkerPool, deduplicator: UpdateDeduplicator, database) -> None:
+    """Register the webhook, finish the backfills and route incoming updates until cancelled"""
+    def handle_update(data: dict) -> bool:
+        update_id = data.get('update_id')
+        if deduplicator.seen(update_id):
+            deduplicator.duplicates += 1
+            return True
+        if not pool.dispatch(data):
+            return False
+        deduplicator.mark(update_id)
+        return True
+
+    async with Bot(config.bot_token) as bot:
+        await bot.set_webhook(config.webhook_url, allowed_updates=ALLOWED_UPDATES)
+    server = WebhookServer(handle_update, config.port, url_path=config.bot_token)
+    save_task = asyncio.create_task(deduplicator.run())
+    backfill_tasks = [asyncio.create_task(MigrationRunner(shard, chunk_seconds=config.backfill_chunk_ms / 1000)
+                                          .run_backfills_async())
+                      for shard in database.shards if shard.pending_backfills]
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        save_task.cancel()
+        for task in backfill_tasks:
+            task.cancel()
+        deduplicator.save()
+
+def run_workers(config: BotConfig) -> None:
+    """Run the webhook front process with config.workers worker processes"""
+    from .main import open_database
+    # Migrate once here instead of in every worker, and let workers share the file
+    database = open_database(config)
+    if not database.enable_wal():
+        logger.warning("Could not enable WAL mode; workers will block each other's reads")
+    pool = WorkerPool(config, config.workers)
+    pool.start()
+    try:
+        asyncio.run(_serve_webhook(config, pool, UpdateDeduplicator(database), database))
+    except KeyboardInterrupt:
+        logger.info("Front process stopped by user")
+    finally:
+        pool.stop()
@@ -0,0 +1,39 @@
+"""Tests for the processed update_id window (telegramreferralpro/dedup.py)"""
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.dedup import UpdateDeduplicator, UpdateIdWindow
+
+def test_window_slides_forward():
+    """Newer ids slide the window; ids that fell just behind it still count as seen"""
+    window = UpdateIdWindow(bits=64)
+    for update_id in range(1000, 1010):
+        assert update_id not in window
+        window.add(update_id)
+        assert update_id in window
+    assert 1010 not in window
+
+    window.add(1100)
+    assert window.base > 1009
+    assert 1100 in window
+    assert 1009 in window
+    assert 1099 not in window
+    assert window.highest == 1100
+
+def test_backward_jump_resets_window_and_polling_offset(tmp_path):
+    """A restarted update sequence is processed, and the saved polling offset follows it"""
+    database = Database(str(tmp_path / 'bot.db'))
+    deduplicator = UpdateDeduplicator(database, bits=1024)
+    for update_id in range(900_000_000, 900_000_100):
+        deduplicator.mark(update_id)
+    assert deduplicator.save()
+    assert database.get_update_window('bot')['polling_offset'] == 900_000_100
+
+    restarted = UpdateDeduplicator(database, bits=1024)
+    assert restarted.seen(900_000_050)
+    assert not restarted.seen(123_456_789)
+    restarted.mark(123_456_789)
+    assert restarted.seen(123_456_789)
+    assert not restarted.seen(123_456_790)
+    assert restarted.polling_offset == 123_456_790
+    assert restarted.save()
+    assert database.get_update_window('bot')['polling_offset'] == 123_456_790
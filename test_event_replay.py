@@ -0,0 +1,50 @@
+"""Tests for rebuilding state from the event log (telegramreferralpro/event_replay.py)"""
+
+import sqlite3
+
+import pytest
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.event_replay import EventReplayer
+
+def row_counts(database: Database) -> tuple:
+    with database.get_connection() as conn:
+        return (conn.execute('SELECT COUNT(*) FROM users').fetchone()[0],
+                conn.execute('SELECT COUNT(*) FROM referrals').fetchone()[0])
+
+def pre_event_log_database(tmp_path) -> Database:
+    """Users and a referral written without events, as before the log existed, plus one logged user"""
+    path = str(tmp_path / 'bot.db')
+    database = Database(path)
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO users (user_id, username, referral_code, referred_by) VALUES (?, ?, ?, ?)',
+                     [(1, 'first', 'ref_1', None), (2, 'second', 'ref_2', 1)])
+    conn.execute('INSERT INTO referrals (referrer_id, referred_user_id) VALUES (1, 2)')
+    conn.commit()
+    conn.close()
+    database.add_user(3, 'logged', referral_code='ref_3')
+    database.update_channel_membership(3, True)
+    return database
+
+def test_rebuild_keeps_rows_from_before_the_event_log(tmp_path):
+    database = pre_event_log_database(tmp_path)
+    assert row_counts(database) == (3, 1)
+    EventReplayer(database).rebuild()
+    assert row_counts(database) == (3, 1)
+    assert database.get_user(3)['is_channel_member']
+
+def test_rebuild_from_scratch_refuses_to_drop_unlogged_rows(tmp_path):
+    database = pre_event_log_database(tmp_path)
+    replayer = EventReplayer(database)
+    assert replayer.unlogged_rows() == {'users': 2, 'referrals': 1}
+    with pytest.raises(ValueError):
+        replayer.rebuild(from_scratch=True)
+    assert row_counts(database) == (3, 1)
+
+def test_rebuild_from_scratch_with_a_complete_log(tmp_path):
+    database = Database(str(tmp_path / 'bot.db'))
+    database.add_user(1, 'referrer', referral_code='ref_1')
+    database.add_user(2, 'referred', referral_code='ref_2', referred_by=1)
+    database.add_referral(1, 2)
+    assert EventReplayer(database).rebuild(from_scratch=True)['users'] == 2
+    assert row_counts(database) == (2, 1)
@@ -0,0 +1,67 @@
+"""Tests for the stored channel membership re-check (telegramreferralpro/bot_handlers.py)"""
+
+import asyncio
+import time
+
+from telegramreferralpro.bot_handlers import BotHandlers
+from telegramreferralpro.config import BotConfig
+from telegramreferralpro.database import Database
+from telegramreferralpro.referral_system import ReferralSystem
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+
+class FakeTelegramUtils:
+    def __init__(self, membership):
+        self.bot = FakeBot()
+        self.membership = membership
+        self.checks = 0
+
+    async def get_channel_membership(self, user_id):
+        self.checks += 1
+        return self.membership
+
+    async def check_channel_membership(self, user_id):
+        return await self.get_channel_membership(user_id) is True
+
+def make_handlers(tmp_path, membership, checked_ago, name='bot.db'):
+    database = Database(str(tmp_path / name))
+    database.add_user(1, 'referrer', referral_code='ref_1')
+    database.add_user(2, 'referred', referral_code='ref_2', referred_by=1)
+    database.add_referral(1, 2)
+    database.update_channel_membership(2, True)
+    with database.get_connection() as conn:
+        conn.execute('UPDATE users SET membership_updated_at = ? WHERE user_id = 2', (int(time.time()) - checked_ago,))
+        conn.commit()
+    config = BotConfig(bot_token='123456:TEST', channel_id='-1001', channel_username='test_channel', admin_user_ids=[],
+                       database_path=str(tmp_path / name), job_concurrency=0, membership_recheck_seconds=3600)
+    utils = FakeTelegramUtils(membership)
+    return database, utils, BotHandlers(config, database, ReferralSystem(database), utils)
+
+def test_fresh_flag_is_trusted(tmp_path):
+    """A member confirmed within the TTL is not re-checked"""
+    database, utils, handlers = make_handlers(tmp_path, False, checked_ago=60)
+    assert asyncio.run(handlers._check_membership(database.get_user(2)))
+    assert utils.checks == 0
+
+def test_stale_flag_applies_missed_leave(tmp_path):
+    """A stale member who has left is marked as left and the referrer is told"""
+    database, utils, handlers = make_handlers(tmp_path, False, checked_ago=7200)
+    assert not asyncio.run(handlers._check_membership(database.get_user(2)))
+    assert utils.checks == 1
+    assert not database.get_user(2)['is_channel_member']
+    assert utils.bot.sent == [1]
+
+def test_stale_flag_refreshed_when_still_member(tmp_path):
+    """A confirmed member gets a fresh timestamp; an unreachable API keeps the stored flag"""
+    database, utils, handlers = make_handlers(tmp_path, True, checked_ago=7200)
+    assert asyncio.run(handlers._check_membership(database.get_user(2)))
+    assert time.time() - database.get_user(2)['membership_updated_at'] < 60
+
+    database, utils, handlers = make_handlers(tmp_path, None, checked_ago=7200, name='down.db')
+    assert asyncio.run(handlers._check_membership(database.get_user(2)))
+    assert database.get_user(2)['is_channel_member']
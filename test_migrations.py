@@ -0,0 +1,20 @@
+"""Tests for schema migrations and backfills (telegramreferralpro/migrations.py)"""
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.migrations import FIRST_POSITION, MigrationRunner
+
+def test_unknown_backfill_does_not_block_later_ones(tmp_path):
+    """A backfill left by a newer bot version is skipped, and the ones after it still run"""
+    database = Database(str(tmp_path / 'bot.db'))
+    database.add_user(1, 'member', referral_code='ref_1')
+    with database.get_connection() as conn:
+        conn.execute('DELETE FROM schema_backfills')
+        conn.executemany('INSERT INTO schema_backfills (name, position) VALUES (?, ?)',
+                         [('from_a_newer_version', FIRST_POSITION), ('channel_joined_at', FIRST_POSITION)])
+        conn.commit()
+
+    runner = MigrationRunner(database)
+    for _ in range(100):
+        if not runner.run_backfill_chunk():
+            break
+    assert runner.pending_backfills() == ['from_a_newer_version']
@@ -0,0 +1,43 @@
+"""Tests for channel join handling (telegramreferralpro/referral_system.py)"""
+
+import time
+
+from telegramreferralpro.database import Database
+from telegramreferralpro.referral_system import ReferralSystem
+
+def joined_events(database: Database, user_id: int) -> int:
+    with database.get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM channel_events WHERE user_id = ? AND event_type = 'joined'",
+                            (user_id,)).fetchone()[0]
+
+def make_referral(tmp_path):
+    database = Database(str(tmp_path / 'bot.db'))
+    database.add_user(1, 'referrer', referral_code='ref_1')
+    database.add_user(2, 'referred', referral_code='ref_2', referred_by=1)
+    database.add_referral(1, 2)
+    return database, ReferralSystem(database)
+
+def test_join_after_membership_check_is_first_join(tmp_path):
+    """A /start or "check" that set the flag before the chat_member update must not swallow the join"""
+    database, referral_system = make_referral(tmp_path)
+    joined_at = int(time.time()) - 5
+    database.update_channel_membership(2, True)
+
+    assert referral_system.handle_user_joined_channel(2, joined_at) == (True, 1)
+    assert joined_events(database, 2) == 1
+    assert database.get_user(2)['is_channel_member']
+
+    # The same join delivered again
+    assert referral_system.handle_user_joined_channel(2, joined_at) == (False, None)
+    assert joined_events(database, 2) == 1
+
+def test_rejoin_is_logged_but_not_welcomed_again(tmp_path):
+    """A rejoin changes the membership and is counted, without a second welcome"""
+    database, referral_system = make_referral(tmp_path)
+    now = int(time.time())
+    assert referral_system.handle_user_joined_channel(2, now - 30) == (True, 1)
+    assert referral_system.handle_user_left_channel(2, now - 20) == [1]
+    assert referral_system.handle_user_joined_channel(2, now - 10) == (False, None)
+    assert joined_events(database, 2) == 2
+    assert database.get_user(2)['is_channel_member']
+    assert database.get_referral_stats(1) == (0, 1)
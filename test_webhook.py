@@ -0,0 +1,58 @@
+"""Tests for webhook update ingestion (telegramreferralpro/webhook.py)"""
+
+import asyncio
+
+from telegramreferralpro.webhook import SpillBuffer, UpdateIngestor
+
+def message_update(update_id: int, user_id: int) -> dict:
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': 'hi',
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'},
+    }}
+
+class FakeApplication:
+    bot = None
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.processed = []
+
+    async def process_update(self, update) -> None:
+        await asyncio.sleep(self.delay)
+        self.processed.append(update.update_id)
+
+async def offer_and_stop(application, spill_path, updates, timeout) -> UpdateIngestor:
+    ingestor = UpdateIngestor(application, queue_size=100, concurrency=2, spill_path=spill_path)
+    await ingestor.start()
+    for data in updates:
+        assert ingestor.offer(data)
+    await asyncio.sleep(0.05)
+    await ingestor.stop(timeout=timeout)
+    return ingestor
+
+def test_stop_lets_lanes_finish(tmp_path):
+    """Updates acknowledged before shutdown are processed while the lanes finish in time"""
+    application = FakeApplication(delay=0.01)
+    updates = [message_update(update_id, user_id=update_id % 3) for update_id in range(1, 21)]
+    asyncio.run(offer_and_stop(application, str(tmp_path / 'spill.db'), updates, timeout=5))
+    assert sorted(application.processed) == list(range(1, 21))
+    assert SpillBuffer(str(tmp_path / 'spill.db')).count == 0
+
+def test_stop_keeps_unfinished_updates_for_next_start(tmp_path):
+    """What the lanes could not finish goes back into the spill buffer in arrival order"""
+    spill_path = str(tmp_path / 'spill.db')
+    spill = SpillBuffer(spill_path)
+    spill.push(message_update(100, user_id=1))
+    spill.close()
+
+    application = FakeApplication(delay=60)
+    updates = [message_update(update_id, user_id=1) for update_id in range(1, 6)]
+    asyncio.run(offer_and_stop(application, spill_path, updates, timeout=0.1))
+    assert application.processed == []
+
+    assert SpillBuffer(spill_path).count == 6
+
+    application = FakeApplication(delay=0)
+    asyncio.run(offer_and_stop(application, spill_path, [message_update(6, user_id=1)], timeout=5))
+    assert application.processed == [100, 1, 2, 3, 4, 5, 6]